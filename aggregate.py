@@ -0,0 +1,302 @@
+import sys
+import argparse
+from collections import Counter
+import numpy as np
+from query import connect_to_elasticsearch, build_query, ES_INDEX
+from analytics import SUMMARY_PERCENTILES, print_header, print_count_table, print_number_summary, print_utilization
+from histogram import print_time_span_values, print_bins
+from profiling import span, setup_from_argv
+
+"""
+Cluster reports computed by Elasticsearch
+
+Instead of downloading every job of a cluster (query.py) and reducing the jobs
+locally, this script asks Elasticsearch for the aggregates the reports are
+built from and prints them with the same layouts as analytics.py and
+histogram.py. Only the aggregation results cross the network, a few kilobytes
+whatever the size of the cluster, and no CSV is written.
+
+    analytics: one request with "terms" on the requested resources, "percentiles"
+               and "extended_stats" on the used memory and disk, and the same on the
+               per-job efficiencies, computed by a script on each job
+    histogram: one request for the runtime percentiles and the time span, and one
+               "range" request for the job count and median runtime of every bin
+
+Counts, averages, minima, maxima and standard deviations are exact. Percentiles
+and medians come from the t-digest Elasticsearch uses and are approximate for
+large clusters, like the --stream mode of the reports. The list of fast job IDs
+(histogram.py printList) needs the jobs themselves and is not available here.
+
+Usage:
+    aggregate.py <ClusterId> [User] [--report analytics|histogram|all] [--percentiles N]
+"""
+
+REPORTS = ["analytics", "histogram", "all"]
+
+# buckets of a "terms" aggregation, more than the distinct requests of any cluster
+TERMS_SIZE = 10000
+
+# per-job efficiencies, in % (the same formulas as analytics.job_metrics)
+SCRIPTS = {
+    "mem_eff": "doc['ResidentSetSize_RAW'].value / 1048576.0 / "
+               "(Math.round(doc['RequestMemory'].value / 1024.0 * 100) / 100.0) * 100",
+    "disk_eff": "doc['DiskUsage_RAW'].value / 1048576.0 / "
+                "(Math.round(doc['RequestDisk'].value / 1048576.0 * 100) / 100.0) * 100",
+    "cpu_eff": "(doc['RemoteSysCpu'].size() == 0 ? 0.0 : doc['RemoteSysCpu'].value) / "
+               "doc['RequestCpus'].value / doc['RemoteWallClockTime'].value * 100",
+}
+
+# requested resource -> (table name, unit, conversion of the requested value)
+REQUESTS = {
+    "RequestMemory": ("Memory (GiB)", "GiB", lambda v: round(v / 1024, 2)),      # Convert MiB to GiB
+    "RequestDisk": ("Disk (GiB)", "GiB", lambda v: round(v / (1024 * 1024), 2)),  # Convert KiB to GiB
+    "RequestCpus": ("CPUs", "", int),
+    "RequestGpus": ("GPUs", "", int),
+}
+
+
+# filter on jobs where every field is present and non-zero (zero counts as "not reported")
+def reported(*fields):
+    return {
+        "bool": {
+            "filter": [{"exists": {"field": field}} for field in fields],
+            "must_not": [{"term": {field: 0}} for field in fields],
+        }
+    }
+
+# metric source of an aggregation: a field, or one of SCRIPTS
+def metric_source(name):
+    return {"script": {"source": SCRIPTS[name], "lang": "painless"}} if name in SCRIPTS else {"field": name}
+
+# "filter" aggregation holding the number summary (percentiles and extended_stats) of a value
+def usage_aggregation(job_filter, name, percents=SUMMARY_PERCENTILES):
+    source = metric_source(name)
+    return {
+        "filter": job_filter,
+        "aggs": {
+            "percentiles": {"percentiles": dict(source, percents=list(percents), keyed=False)},
+            "stats": {"extended_stats": dict(source)},
+        },
+    }
+
+
+"""
+Builds the aggregation request of the analytics report.
+
+    Parameters:
+        cluster_id (int): ClusterId of the jobs.
+        user (str or None): Only count the jobs of this Owner.
+
+    Returns:
+        dict: Search body with size 0 and the aggregations read by analytics_summary().
+"""
+def analytics_request(cluster_id, user=None):
+    aggs = {
+        "runtime": {"filter": reported("RemoteWallClockTime"),
+                    "aggs": {"avg": {"avg": {"field": "RemoteWallClockTime"}}}},
+        "mem_used": usage_aggregation(reported("ResidentSetSize_RAW"), "ResidentSetSize_RAW"),
+        "disk_used": usage_aggregation(reported("DiskUsage_RAW"), "DiskUsage_RAW"),
+        # jobs whose request rounds to 0 GiB have no efficiency, as in analytics.py
+        "mem_eff": usage_aggregation(
+            {"bool": {"filter": [reported("RequestMemory", "ResidentSetSize_RAW"),
+                                 {"range": {"RequestMemory": {"gte": 5.12}}}]}},
+            "mem_eff", [50]),
+        "disk_eff": usage_aggregation(
+            {"bool": {"filter": [reported("RequestDisk", "DiskUsage_RAW"),
+                                 {"range": {"RequestDisk": {"gte": 5242.88}}}]}},
+            "disk_eff", [50]),
+        "cpu_eff": usage_aggregation(
+            {"bool": {"filter": [reported("RemoteWallClockTime", "RequestCpus")],
+                      "should": [reported("RemoteUserCpu"), reported("RemoteSysCpu")],
+                      "minimum_should_match": 1}},
+            "cpu_eff"),
+    }
+    for field in REQUESTS:
+        aggs[field] = {"filter": reported(field),
+                       "aggs": {"values": {"terms": {"field": field, "size": TERMS_SIZE}}}}
+
+    body = build_query(cluster_id, user)
+    body.update(size=0, track_total_hits=True, aggs=aggs)
+    return body
+
+# number of jobs that matched a search
+def total_hits(response):
+    total = response["hits"]["total"]
+    return total["value"] if isinstance(total, dict) else total
+
+# {percent: value} of a percentiles aggregation requested with keyed=False
+def percentile_values(aggregation):
+    return {entry["key"]: entry["value"] for entry in aggregation["values"]}
+
+# (min, Q1, median, Q3, max, stddev) of a usage aggregation in the given unit, or None for fewer than 2 values
+def usage_stats(aggregation, scale=1.0):
+    count = aggregation["doc_count"]
+    if count < 2:
+        return None
+    values = percentile_values(aggregation["percentiles"])
+    quantiles = [values[float(q)] * scale for q in SUMMARY_PERCENTILES]
+    # Elasticsearch gives the population variance, the report shows the sample standard deviation
+    std_dev = np.sqrt(aggregation["stats"]["variance"] * count / (count - 1)) * scale
+    return tuple(quantiles) + (float(std_dev),)
+
+# median of a usage aggregation, 0 if no job reported it
+def median_or_zero(aggregation):
+    if not aggregation["doc_count"]:
+        return 0
+    return percentile_values(aggregation["percentiles"])[50.0]
+
+
+"""
+Reads the analytics report out of the response to analytics_request().
+
+    Returns:
+        dict: total_jobs, avg_runtime, a Counter of jobs per requested value for every
+              resource in REQUESTS, the number summaries of the used memory, disk and
+              CPU, and the median efficiencies.
+"""
+def analytics_summary(response):
+    aggs = response["aggregations"]
+    runtime = aggs["runtime"]["avg"]["value"]
+
+    requests = {}
+    for field, (_, _, convert) in REQUESTS.items():
+        terms = aggs[field]["values"]
+        if terms.get("sum_other_doc_count"):
+            print(f"[WARN] {field} has more than {TERMS_SIZE} distinct values; the rest are not shown")
+        counts = Counter()
+        for bucket in terms["buckets"]:
+            counts[convert(bucket["key"])] += bucket["doc_count"]
+        requests[field] = counts
+
+    return {
+        "total_jobs": total_hits(response),
+        "avg_runtime": runtime or 0,
+        "requests": requests,
+        "mem_stats": usage_stats(aggs["mem_used"], 1 / (1024 * 1024)),   # Convert KiB to GiB
+        "disk_stats": usage_stats(aggs["disk_used"], 1 / (1024 * 1024)),  # Convert KiB to GiB
+        "cpu_stats": usage_stats(aggs["cpu_eff"]),
+        "mem_eff": median_or_zero(aggs["mem_eff"]),
+        "disk_eff": median_or_zero(aggs["disk_eff"]),
+        "cpu_eff": median_or_zero(aggs["cpu_eff"]),
+    }
+
+# prints the analytics report of a summary from analytics_summary()
+def print_analytics(cluster_id, summary):
+    print_header(cluster_id, summary["total_jobs"], summary["avg_runtime"])
+    for field, (name, unit, _) in REQUESTS.items():
+        print_count_table(name, summary["requests"][field], unit)
+    print_number_summary(summary["mem_stats"], summary["disk_stats"], summary["cpu_stats"])
+    print_utilization(summary["mem_eff"], summary["disk_eff"], summary["cpu_eff"])
+
+
+"""
+Builds the first histogram request: the runtime percentiles and the time span.
+
+    Parameters:
+        cluster_id (int): ClusterId of the jobs.
+        user (str or None): Only count the jobs of this Owner.
+        percentiles (int): Number of bins.
+
+    Returns:
+        dict: Search body with size 0.
+"""
+def histogram_edges_request(cluster_id, user=None, percentiles=10):
+    body = build_query(cluster_id, user)
+    body.update(size=0, aggs={
+        "runtimes": {
+            "filter": {"exists": {"field": "RemoteWallClockTime"}},
+            "aggs": {"edges": {"percentiles": {"field": "RemoteWallClockTime", "keyed": False,
+                                               "percents": np.linspace(0, 100, percentiles + 1).tolist()}}},
+        },
+        "first_submit": {"min": {"field": "QDate"}},
+        "last_completion": {"max": {"field": "CompletionDate"}},
+    })
+    return body
+
+"""
+Builds the second histogram request: the job count and median runtime between the edges.
+Like histogram.percentile_bins(), the first bin also holds the runtimes below the first
+edge and the last bin those from the last edge up.
+"""
+def histogram_bins_request(cluster_id, edges, user=None):
+    ranges = [{"from": left, "to": right} for left, right in zip(edges[:-1], edges[1:])]
+    del ranges[0]["from"]
+    del ranges[-1]["to"]
+
+    body = build_query(cluster_id, user)
+    body.update(size=0, aggs={
+        "runtimes": {
+            "filter": {"exists": {"field": "RemoteWallClockTime"}},
+            "aggs": {"bins": {
+                "range": {"field": "RemoteWallClockTime", "ranges": ranges},
+                "aggs": {"median": {"percentiles": {"field": "RemoteWallClockTime",
+                                                    "percents": [50], "keyed": False}}},
+            }},
+        },
+    })
+    return body
+
+# prints the histogram report from two aggregation requests
+def print_histogram(es, cluster_id, user=None, percentiles=10, max_width=20):
+    with span("aggregate: edges"):
+        response = es.search(index=ES_INDEX, body=histogram_edges_request(cluster_id, user, percentiles))
+    aggs = response["aggregations"]
+    if not aggs["runtimes"]["doc_count"]:
+        print("[WARN] No valid data to plot.")
+        return
+
+    percentiles_list = np.linspace(0, 100, percentiles + 1)
+    values = percentile_values(aggs["runtimes"]["edges"])
+    edges = np.array([values[p] for p in percentiles_list.tolist()])
+
+    with span("aggregate: bins"):
+        response = es.search(index=ES_INDEX, body=histogram_bins_request(cluster_id, edges.tolist(), user))
+    buckets = response["aggregations"]["runtimes"]["bins"]["buckets"]
+    counts = np.array([bucket["doc_count"] for bucket in buckets])
+    medians = np.array([percentile_values(bucket["median"])[50.0] if bucket["doc_count"] else 0
+                        for bucket in buckets])
+
+    with span("render"):
+        print("\nHistogram of Job Runtimes by Percentiles:\n")
+        print(f"ClusterId: {cluster_id}\n")
+        print_time_span_values(aggs["first_submit"]["value"], aggs["last_completion"]["value"])
+        print_bins({"percentiles": percentiles_list, "edges": edges, "counts": counts, "medians": medians},
+                   max_width)
+
+# parses the command line arguments
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Print the analytics and histogram reports of a cluster from Elasticsearch aggregations.")
+    parser.add_argument("cluster_id", type=int, help="ClusterId to report on")
+    parser.add_argument("user", nargs="?", help="only count jobs owned by this user")
+    parser.add_argument("--report", choices=REPORTS, default="all", help="report to print (default: all)")
+    parser.add_argument("--percentiles", type=int, default=10, help="histogram bins (default: 10)")
+    args = parser.parse_args(argv)
+    if args.percentiles < 1:
+        parser.error("--percentiles must be at least 1")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    with span("connect"):
+        es = connect_to_elasticsearch()
+
+    if args.report in ("histogram", "all"):
+        print_histogram(es, args.cluster_id, args.user, args.percentiles)
+        if args.report == "all":
+            print()
+
+    if args.report in ("analytics", "all"):
+        with span("aggregate: analytics"):
+            response = es.search(index=ES_INDEX, body=analytics_request(args.cluster_id, args.user))
+        summary = analytics_summary(response)
+        if not summary["total_jobs"]:
+            print(f"No jobs found for ClusterId {args.cluster_id}")
+            sys.exit(1)
+        with span("render"):
+            print_analytics(args.cluster_id, summary)
+
+if __name__ == "__main__":
+    setup_from_argv()
+    main()
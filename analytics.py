@@ -1,41 +1,71 @@
 import os
 import sys
-import csv
-import statistics
+from profiling import span, setup_from_argv
+from daemon import serve_from_daemon
+
+# run as a script, hand the report to the daemon (see daemon.py) before the
+# statistics modules below are imported; they are not needed when it answers
+if __name__ == "__main__":
+    setup_from_argv()
+    serve_from_daemon("analytics")
+
 from collections import Counter
 from datetime import timedelta
-from utils import safe_float
+import numpy as np
+from utils import REPORT_COLUMNS, sample_csv_path
+from jobcache import float_column, iter_column_chunks, CHUNK_SIZE
+from jobtable import load_table
+from store import load_report_table, store_filters_from_argv
+from sketch import KLLSketch, RunningStats, DEFAULT_K
+from sampling import (read_sample_info, describe_sample, bootstrap_percentiles,
+                      bootstrap_mean, print_estimates)
 
 """
 This program provides a report on the resource request and usage for a cluster
 
+The report is computed on whole columns with NumPy. Every per-job efficiency is
+taken from the same job's used and requested values; jobs missing either value
+are masked out instead of shifting the pairing.
+
+With --stream the CSV is read in chunks and folded into a SummarySketch (KLL
+quantile sketches, running mean/stddev and counters), so memory stays bounded
+for clusters of any size. Quantiles in that mode are approximate: their rank is
+within about 1% of the exact one (see sketch.py); counts, means, standard
+deviations, minima and maxima are exact.
+
+With --sample the report is computed on the random sample written by
+"query.py <ClusterId> --sample N", and is followed by the estimated mean runtime,
+usage quartiles and median efficiencies with bootstrap confidence intervals
+(see sampling.py), which say how far the sample can be trusted for the cluster.
+
 """
 
+# columns of the cluster CSV that the report reads
+COLUMNS = REPORT_COLUMNS["analytics"]
+
+# quantiles of the number summary table: min, Q1, median, Q3, max
+SUMMARY_PERCENTILES = [0, 25, 50, 75, 100]
+
 
 # to print the bar visualizations
 def bar(pct, width=50):
     filled = int(pct / 100 * width)
     return "[" + "█" * filled + " " * (width - filled) + f"] {pct:.1f}%"
 
-# to calculate efficiency
-def efficiency(used, expected):
-    if not expected:
-        return 0.0
-    return (used / expected) * 100
-
-# to print the usage report
-def compute_usage_summary(data, label, percentage=False, unit=None):
-    if not data or len(data) < 2:
+# min, Q1, median, Q3, max and standard deviation of the data, or None for fewer than 2 values
+# ("weibull" gives the same quartiles as statistics.quantiles' default exclusive method)
+def usage_stats(data):
+    if data is None or len(data) < 2:
+        return None
+    quantiles = np.percentile(data, SUMMARY_PERCENTILES, method="weibull")
+    return tuple(quantiles.tolist()) + (float(np.std(data, ddof=1)),)
+
+# formats one row of the number summary table
+def format_usage_row(label, stats, percentage=False):
+    if stats is None:
         return f"{label:<25}: Not enough data"
 
-    data_sorted = sorted(data)
-    min_val = data_sorted[0]
-    q1 = statistics.quantiles(data_sorted, n=4)[0]
-    median = statistics.median(data_sorted)
-    q3 = statistics.quantiles(data_sorted, n=4)[2]
-    max_val = data_sorted[-1]
-    std_dev = statistics.stdev(data_sorted)
-
+    min_val, q1, median, q3, max_val, std_dev = stats
     fmt = "{:.1f}%%" if percentage else "{:.1f}"
     return (
         f"{label:<25}: "
@@ -43,102 +73,248 @@ def compute_usage_summary(data, label, percentage=False, unit=None):
         f"{fmt.format(q3):>6}  {fmt.format(max_val):>6}   {fmt.format(std_dev):>6}"
     )
 
+# to print the usage report
+def compute_usage_summary(data, label, percentage=False, unit=None):
+    return format_usage_row(label, usage_stats(data), percentage)
+
 # prints the resource request table
 def print_resource_table(name, values, unit=""):
-    if not values:
+    keys, counts = np.unique(values, return_counts=True)
+    print_count_table(name, Counter(dict(zip(keys.tolist(), counts.tolist()))), unit)
+
+# prints the resource request table from a Counter of value -> jobs
+def print_count_table(name, counts, unit=""):
+    if not counts:
         print(f"{name:<15}: No data")
         return
 
-    counts = Counter(values)
     print(f"{name:<15}:")
     for val, count in sorted(counts.items()):
         print(f"{'':<15}  {val:<10} {unit:<5}  {count} job(s)")
     print()
 
-# prints the total report
-def summarize(cluster_id):
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(script_dir, "cluster_data")
-    filepath = os.path.join(data_dir, f"cluster_{cluster_id}_jobs.csv")
+# True where a value is present and non-zero (zero counts as "not reported")
+def reported(values):
+    return np.isfinite(values) & (values != 0)
 
-    if not os.path.exists(filepath):
-        print(f"File not found: {filepath}")
-        sys.exit(1)
+# median of the values, 0 if there are none
+def median_or_zero(values):
+    return float(np.median(values)) if len(values) else 0
+
+
+"""
+Computes the per-job values the report is built from.
+
+    Parameters:
+        columns (JobTable or Dict[str, np.ndarray]): Typed columns (see jobtable.load_table).
+        rows (int): Number of jobs.
+
+    Returns:
+        Dict[str, np.ndarray]: One array per quantity, holding only the jobs that reported it:
+            requested resources (mem_requested, disk_requested, cpu_requests, gpu_requests),
+            used resources (mem_used, disk_used), runtimes, and the per-job efficiencies in %
+            (mem_eff, disk_eff, cpu_eff).
+"""
+def job_metrics(columns, rows):
+    col = lambda name: float_column(columns, name, rows)
+
+    mem_req, mem_use = col("RequestMemory"), col("ResidentSetSize_RAW")
+    disk_req, disk_use = col("RequestDisk"), col("DiskUsage_RAW")
+    cpus, gpus = col("RequestCpus"), col("RequestGpus")
+    user_cpu = np.nan_to_num(col("RemoteUserCpu"))
+    sys_cpu = np.nan_to_num(col("RemoteSysCpu"))
+    wall_time = col("RemoteWallClockTime")
+
+    mem_requested = np.round(mem_req / 1024, 2)           # Convert MiB to GiB
+    mem_used = mem_use / 1024 / 1024                      # Convert KiB to GiB
+    disk_requested = np.round(disk_req / (1024 * 1024), 2)  # Convert KiB to GiB
+    disk_used = disk_use / (1024 * 1024)                  # Convert KiB to GiB
+
+    has_mem_req, has_mem_use = reported(mem_req), reported(mem_use)
+    has_disk_req, has_disk_use = reported(disk_req), reported(disk_use)
+    has_cpus, has_wall = reported(cpus), reported(wall_time)
+    has_cpu_time = has_wall & has_cpus & ((user_cpu != 0) | (sys_cpu != 0))
+
+    # Compute per-job efficiencies, masking jobs that lack either value
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cpu_eff = np.ma.masked_where(~has_cpu_time, sys_cpu / cpus / wall_time * 100)
+        mem_eff = np.ma.masked_where(~(has_mem_req & has_mem_use & (mem_requested != 0)),
+                                     mem_used / mem_requested * 100)
+        disk_eff = np.ma.masked_where(~(has_disk_req & has_disk_use & (disk_requested != 0)),
+                                      disk_used / disk_requested * 100)
+
+    return {
+        "mem_requested": mem_requested[has_mem_req],
+        "disk_requested": disk_requested[has_disk_req],
+        "cpu_requests": cpus[has_cpus].astype(np.int64),
+        "gpu_requests": gpus[reported(gpus)].astype(np.int64),
+        "mem_used": mem_used[has_mem_use],
+        "disk_used": disk_used[has_disk_use],
+        "runtimes": wall_time[has_wall],
+        "mem_eff": mem_eff.compressed(),
+        "disk_eff": disk_eff.compressed(),
+        "cpu_eff": cpu_eff.compressed(),
+    }
+
+
+"""
+Computes the quantities shown in the report from the job columns.
+
+    Parameters:
+        columns (JobTable or Dict[str, np.ndarray]): Typed columns (see jobtable.load_table).
+        rows (int): Number of jobs.
+
+    Returns:
+        dict: Requested values per resource (one entry per job that reported it),
+              used values and per-job CPU usage for the number summary table,
+              median per-job efficiencies, the job count and the mean runtime.
+"""
+def compute_summary(columns, rows, metrics=None):
+    metrics = job_metrics(columns, rows) if metrics is None else metrics
+    runtimes = metrics["runtimes"]
+
+    return {
+        "total_jobs": rows,
+        "avg_runtime": float(np.mean(runtimes)) if len(runtimes) else 0,
+        "mem_requested": metrics["mem_requested"],
+        "disk_requested": metrics["disk_requested"],
+        "cpu_requests": metrics["cpu_requests"],
+        "gpu_requests": metrics["gpu_requests"],
+        "mem_used": metrics["mem_used"],
+        "disk_used": metrics["disk_used"],
+        "cpu_usage": metrics["cpu_eff"],
+        # Take medians
+        "mem_eff": median_or_zero(metrics["mem_eff"]),
+        "disk_eff": median_or_zero(metrics["disk_eff"]),
+        "cpu_eff": median_or_zero(metrics["cpu_eff"]),
+    }
+
+
+"""
+Bootstraps the estimates of the sampled report.
+
+    Parameters:
+        metrics (Dict[str, np.ndarray]): Output of job_metrics() for the sampled jobs.
+
+    Returns:
+        List[Tuple[str, float, float, float, Callable]]: Rows for sampling.print_estimates().
+"""
+def sample_estimates(metrics):
+    estimates = [("Avg Runtime",) + bootstrap_mean(metrics["runtimes"])
+                 + (lambda v: str(timedelta(seconds=int(v))),)]
+
+    for name, label, unit in (("mem_used", "Memory Used", "GiB"), ("disk_used", "Disk Used", "GiB"),
+                              ("cpu_eff", "CPU Usage", "%")):
+        # same quartiles as usage_stats()
+        values, low, high = bootstrap_percentiles(metrics[name], [25, 50, 75], method="weibull")
+        for i, quartile in enumerate(("Q1", "Median", "Q3")):
+            estimates.append((f"{label} {quartile} ({unit})", values[i], low[i], high[i], "{:.1f}".format))
 
-    with open(filepath, newline='', encoding='utf-8') as f:
-        jobs = list(csv.DictReader(f))
-
-    mem_requested, mem_used = [], []
-    disk_requested, disk_used = [], []
-    run_time, cpu_used_time = [], []
-    runtimes = []
-    cpu_requests = []
-    gpu_requests = []
-
-    for job in jobs:
-        mem_req = safe_float(job.get("RequestMemory"))
-        mem_use = safe_float(job.get("ResidentSetSize_RAW"))
-        if mem_req:
-            mem_requested.append(round(mem_req / 1024, 2))  # Convert MiB to GiB
-        if mem_use:
-            mem_used.append(mem_use / 1024 / 1024)  # Convert KiB to GiB
-
-        disk_req = safe_float(job.get("RequestDisk"))
-        disk_use = safe_float(job.get("DiskUsage_RAW"))
-        if disk_req:
-            disk_requested.append(round(disk_req / (1024 * 1024), 2))  # Convert KiB to GiB
-        if disk_use:
-            disk_used.append(disk_use / (1024 * 1024))  # Convert KiB to GiB
-
-        cpus = safe_float(job.get("RequestCpus"))
-        if cpus:
-            cpu_requests.append(int(cpus))
-
-        gpus = safe_float(job.get("RequestGpus"))
-        if gpus:
-            gpu_requests.append(int(gpus))
-
-        user_cpu = safe_float(job.get("RemoteUserCpu")) or 0
-        sys_cpu = safe_float(job.get("RemoteSysCpu")) or 0
-        wall_time = safe_float(job.get("RemoteWallClockTime"))
-
-        if wall_time and cpus and (user_cpu or sys_cpu):
-            total_cpu_used = sys_cpu / cpus
-            cpu_used_time.append(total_cpu_used)
-            run_time.append(wall_time)
-
-        if wall_time:
-            runtimes.append(wall_time)
-
-    from statistics import median
-
-    # Compute per-job efficiency lists
-    per_job_cpu_eff = [
-        efficiency(cpu_used_time[i], run_time[i])
-        for i in range(len(cpu_used_time))
-        if run_time[i]
-    ]
-
-    per_job_mem_eff = [
-        efficiency(mem_used[i], mem_requested[i])
-        for i in range(min(len(mem_used), len(mem_requested)))
-        if mem_requested[i]
-    ]
-
-    per_job_disk_eff = [
-        efficiency(disk_used[i], disk_requested[i])
-        for i in range(min(len(disk_used), len(disk_requested)))
-        if disk_requested[i]
-    ]
-
-    # Take medians
-    avg_cpu_eff = median(per_job_cpu_eff) if per_job_cpu_eff else 0
-    avg_mem_eff = median(per_job_mem_eff) if per_job_mem_eff else 0
-    avg_disk_eff = median(per_job_disk_eff) if per_job_disk_eff else 0
-
-    
-    total_jobs = len(jobs)
-    avg_runtime = statistics.mean(runtimes) if runtimes else 0
+    # the median CPU usage is already in the quartiles above
+    for name, label in (("mem_eff", "Memory"), ("disk_eff", "Disk")):
+        values, low, high = bootstrap_percentiles(metrics[name], [50])
+        estimates.append((f"{label} Usage, median (%)", values[0], low[0], high[0], "{:.1f}%".format))
+    return estimates
+
+
+"""
+Mergeable summary of the report, built from chunks of jobs in bounded memory.
+Used values and efficiencies go into KLL quantile sketches, used values and
+runtimes into running mean/stddev, and requested values into counters.
+
+    Parameters:
+        k (int): Accuracy parameter of the quantile sketches (see sketch.KLLSketch).
+"""
+class SummarySketch:
+    USAGE = ("mem_used", "disk_used", "cpu_eff")
+    EFFICIENCY = ("mem_eff", "disk_eff", "cpu_eff")
+    REQUESTS = ("mem_requested", "disk_requested", "cpu_requests", "gpu_requests")
+
+    def __init__(self, k=DEFAULT_K):
+        self.total_jobs = 0
+        self.runtime = RunningStats()
+        self.quantiles = {name: KLLSketch(k) for name in dict.fromkeys(self.USAGE + self.EFFICIENCY)}
+        self.stats = {name: RunningStats() for name in self.USAGE}
+        self.requests = {name: Counter() for name in self.REQUESTS}
+
+    # adds a chunk of jobs, given as the output of job_metrics()
+    def update(self, metrics, rows):
+        self.total_jobs += rows
+        self.runtime.update(metrics["runtimes"])
+        for name, sketch in self.quantiles.items():
+            sketch.update(metrics[name])
+        for name, stats in self.stats.items():
+            stats.update(metrics[name])
+        for name, counter in self.requests.items():
+            keys, counts = np.unique(metrics[name], return_counts=True)
+            counter.update(dict(zip(keys.tolist(), counts.tolist())))
+
+    def merge(self, other):
+        self.total_jobs += other.total_jobs
+        self.runtime.merge(other.runtime)
+        for name, sketch in self.quantiles.items():
+            sketch.merge(other.quantiles[name])
+        for name, stats in self.stats.items():
+            stats.merge(other.stats[name])
+        for name, counter in self.requests.items():
+            counter.update(other.requests[name])
+        return self
+
+    # plain-dict form of the sketch, for saving as JSON
+    def to_dict(self):
+        return {
+            "total_jobs": self.total_jobs,
+            "runtime": self.runtime.to_dict(),
+            "quantiles": {name: sketch.to_dict() for name, sketch in self.quantiles.items()},
+            "stats": {name: stats.to_dict() for name, stats in self.stats.items()},
+            "requests": {name: sorted(counter.items()) for name, counter in self.requests.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls()
+        summary.total_jobs = data["total_jobs"]
+        summary.runtime = RunningStats.from_dict(data["runtime"])
+        summary.quantiles = {name: KLLSketch.from_dict(sketch) for name, sketch in data["quantiles"].items()}
+        summary.stats = {name: RunningStats.from_dict(stats) for name, stats in data["stats"].items()}
+        summary.requests = {name: Counter(dict((value, count) for value, count in pairs))
+                            for name, pairs in data["requests"].items()}
+        return summary
+
+    # (min, Q1, median, Q3, max, stddev) of a used value, or None for fewer than 2 values
+    def usage_stats(self, name):
+        stats = self.stats[name]
+        if stats.count < 2:
+            return None
+        quantiles = self.quantiles[name].quantiles([q / 100 for q in SUMMARY_PERCENTILES])
+        return tuple(quantiles.tolist()) + (stats.std(),)
+
+    # median per-job efficiency, 0 if no job reported it
+    def median_efficiency(self, name):
+        sketch = self.quantiles[name]
+        return sketch.quantile(0.5) if sketch.count else 0
+
+    # prints the report with the sketched statistics
+    def print_report(self, cluster_id):
+        print_header(cluster_id, self.total_jobs, self.runtime.mean if self.runtime.count else 0)
+        print_count_table("Memory (GiB)", self.requests["mem_requested"], "GiB")
+        print_count_table("Disk (GiB)", self.requests["disk_requested"], "GiB")
+        print_count_table("CPUs", self.requests["cpu_requests"], "")
+        print_count_table("GPUs", self.requests["gpu_requests"], "")
+
+        print_number_summary(
+            self.usage_stats("mem_used"),
+            self.usage_stats("disk_used"),
+            self.usage_stats("cpu_eff"),
+        )
+        print_utilization(
+            self.median_efficiency("mem_eff"),
+            self.median_efficiency("disk_eff"),
+            self.median_efficiency("cpu_eff"),
+        )
+
+# prints the title block and the requested resources heading
+def print_header(cluster_id, total_jobs, avg_runtime):
     avg_runtime_str = str(timedelta(seconds=int(avg_runtime))) if avg_runtime else "N/A"
 
     print("=" * 80)
@@ -151,34 +327,37 @@ def summarize(cluster_id):
 
     print(f"{'Requested Resources':^80}")
     print("=" * 80)
-    print_resource_table("Memory (GiB)", mem_requested, "GiB")
-    print_resource_table("Disk (GiB)", disk_requested, "GiB")
-    print_resource_table("CPUs", cpu_requests, "")
-    print_resource_table("GPUs", gpu_requests, "")
 
+# prints the report for a computed summary
+def print_summary(cluster_id, summary):
+    print_header(cluster_id, summary["total_jobs"], summary["avg_runtime"])
+    print_resource_table("Memory (GiB)", summary["mem_requested"], "GiB")
+    print_resource_table("Disk (GiB)", summary["disk_requested"], "GiB")
+    print_resource_table("CPUs", summary["cpu_requests"], "")
+    print_resource_table("GPUs", summary["gpu_requests"], "")
+
+    print_number_summary(
+        usage_stats(summary["mem_used"]),
+        usage_stats(summary["disk_used"]),
+        usage_stats(summary["cpu_usage"]),
+    )
+    print_utilization(summary["mem_eff"], summary["disk_eff"], summary["cpu_eff"])
+
+# prints the number summary table from (min, Q1, median, Q3, max, stddev) tuples
+def print_number_summary(mem_stats, disk_stats, cpu_stats):
     print(f"{'Number Summary Table':^80}")
     print("=" * 80)
     print(f"{'Resource (units)':<25}: {'Min':>6}  {'Q1':>6}  {'Median':>7}  {'Q3':>6}  {'Max':>6}   {'StdDev':>6}")
     print("-" * 80)
 
-    cpu_usages, mem_values, disk_values = [], [], []
-
-    for i in range(len(jobs)):
-        if i < len(cpu_used_time) and i < len(run_time) and run_time[i]:
-            cpu_usages.append(efficiency(cpu_used_time[i], run_time[i]))
-        if i < len(mem_used):
-            mem_values.append(mem_used[i])
-        if i < len(disk_used):
-            disk_values.append(disk_used[i])
-
-
-    print(compute_usage_summary(mem_values, "Memory Used (GiB)"))
-    print(compute_usage_summary(disk_values, "Disk Used (GiB)"))
-    print(compute_usage_summary(cpu_usages, "CPU Usage (%)", percentage=True))
-    
+    print(format_usage_row("Memory Used (GiB)", mem_stats))
+    print(format_usage_row("Disk Used (GiB)", disk_stats))
+    print(format_usage_row("CPU Usage (%)", cpu_stats, percentage=True))
 
     print()
 
+# prints the utilization bars, the efficiency notes and the end of the report
+def print_utilization(avg_mem_eff, avg_disk_eff, avg_cpu_eff):
     print(f"{'Overall Utilization':^80}")
     print("=" * 80)
     print(f"  Memory usage      {bar(avg_mem_eff)}")
@@ -206,8 +385,87 @@ def summarize(cluster_id):
     print(f"{'End of Summary':^80}")
     print("=" * 80)
 
+# path of the CSV dump of a cluster
+def cluster_csv_path(cluster_id):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(script_dir, "cluster_data")
+    return os.path.join(data_dir, f"cluster_{cluster_id}_jobs.csv")
+
+# prints the total report, from the cluster's CSV dump or, given store filters, from the job store
+def summarize(cluster_id, store_filters=None):
+    if store_filters is None:
+        filepath = cluster_csv_path(cluster_id)
+        if not os.path.exists(filepath):
+            print(f"File not found: {filepath}")
+            sys.exit(1)
+
+    with span("load") as s:
+        if store_filters is None:
+            columns = load_table(filepath, COLUMNS)
+        else:
+            columns = load_report_table(cluster_id, COLUMNS, store_filters)
+        rows = columns.rows
+        s.rows = rows
+    with span("compute", rows):
+        summary = compute_summary(columns, rows)
+    with span("render"):
+        print_summary(cluster_id, summary)
+
+# prints the report of a random sample of the cluster, followed by its confidence intervals
+def summarize_sample(cluster_id):
+    filepath = sample_csv_path(cluster_id, os.path.dirname(cluster_csv_path(cluster_id)))
+
+    if not os.path.exists(filepath):
+        print(f"File not found: {filepath}")
+        print(f"Fetch a sample first with: python query.py {cluster_id} --sample <N>")
+        sys.exit(1)
+
+    with span("load") as s:
+        columns = load_table(filepath, COLUMNS)
+        rows = columns.rows
+        s.rows = rows
+    with span("compute", rows):
+        metrics = job_metrics(columns, rows)
+        summary = compute_summary(columns, rows, metrics)
+    with span("bootstrap", rows):
+        estimates = sample_estimates(metrics)
+    with span("render"):
+        print(describe_sample(read_sample_info(filepath), rows))
+        print()
+        print_summary(cluster_id, summary)
+        print()
+        print_estimates("Sample Estimates", estimates)
+
+# prints the report computed chunk by chunk in bounded memory
+def summarize_streaming(cluster_id, chunk_size=CHUNK_SIZE):
+    filepath = cluster_csv_path(cluster_id)
+
+    if not os.path.exists(filepath):
+        print(f"File not found: {filepath}")
+        sys.exit(1)
+
+    sketch = SummarySketch()
+    with span("stream") as s:
+        for columns, rows in iter_column_chunks(filepath, COLUMNS, chunk_size):
+            with span("compute", rows):
+                sketch.update(job_metrics(columns, rows), rows)
+        s.rows = sketch.total_jobs
+    with span("render"):
+        sketch.print_report(cluster_id)
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python htcondor_cluster_summary.py <ClusterId>")
+    store_filters = store_filters_from_argv()
+    stream_flag = "--stream" in sys.argv
+    sample_flag = "--sample" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg not in ("--stream", "--sample")]
+    if len(args) != 1 or stream_flag + sample_flag + (store_filters is not None) > 1:
+        print("Usage: python htcondor_cluster_summary.py <ClusterId> [--stream | --sample | --store [filters]] [--profile]")
         sys.exit(1)
-    summarize(sys.argv[1])
+    if store_filters is not None:
+        summarize(args[0], store_filters)
+    elif sample_flag:
+        summarize_sample(args[0])
+    elif stream_flag:
+        summarize_streaming(args[0])
+    else:
+        summarize(args[0])
@@ -0,0 +1,189 @@
+import io
+import os
+import sys
+import argparse
+import traceback
+from store import add_store_arguments, filters_from_args
+from schedd_cache import QueryCache, CachedSchedd, local_schedd
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+This program runs one report over many clusters, in parallel
+
+The clusters are split across a pool of worker processes. Each worker imports
+the report module and connects to the schedd once, then reuses both for every
+cluster it is given, and all of them share the column cache in 'cluster_data/'.
+hold_bucket workers query the schedd through the query cache, as hold_bucket.py
+does (see schedd_cache.py); --no-cache queries it directly. The output of every
+cluster, including that of query.py when a report has to fetch a missing CSV,
+is captured and printed in the order the clusters were given, whatever order
+they finish in. A cluster whose report fails or exits is reported as an error
+and does not stop the others. With --store the
+analytics, histogram and summarise reports read the job store (see store.py).
+
+Example: python batch.py analytics 4421577 4421578 --jobs 8
+         python batch.py histogram --file clusters.txt
+"""
+
+REPORTS = ["analytics", "histogram", "summarise", "hold_bucket"]
+
+# per-process state of a worker: the report module and its schedd
+_worker = {}
+
+
+# imports the report module once per worker process
+def init_worker(report, no_cache=False):
+    _worker["report"] = report
+    if report == "analytics":
+        import analytics
+        _worker["module"] = analytics
+    elif report == "histogram":
+        import histogram
+        _worker["module"] = histogram
+    elif report == "summarise":
+        import summarise
+        _worker["module"] = summarise
+    elif report == "hold_bucket":
+        import hold_bucket
+        _worker["module"] = hold_bucket
+        # the cache file is shared by the workers; it is evicted by the next hold_bucket.py run
+        _worker["schedd"] = local_schedd() if no_cache else CachedSchedd(QueryCache())
+
+
+# runs the report of one cluster in the current worker
+def run_report(cluster_id, options):
+    module = _worker["module"]
+    report = _worker["report"]
+
+    store_filters = options.get("store")
+    if report == "analytics":
+        if options.get("stream"):
+            module.summarize_streaming(cluster_id)
+        else:
+            module.summarize(cluster_id, store_filters)
+    elif report == "histogram":
+        df = module.load_data_for_cluster(cluster_id, store_filters=store_filters)
+        if df is not None:
+            module.histogram(cluster_id, df, show_fast_jobs=options.get("print_list", False))
+    elif report == "summarise":
+        module.summarise(cluster_id, store_filters=store_filters)
+    elif report == "hold_bucket":
+        _, reasons_by_code = module.group_by_code(cluster_id, _worker["schedd"])
+        if options.get("templates"):
+            with module.TemplateCache() as cache:
+                module.bucket_and_print_table(reasons_by_code, cluster_id, cache=cache)
+        else:
+            module.bucket_and_print_table(reasons_by_code, cluster_id,
+                                          normalize=options.get("normalize", False))
+
+
+"""
+Runs the report of one cluster with its output captured.
+
+    Parameters:
+        cluster_id (str): The cluster.
+        options (dict): Report options (stream, print_list, normalize, templates, no_cache, and
+                        store: the store filters, or None to read the CSV dumps).
+
+    Returns:
+        Tuple[str, str, str or None]: ClusterId, the captured output, and an error
+                                      message if the report failed or exited.
+"""
+def capture_report(cluster_id, options):
+    output = io.StringIO()
+    error = None
+    try:
+        with redirect_stdout(output):
+            run_report(cluster_id, options)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            error = f"exited with status {e.code}"
+    except Exception:
+        error = traceback.format_exc()
+    return cluster_id, output.getvalue(), error
+
+
+"""
+Runs a report over many clusters with a process pool.
+
+    Parameters:
+        report (str): One of REPORTS.
+        cluster_ids (List[str]): Clusters to report on.
+        jobs (int): Number of worker processes.
+        options (dict): Report options, see capture_report().
+        chunksize (int): Clusters handed to a worker at a time.
+
+    Yields:
+        Tuple[str, str, str or None]: The capture_report() result of every cluster, in input order.
+"""
+def run_batch(report, cluster_ids, jobs, options=None, chunksize=1):
+    options = options or {}
+    if jobs == 1:
+        init_worker(report, options.get("no_cache", False))
+        for cluster_id in cluster_ids:
+            yield capture_report(cluster_id, options)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(report, options.get("no_cache", False))) as pool:
+        yield from pool.map(capture_report, cluster_ids, [options] * len(cluster_ids),
+                            chunksize=chunksize)
+
+
+# reads ClusterIds from a file, one per line (blank lines and # comments are skipped)
+def read_cluster_file(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.split("#")[0].strip() for line in f if line.split("#")[0].strip()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a report over many clusters in parallel.")
+    parser.add_argument("report", choices=REPORTS, help="report to run")
+    parser.add_argument("cluster_ids", nargs="*", help="ClusterIds to report on")
+    parser.add_argument("--file", help="file with one ClusterId per line")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--stream", action="store_true", help="analytics: bounded-memory mode")
+    parser.add_argument("--print-list", action="store_true", help="histogram: list the fast jobs")
+    parser.add_argument("--normalize", action="store_true", help="hold_bucket: normalize reasons")
+    parser.add_argument("--templates", action="store_true", help="hold_bucket: use the template cache")
+    parser.add_argument("--no-cache", action="store_true", help="hold_bucket: always query the schedd")
+    add_store_arguments(parser)
+    args = parser.parse_args()
+    store_filters = filters_from_args(args)
+    if store_filters and not args.store:
+        parser.error("the store filters can only be used with --store")
+    if args.store and (args.report == "hold_bucket" or args.stream):
+        parser.error("--store works with the analytics, histogram and summarise reports, without --stream")
+
+    cluster_ids = list(args.cluster_ids)
+    if args.file:
+        cluster_ids += read_cluster_file(args.file)
+    if not cluster_ids:
+        print("Usage: python batch.py <report> <ClusterId> [ClusterId ...] [--file FILE] [--jobs N]")
+        sys.exit(1)
+    if args.jobs < 1:
+        print("Error: --jobs must be at least 1.")
+        sys.exit(1)
+
+    options = {
+        "stream": args.stream,
+        "print_list": args.print_list,
+        "normalize": args.normalize,
+        "templates": args.templates,
+        "no_cache": args.no_cache,
+        "store": store_filters if args.store else None,
+    }
+    # hand out several clusters at a time when there are many, to cut the IPC overhead
+    chunksize = max(1, min(16, len(cluster_ids) // (args.jobs * 4)))
+
+    failed = 0
+    for cluster_id, output, error in run_batch(args.report, cluster_ids, args.jobs, options, chunksize):
+        print(output, end="")
+        if error:
+            failed += 1
+            print(f"[ERROR] {args.report} failed for cluster {cluster_id}: {error}", file=sys.stderr)
+        sys.stdout.flush()
+
+    if failed:
+        print(f"[ERROR] {failed} of {len(cluster_ids)} cluster(s) failed.", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,296 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic import write_cluster_csv, synthetic_cluster_id, hold_reasons, FakeSchedd, FakeElasticsearch
+
+"""
+Benchmarks of the report tools on synthetic clusters
+
+    python benchmarks/bench.py [--sizes 10k,100k,1M,10M] [--cases analytics,histogram,...]
+                               [--repeat N] [--output results.json]
+    python benchmarks/bench.py compare old.json new.json
+
+Synthetic cluster CSVs (see synthetic.py) are generated once per size in
+'benchmarks/data/'. Every (case, size) runs in a fresh Python process, so the
+peak RSS it reports (ru_maxrss) belongs to that case alone, and nothing stays
+warm between cases except the files on disk. Report output is discarded.
+
+The results are saved as JSON together with the git commit they were measured
+on; "compare" prints the change in time and peak memory between two such files.
+"""
+
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+CASES = [
+    "column_cache", "analytics", "analytics_stream", "histogram",
+    "summarise", "hold_bucket", "query", "query_fields", "query_sample", "aggregate", "store",
+]
+DEFAULT_SIZES = "10k,100k"
+
+# fraction of the jobs that are held in the hold_bucket case
+HELD_FRACTION = 0.05
+
+
+# parses "10k", "1M", ... into a number of jobs
+def parse_size(text):
+    text = text.strip()
+    factor = {"k": 1000, "m": 1000000}.get(text[-1].lower(), 1)
+    return int(float(text[:-1] if factor > 1 else text) * factor)
+
+
+# path of the synthetic CSV of a size, generated if missing
+def synthetic_csv(n, data_dir=DATA_DIR, columns=None):
+    suffix = "" if columns is None else "_reports"
+    folder = os.path.join(data_dir, f"{n}{suffix}")
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"cluster_{synthetic_cluster_id(n)}_jobs.csv")
+    if not os.path.exists(path):
+        print(f"[INFO] Generating {n} synthetic jobs into {path} ...", file=sys.stderr)
+        write_cluster_csv(path, n, columns=columns)
+    return path
+
+
+# current peak RSS of this process in KiB
+def peak_rss_kib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB on Linux
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+"""
+Prepares one case: returns the function to time and the time spent preparing it.
+Loading the input is part of the setup when the function under test takes it ready-made.
+"""
+def prepare_case(case, csv_path, n):
+    cluster_id = synthetic_cluster_id(n)
+    folder = os.path.dirname(csv_path)
+    start = time.perf_counter()
+
+    if case == "column_cache":
+        import jobcache
+
+        def run():
+            shutil.rmtree(jobcache.cache_dir_for(csv_path), ignore_errors=True)
+            jobcache.ensure_cache(csv_path)
+    elif case in ("analytics", "analytics_stream"):
+        import analytics
+        import jobcache
+        analytics.cluster_csv_path = lambda _: csv_path
+        jobcache.ensure_cache(csv_path)
+        report = analytics.summarize if case == "analytics" else analytics.summarize_streaming
+
+        def run():
+            report(cluster_id)
+    elif case == "histogram":
+        import histogram
+        from jobtable import load_table
+        df = load_table(csv_path, histogram.COLUMNS).to_frame()
+
+        def run():
+            histogram.histogram(cluster_id, df, show_fast_jobs=False)
+    elif case == "summarise":
+        import summarise
+        _, columns, rows = summarise.load_job_columns(cluster_id, summarise.DEFAULT_PARAMS, folder=folder)
+
+        def run():
+            list(summarise.summary_rows(columns, summarise.DEFAULT_PARAMS, rows))
+    elif case == "hold_bucket":
+        import hold_bucket
+        schedd = FakeSchedd(cluster_id, hold_reasons(max(1, int(n * HELD_FRACTION))), running=n)
+        _, reasons_by_code = hold_bucket.group_by_code(cluster_id, schedd)
+
+        def run():
+            for entries in reasons_by_code.values():
+                reasons, subcodes = zip(*entries)
+                hold_bucket.bucket_reasons_with_subcodes(list(reasons), list(subcodes))
+    elif case in ("query", "query_fields", "query_sample"):
+        import query
+        query.connect_to_elasticsearch = lambda: FakeElasticsearch(csv_path)
+        if case == "query_sample":
+            argv = [str(cluster_id), "--sample", str(max(1, n // 100)), "--fields", "reports"]
+        else:
+            argv = [str(cluster_id), "--slices", "4"] + (["--fields", "reports"] if case == "query_fields" else [])
+
+        def run():
+            with tempfile.TemporaryDirectory() as tmp:
+                cwd = os.getcwd()
+                os.chdir(tmp)
+                try:
+                    query.main(argv)
+                finally:
+                    os.chdir(cwd)
+    elif case == "aggregate":
+        # the fake evaluates the aggregations in Python, so this mostly checks the
+        # requests end to end; the time a real cluster takes is not comparable
+        import aggregate
+        aggregate.connect_to_elasticsearch = lambda: FakeElasticsearch(csv_path)
+
+        def run():
+            aggregate.main([str(cluster_id)])
+    elif case == "store":
+        # the analytics report off the job store: the indexed selection plus loading its columns
+        import analytics
+        import store
+        store.DEFAULT_PATH = os.path.join(tempfile.mkdtemp(), "jobs.sqlite")
+        with store.JobStore() as job_store:
+            job_store.ingest(store.read_csv_jobs(csv_path))
+
+        def run():
+            analytics.summarize(str(cluster_id), {})
+    else:
+        raise ValueError(f"unknown case {case}")
+
+    return run, time.perf_counter() - start
+
+
+# runs one case in this process and prints its result as JSON (used by the child processes)
+def run_child(case, csv_path, n, repeat):
+    baseline = peak_rss_kib()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        run, setup_seconds = prepare_case(case, csv_path, n)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+
+    print(json.dumps({
+        "case": case,
+        "size": n,
+        "seconds": times,
+        "best": min(times),
+        "median": sorted(times)[len(times) // 2],
+        "setup_seconds": setup_seconds,
+        "baseline_rss_kib": baseline,
+        "peak_rss_kib": peak_rss_kib(),
+    }))
+
+
+# runs one case in a fresh interpreter and returns its result
+def run_case(case, csv_path, n, repeat):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", case, "--csv", csv_path,
+         "--child-size", str(n), "--repeat", str(repeat)],
+        capture_output=True, text=True)
+    if result.returncode != 0:
+        return {"case": case, "size": n, "error": result.stderr.strip().splitlines()[-1:]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# commit the benchmarks run on, and whether the tree had local changes
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+# prints one row per case of a result file, or the change between two
+def print_results(results, old=None):
+    old_by_key = {(r["case"], r["size"]): r for r in (old or {}).get("results", [])}
+    print(f"{'Case':<18} {'Jobs':>10} {'Best (s)':>10} {'Peak RSS (MiB)':>15}"
+          + (f" {'Time ratio':>11} {'RSS ratio':>10}" if old else ""))
+    print("-" * (56 + (23 if old else 0)))
+    for r in results["results"]:
+        if "error" in r:
+            print(f"{r['case']:<18} {r['size']:>10} {'failed: ' + ' '.join(r['error'])}")
+            continue
+        line = f"{r['case']:<18} {r['size']:>10} {r['best']:>10.3f} {r['peak_rss_kib'] / 1024:>15.1f}"
+        before = old_by_key.get((r["case"], r["size"]))
+        if before and "error" not in before:
+            line += (f" {r['best'] / before['best']:>10.2f}x"
+                     f" {r['peak_rss_kib'] / before['peak_rss_kib']:>9.2f}x")
+        print(line)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["compare"]:
+        if len(argv) != 3:
+            print("Usage: python benchmarks/bench.py compare <old.json> <new.json>")
+            sys.exit(1)
+        with open(argv[1], encoding="utf-8") as f:
+            old = json.load(f)
+        with open(argv[2], encoding="utf-8") as f:
+            new = json.load(f)
+        print(f"old: {old.get('commit')}   new: {new.get('commit')}\n")
+        print_results(new, old)
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark the report tools on synthetic clusters.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help=f"comma-separated job counts, e.g. 10k,100k,1M,10M (default: {DEFAULT_SIZES})")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma-separated cases (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case (default: 3)")
+    parser.add_argument("--reports-only", action="store_true",
+                        help="generate only the columns the reports read (keeps 1M/10M files small)")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="where the synthetic CSVs are kept")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--csv", help=argparse.SUPPRESS)
+    parser.add_argument("--child-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child, args.csv, args.child_size, args.repeat)
+        return
+
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = [c for c in cases if c not in CASES]
+    if unknown:
+        print(f"Unknown case(s): {', '.join(unknown)}. Known cases: {', '.join(CASES)}")
+        sys.exit(1)
+
+    columns = None
+    if args.reports_only:
+        from utils import REPORT_FIELDS, REPORT_COLUMNS
+        columns = sorted(set(REPORT_FIELDS) | {"GlobalJobId", "EnteredCurrentStatus"}
+                         | set(REPORT_COLUMNS["rollup"]))
+
+    commit, dirty = git_revision()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "repeat": args.repeat,
+        "results": [],
+    }
+
+    for n in (parse_size(s) for s in args.sizes.split(",")):
+        csv_path = synthetic_csv(n, args.data_dir, columns)
+        for case in cases:
+            print(f"[INFO] {case} on {n} jobs ...", file=sys.stderr)
+            results["results"].append(run_case(case, csv_path, n, args.repeat))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{(commit or 'unknown')[:12]}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print_results(results)
+    print(f"\nSaved to {output}")
+
+if __name__ == "__main__":
+    main()
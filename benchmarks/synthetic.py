@@ -0,0 +1,428 @@
+import os
+import csv
+import sys
+import random
+import hashlib
+import operator
+import threading
+from collections import Counter
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobcache import CHUNK_SIZE
+
+"""
+Synthetic job data for the benchmarks.
+
+write_cluster_csv() writes a cluster CSV with the schema of the fixture dump
+('cluster_data/cluster_4421577_jobs.csv'). Every synthetic job is a fixture job
+picked at random, renumbered and with its runtime, CPU time, memory and dates
+scaled by a random factor, so the value distributions stay realistic.
+
+hold_reasons() generates HoldReason/HoldReasonCode/HoldReasonSubCode triples
+from templates of real hold messages, with varying paths, hosts, slots, sizes
+and numbers, and a skewed (Zipf-like) mix of templates.
+
+FakeElasticsearch serves a CSV as Elasticsearch scroll pages (with sliced
+scrolls and _source filtering) and answers the aggregation requests of
+aggregate.py, and FakeSchedd serves held-job ads, so query.py, aggregate.py and
+hold_bucket.py can be run without the services.
+"""
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       "cluster_data", "cluster_4421577_jobs.csv")
+
+# ClusterId of the synthetic cluster with n jobs
+def synthetic_cluster_id(n):
+    return 900000000 + n
+
+
+# reads the fixture header and rows
+def read_fixture(path=FIXTURE):
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = [row for row in reader if row]
+    return header, rows
+
+
+"""
+Writes a synthetic cluster CSV.
+
+    Parameters:
+        path (str): Output file.
+        n (int): Number of jobs.
+        seed (int): Random seed; the same seed gives the same file.
+        columns (List[str] or None): Only write these fixture columns (all of them by default).
+
+    Returns:
+        int: The ClusterId of the synthetic jobs.
+"""
+def write_cluster_csv(path, n, seed=0, columns=None):
+    header, rows = read_fixture()
+    keep = list(range(len(header))) if columns is None else [header.index(c) for c in columns if c in header]
+    index = {name: i for i, name in enumerate(header)}
+    cluster_id = synthetic_cluster_id(n)
+    rng = np.random.default_rng(seed)
+
+    def number(row, name):
+        try:
+            return float(row[index[name]])
+        except (KeyError, ValueError):
+            return None
+
+    def put(row, name, value):
+        if name in index and value is not None:
+            row[index[name]] = str(int(value)) if float(value).is_integer() else f"{value:.3f}"
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([header[i] for i in keep])
+
+        for start in range(0, n, CHUNK_SIZE):
+            count = min(CHUNK_SIZE, n - start)
+            picks = rng.integers(0, len(rows), count)
+            time_scale = rng.lognormal(0, 0.5, count)
+            memory_scale = rng.lognormal(0, 0.3, count)
+            submit_shift = rng.integers(0, 30 * 86400, count)
+
+            for i in range(count):
+                template = rows[picks[i]]
+                row = list(template) + [""] * (len(header) - len(template))
+                proc_id = start + i
+                scale = time_scale[i]
+
+                put(row, "ClusterId", cluster_id)
+                put(row, "ProcId", proc_id)
+                if "GlobalJobId" in index:
+                    row[index["GlobalJobId"]] = f"ap.synthetic.org#{cluster_id}.{proc_id}#1700000000"
+
+                wall = number(template, "RemoteWallClockTime")
+                for name in ("RemoteWallClockTime", "RemoteUserCpu", "RemoteSysCpu", "CommittedTime"):
+                    value = number(template, name)
+                    put(row, name, round(value * scale) if value is not None else None)
+                for name in ("ResidentSetSize_RAW", "MemoryUsage", "ResidentSetSize"):
+                    value = number(template, name)
+                    put(row, name, round(value * memory_scale[i]) if value is not None else None)
+
+                qdate = number(template, "QDate")
+                if qdate is not None:
+                    qdate += int(submit_shift[i])
+                    put(row, "QDate", qdate)
+                    start_date = qdate + 60
+                    put(row, "JobStartDate", start_date)
+                    if wall is not None:
+                        end = start_date + round(wall * scale)
+                        put(row, "CompletionDate", end)
+                        put(row, "EnteredCurrentStatus", end)
+
+                writer.writerow([row[i] for i in keep])
+    os.replace(tmp_path, path)
+    return cluster_id
+
+
+# (template, HoldReasonCode, HoldReasonSubCode) of common hold messages
+HOLD_TEMPLATES = [
+    ("Error from {slot}: Job has gone over cgroup memory limit of {mem} megabytes. Peak usage: {peak} "
+     "megabytes.  Consider resubmitting with a higher request_memory.", 34, 0),
+    ("Transfer input files failure at access point {ap} while receiving files from the execution point "
+     "{slot}. Details: reading from file {path}: (errno 2) No such file or directory", 13, 2),
+    ("Transfer output files failure at execution point {slot} while sending files to access point {ap}. "
+     "Details: reading from file {path}: (errno 2) No such file or directory", 12, 2),
+    ("Transfer input files failure at execution point {slot} using protocol osdf. Details: "
+     "FILETRANSFER:1:non-zero exit (1) from /usr/libexec/condor/pelican_plugin. |Error: Aborted due to "
+     "lack of progress (with environment: GOMAXPROCS={n}) ( URL file = osdf://{path} )|", 13, 1),
+    ("The job exceeded allowed execute duration of {hours}:00:00", 47, 0),
+    ("via condor_hold (by user {user})", 1, 0),
+    ("Error from {slot}: Failed to execute '{path}': (errno=8: 'Exec format error')", 6, 8),
+    ("Cannot access initial working directory {path}: No such file or directory", 14, 2),
+    ("The job attribute PeriodicHold expression '(JobStatus == 2) && (time() - EnteredCurrentStatus) > "
+     "{seconds}' evaluated to TRUE", 3, 0),
+    ("Job disk usage ({disk} KB) exceeded request_disk ({request} KB).", 26, 0),
+    ("Error from {slot}: SHADOW at {ip} failed to send file(s) to <{ip}:{port}>: error reading from "
+     "{path}: (errno 13) Permission denied; STARTER failed to receive file(s) from <{ip}:{port}>", 13, 13),
+    ("Error from {slot}: Singularity test failed: FATAL: could not open image {path}: failed to "
+     "retrieve path for {path}: lstat {path}: no such file or directory", 45, 0),
+    ("Maximum total input file transfer size of {mem} MB exceeded.", 32, 0),
+    ("Error from {slot}: Docker job has gone over memory limit of {mem} Mb", 34, 0),
+]
+
+USERS = ["alice", "bchen", "cdiaz", "dkumar", "eokafor", "fwang", "gmuller", "hsato"]
+SITES = ["chtc.wisc.edu", "swan.hcc.unl.edu", "osg-htc.org", "crc.nd.edu", "sdsc.edu", "uchicago.edu"]
+
+
+# a random execution slot name
+def random_slot(rng):
+    return (f"slot1_{rng.randint(1, 64)}@glidein_{rng.randint(10**6, 10**7)}_{rng.randint(10**7, 10**8)}"
+            f"@c{rng.randint(100, 9999)}.{rng.choice(SITES)}")
+
+
+# a random file path
+def random_path(rng):
+    user = rng.choice(USERS)
+    parts = [rng.choice(["data", "runs", "inputs", "outputs", "scratch"]) for _ in range(rng.randint(1, 4))]
+    return f"/home/{user}/" + "/".join(parts) + f"/file_{rng.randint(0, 99999)}.{rng.choice(['dat', 'tar.gz', 'sif', 'sh'])}"
+
+
+"""
+Generates hold reasons with realistic variety.
+
+    Parameters:
+        n (int): Number of held jobs.
+        seed (int): Random seed.
+
+    Returns:
+        List[Tuple[str, int, int]]: (HoldReason, HoldReasonCode, HoldReasonSubCode) per job.
+"""
+def hold_reasons(n, seed=0):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(HOLD_TEMPLATES))]
+    reasons = []
+    for template, code, subcode in rng.choices(HOLD_TEMPLATES, weights, k=n):
+        ip = f"128.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+        mem = rng.choice([1024, 2048, 4096, 8192, 16384, 32768])
+        reason = template.format(
+            slot=random_slot(rng), ap=f"ap{rng.randint(1, 40)}.uc.osg-htc.org", path=random_path(rng),
+            mem=mem, peak=mem + rng.randint(1, 4096), n=rng.randint(1, 64), hours=rng.choice([4, 10, 20, 40]),
+            user=rng.choice(USERS), seconds=rng.randint(3600, 86400), disk=rng.randint(10**6, 10**8),
+            request=rng.randint(10**5, 10**6), ip=ip, port=rng.randint(1024, 65535),
+        )
+        reasons.append((reason, code, subcode))
+    return reasons
+
+
+# a job ad as returned by the schedd
+class FakeAd(dict):
+    def eval(self, name):
+        return self[name]
+
+
+"""
+Serves held-job ads for one cluster, like htcondor.Schedd.query().
+
+    Parameters:
+        cluster_id (int): ClusterId of the ads.
+        reasons (List[Tuple[str, int, int]]): Output of hold_reasons().
+        running (int): Number of extra jobs that are not held.
+"""
+class FakeSchedd:
+    def __init__(self, cluster_id, reasons, running=0):
+        self.ads = [FakeAd(ClusterId=cluster_id, ProcId=i, JobStatus=5, HoldReason=reason,
+                           HoldReasonCode=code, HoldReasonSubCode=subcode)
+                    for i, (reason, code, subcode) in enumerate(reasons)]
+        self.ads += [FakeAd(ClusterId=cluster_id, ProcId=len(reasons) + i, JobStatus=2)
+                     for i in range(running)]
+
+    def query(self, constraint="true", projection=None, limit=-1):
+        return iter(self.ads)
+
+    xquery = query
+
+    def history(self, constraint="true", projection=None, match=-1):
+        return iter([])
+
+
+# converts a CSV value to the type Elasticsearch would return
+def convert(value):
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+# True if a document matches a query clause (bool, match, term, exists and range)
+def matches(doc, clause):
+    if not clause or "match_all" in clause:
+        return True
+    kind, spec = next(iter(clause.items()))
+    if kind == "function_score":
+        return matches(doc, spec.get("query"))
+    if kind == "bool":
+        as_list = lambda value: value if isinstance(value, list) else [value]
+        if not all(matches(doc, c) for c in as_list(spec.get("must", [])) + as_list(spec.get("filter", []))):
+            return False
+        if any(matches(doc, c) for c in as_list(spec.get("must_not", []))):
+            return False
+        should = as_list(spec.get("should", []))
+        return sum(matches(doc, c) for c in should) >= spec.get("minimum_should_match", 0 if not should else 1)
+    if kind in ("match", "term"):
+        field, value = next(iter(spec.items()))
+        if isinstance(value, dict):
+            value = value.get("query", value.get("value"))
+        return field in doc and doc[field] == convert(str(value))
+    if kind == "exists":
+        return spec["field"] in doc
+    if kind == "range":
+        field, bounds = next(iter(spec.items()))
+        value = doc.get(field)
+        if not isinstance(value, (int, float)):
+            return False
+        checks = {"gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
+        return all(checks[op](value, bound) for op, bound in bounds.items() if op in checks)
+    raise ValueError(f"unsupported query clause {kind}")
+
+
+# Python versions of the painless scripts aggregate.py sends
+def script_functions():
+    from aggregate import SCRIPTS
+
+    return {
+        SCRIPTS["mem_eff"]: lambda d: d["ResidentSetSize_RAW"] / 1048576 / round(d["RequestMemory"] / 1024, 2) * 100,
+        SCRIPTS["disk_eff"]: lambda d: d["DiskUsage_RAW"] / 1048576 / round(d["RequestDisk"] / 1048576, 2) * 100,
+        SCRIPTS["cpu_eff"]: lambda d: d.get("RemoteSysCpu", 0) / d["RequestCpus"] / d["RemoteWallClockTime"] * 100,
+    }
+
+
+# numeric values of the field or script of a metric aggregation
+def metric_values(docs, spec):
+    if "script" in spec:
+        function = script_functions()[spec["script"]["source"]]
+        return np.array([function(doc) for doc in docs], dtype=float)
+    field = spec["field"]
+    return np.array([doc[field] for doc in docs if isinstance(doc.get(field), (int, float))], dtype=float)
+
+
+"""
+Evaluates aggregations over documents, like the "aggregations" of a search response.
+Supports filter, terms and range buckets and the min, max, avg, sum, value_count,
+stats, extended_stats and percentiles metrics. Percentiles are exact (linear
+interpolation), where Elasticsearch estimates them with a t-digest.
+"""
+def aggregate(docs, aggs):
+    results = {}
+    for name, spec in aggs.items():
+        sub_aggs = spec.get("aggs") or spec.get("aggregations")
+        kind = next(key for key in spec if key not in ("aggs", "aggregations"))
+        body = spec[kind]
+
+        def bucket(selected, **fields):
+            result = dict(fields, doc_count=len(selected))
+            if sub_aggs:
+                result.update(aggregate(selected, sub_aggs))
+            return result
+
+        if kind == "filter":
+            results[name] = bucket([doc for doc in docs if matches(doc, body)])
+        elif kind == "terms":
+            field = body["field"]
+            counts = Counter(doc[field] for doc in docs if field in doc)
+            keys = sorted(counts, key=lambda key: (-counts[key], key))
+            shown = keys[:body.get("size", 10)]
+            results[name] = {
+                "buckets": [bucket([doc for doc in docs if doc.get(field) == key], key=key) for key in shown],
+                "sum_other_doc_count": sum(counts[key] for key in keys[len(shown):]),
+            }
+        elif kind == "range":
+            field = body["field"]
+            buckets = []
+            for r in body["ranges"]:
+                low, high = r.get("from", -np.inf), r.get("to", np.inf)
+                selected = [doc for doc in docs
+                            if isinstance(doc.get(field), (int, float)) and low <= doc[field] < high]
+                buckets.append(bucket(selected, **{k: v for k, v in r.items() if k in ("from", "to")}))
+            results[name] = {"buckets": buckets}
+        else:
+            values = metric_values(docs, body)
+            empty = not len(values)
+            if kind in ("min", "max", "avg", "sum"):
+                function = {"min": np.min, "max": np.max, "avg": np.mean, "sum": np.sum}[kind]
+                results[name] = {"value": None if empty and kind != "sum" else float(function(values))}
+            elif kind == "value_count":
+                results[name] = {"value": len(values)}
+            elif kind in ("stats", "extended_stats"):
+                stats = {"count": len(values), "min": None, "max": None, "avg": None, "sum": float(values.sum())}
+                if not empty:
+                    stats.update(min=float(values.min()), max=float(values.max()), avg=float(values.mean()))
+                if kind == "extended_stats":
+                    variance = None if empty else float(values.var())
+                    stats.update(variance=variance, std_deviation=None if empty else variance ** 0.5)
+                results[name] = stats
+            elif kind == "percentiles":
+                percents = body.get("percents", [1, 5, 25, 50, 75, 95, 99])
+                points = np.percentile(values, percents).tolist() if not empty else [None] * len(percents)
+                if body.get("keyed", True):
+                    results[name] = {"values": {str(float(p)): v for p, v in zip(percents, points)}}
+                else:
+                    results[name] = {"values": [{"key": float(p), "value": v} for p, v in zip(percents, points)]}
+            else:
+                raise ValueError(f"unsupported aggregation {kind}")
+    return results
+
+
+"""
+Serves a cluster CSV as Elasticsearch scroll pages, reading it lazily.
+Only the documents matching the query are returned (see matches()).
+Supports sliced scrolls ({"slice": {"id", "max"}}) and _source includes, and
+answers searches with "aggs" (see aggregate()) in a single response.
+A function_score query with a random_score returns the documents ordered by a
+hash of the seed and the scored field, like a seeded random sample.
+
+    Parameters:
+        csv_path (str): The CSV to serve.
+"""
+class FakeElasticsearch:
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+        self.scrolls = {}
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+    def ping(self):
+        return True
+
+    def documents(self, body):
+        includes = body.get("_source", {}).get("includes")
+        slice_spec = body.get("slice")
+        random_score = body.get("query", {}).get("function_score", {}).get("random_score")
+        with open(self.csv_path, newline='', encoding='utf-8') as f:
+            rows = csv.DictReader(f)
+            if random_score:
+                def score(row):
+                    text = f"{random_score['seed']}:{row.get(random_score['field'])}"
+                    return hashlib.sha1(text.encode("utf-8")).digest()
+                rows = sorted(rows, key=score)
+            for i, row in enumerate(rows):
+                if slice_spec and i % slice_spec["max"] != slice_spec["id"]:
+                    continue
+                doc = {name: convert(value) for name, value in row.items() if value != ""}
+                if not matches(doc, body.get("query")):
+                    continue
+                yield doc if includes is None else {name: value for name, value in doc.items() if name in includes}
+
+    def count(self, index, body):
+        return {"count": sum(1 for doc in self.documents({}) if matches(doc, body.get("query")))}
+
+    def page(self, scroll_id):
+        documents, size = self.scrolls[scroll_id]
+        hits = []
+        for doc in documents:
+            hits.append({"_source": doc})
+            if len(hits) == size:
+                break
+        return {"_scroll_id": scroll_id, "hits": {"hits": hits}}
+
+    def search(self, index, body, scroll=None, size=10, **kwargs):
+        if "aggs" in body or "aggregations" in body:
+            docs = [doc for doc in self.documents({}) if matches(doc, body.get("query"))]
+            return {
+                "hits": {"total": {"value": len(docs), "relation": "eq"}, "hits": []},
+                "aggregations": aggregate(docs, body.get("aggs") or body.get("aggregations")),
+            }
+
+        with self.lock:
+            self.next_id += 1
+            scroll_id = f"scroll-{self.next_id}"
+        self.scrolls[scroll_id] = (self.documents(body), size)
+        return self.page(scroll_id)
+
+    def scroll(self, scroll_id, scroll=None):
+        return self.page(scroll_id)
+
+    def clear_scroll(self, scroll_id):
+        self.scrolls.pop(scroll_id, None)
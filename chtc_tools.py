@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import runpy
+from daemon import REPORTS as DAEMON_REPORTS, serve_from_daemon
+from profiling import setup_from_argv
+
+"""
+Single entry point for the CHTC tools: chtc-tools <subcommand> [arguments]
+
+Only the module of the chosen subcommand is imported, and the tools themselves
+import their heavy dependencies (pandas, htcondor, elasticsearch) only on the
+code paths that use them, so starting a tool costs little more than starting
+Python.
+
+"chtc-tools startup [subcommand ...]" measures that cost: every subcommand's
+module is imported in a fresh interpreter run with -X importtime, and the total
+time and the slowest imports are printed.
+
+When the report daemon is running, the reports it serves are sent to it before
+their modules are imported (see daemon.py).
+
+Example: chtc-tools analytics 4421577
+         chtc-tools startup histogram dashboard --top 5
+"""
+
+# subcommand -> module that implements it
+SUBCOMMANDS = {
+    "query": "query",
+    "aggregate": "aggregate",
+    "analytics": "analytics",
+    "histogram": "histogram",
+    "summarise": "summarise",
+    "hold-bucket": "hold_bucket",
+    "dashboard": "dashboard",
+    "rollup": "rollup",
+    "batch": "batch",
+    "daemon": "daemon",
+    "store": "store",
+}
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# prints the list of subcommands
+def print_usage():
+    print("Usage: chtc-tools <subcommand> [arguments]")
+    print()
+    print("Subcommands:")
+    for name in SUBCOMMANDS:
+        print(f"  {name}")
+    print(f"  startup      measure the import time of the subcommands")
+
+
+# runs a tool's script as if it had been started directly, or in the report
+# daemon when one is running (see daemon.py), before the script is even imported
+def run_subcommand(name, argv):
+    sys.argv = [f"chtc-tools {name}"] + argv
+    module = SUBCOMMANDS[name]
+    if module in DAEMON_REPORTS and not (module == "dashboard" and "--watch" in argv):
+        setup_from_argv()
+        serve_from_daemon(module)
+    if TOOLS_DIR not in sys.path:
+        sys.path.insert(0, TOOLS_DIR)
+    runpy.run_module(SUBCOMMANDS[name], run_name="__main__", alter_sys=True)
+
+
+"""
+Parses the stderr of "python -X importtime".
+
+    Parameters:
+        text (str): The importtime lines.
+
+    Returns:
+        List[Tuple[str, int, int]]: (module, self time in us, cumulative time in us) per import.
+"""
+def parse_importtime(text):
+    imports = []
+    for line in text.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        imports.append((fields[2].rstrip(), int(fields[0]), int(fields[1])))
+    return imports
+
+
+"""
+Imports a subcommand's module in a fresh interpreter with -X importtime.
+
+    Parameters:
+        name (str): The subcommand.
+
+    Returns:
+        Tuple[float, List[Tuple[str, int, int]], str or None]: Wall time of the run in
+            seconds, the parsed imports, and the error if the import failed.
+"""
+def measure_startup(name):
+    import subprocess
+
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {SUBCOMMANDS[name]}"],
+        cwd=TOOLS_DIR, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+
+    error = None
+    if result.returncode != 0:
+        lines = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        error = lines[-1] if lines else f"exit status {result.returncode}"
+    return elapsed, parse_importtime(result.stderr), error
+
+
+# prints the startup report of the given subcommands
+def startup_report(names, top=10):
+    for name in names:
+        elapsed, imports, error = measure_startup(name)
+        total = sum(self_us for _, self_us, _ in imports)
+
+        print(f"{name:<12} startup {elapsed * 1000:7.1f} ms   "
+              f"imports {total / 1000:7.1f} ms   ({len(imports)} modules)")
+        if error:
+            print(f"{'':<12} [WARN] import failed: {error}")
+        for module, _, cumulative in sorted(imports, key=lambda i: -i[2])[:top]:
+            print(f"{'':<14}{cumulative / 1000:7.1f} ms  {module}")
+        print()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print_usage()
+        sys.exit(0 if argv else 1)
+
+    name, rest = argv[0], argv[1:]
+    if name == "startup":
+        top = 10
+        if "--top" in rest:
+            i = rest.index("--top")
+            if i + 1 >= len(rest) or not rest[i + 1].isdigit():
+                print("Usage: chtc-tools startup [subcommand ...] [--top N]")
+                sys.exit(1)
+            top = int(rest[i + 1])
+            rest = rest[:i] + rest[i + 2:]
+        unknown = [n for n in rest if n not in SUBCOMMANDS]
+        if unknown:
+            print(f"Unknown subcommand(s): {', '.join(unknown)}")
+            sys.exit(1)
+        startup_report(rest or list(SUBCOMMANDS), top)
+    elif name in SUBCOMMANDS:
+        run_subcommand(name, rest)
+    else:
+        print(f"Unknown subcommand: {name}\n")
+        print_usage()
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,564 @@
+import io
+import os
+import sys
+import json
+import time
+import socket
+import threading
+from collections import OrderedDict
+
+"""
+Long-lived report server for the CHTC tools
+
+Every report started from the command line is a new Python process: it imports
+numpy, pandas and the HTCondor bindings again, locates the schedd again and
+reads the cluster's columns from disk again. "python daemon.py serve" keeps one
+process running instead, listening on a unix socket, with its state kept warm
+between requests:
+
+    - the report modules and their dependencies, imported once,
+    - the loaded columns of the cluster CSVs (jobcache.set_memory_cache), up to
+      --max-table-mb, least recently used first out; a CSV that changed on disk
+      is read again,
+    - the schedd connection (schedd_cache.local_schedd), located once,
+    - the known hold-reason templates (hold_templates.set_memory_cache).
+
+analytics.py, histogram.py, summarise.py, hold_bucket.py and dashboard.py are
+thin clients: when the daemon is running they send it their arguments and
+working directory, print the output it sends back and exit with its status.
+"chtc-tools <report>" does so before importing the report at all, so a repeated
+report returns in milliseconds. Without a daemon, or with --no-daemon, they
+run the report themselves as before. --profile is handled by the client and
+times the round trip. dashboard.py --watch always runs locally.
+
+Reports are run one at a time in a worker thread, because they write to
+stdout and use the working directory, which the whole process shares; the
+event loop keeps accepting connections and answers "status" meanwhile.
+
+Requests and responses are one JSON object per line. A report request can ask
+for "json" instead of "text", and then gets the report's figures as data:
+
+    python daemon.py serve [--socket PATH] [--max-table-mb N]
+    python daemon.py status | stop
+    python daemon.py run <report> [arguments ...] [--json]
+
+The socket is '~/.cache/chtc-tools/daemon.sock', or $CHTC_TOOLS_SOCKET.
+"""
+
+DEFAULT_SOCKET = os.environ.get("CHTC_TOOLS_SOCKET") or os.path.join(
+    os.path.expanduser("~"), ".cache", "chtc-tools", "daemon.sock")
+REPORTS = ["analytics", "histogram", "summarise", "hold_bucket", "dashboard"]
+
+MAX_TABLE_BYTES = 1024 * 1024 * 1024
+MAX_TEMPLATES = 100000
+
+# set in the daemon's environment, so the reports it runs do not forward to it
+IN_DAEMON_ENV = "CHTC_TOOLS_IN_DAEMON"
+
+
+"""
+Least recently used cache with a limit on the number of entries and on their total size.
+
+    Parameters:
+        max_entries (int or None): Most entries kept.
+        max_bytes (int or None): Most total size kept (as given to put()).
+"""
+class LRUCache:
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=0):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.entries and ((self.max_entries is not None and len(self.entries) > self.max_entries)
+                                    or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.bytes, "hits": self.hits, "misses": self.misses}
+
+
+# sends one request to the daemon and returns its response
+def send_request(request, path=DEFAULT_SOCKET, timeout=None):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(1)
+        sock.connect(path)
+        sock.settimeout(timeout)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("the daemon closed the connection")
+    return json.loads(line)
+
+
+"""
+Runs the report in the daemon if one is running, prints its output and exits
+with its status. Returns without doing anything if there is no daemon (or it
+cannot be reached), if this process is the daemon, or if --no-daemon was given;
+the script then runs the report itself. --no-daemon is removed from the arguments.
+
+    Parameters:
+        report (str): One of REPORTS.
+        argv (List[str] or None): The arguments, sys.argv by default (changed in place).
+"""
+def serve_from_daemon(report, argv=None):
+    args = sys.argv if argv is None else argv
+    if "--no-daemon" in args:
+        args[:] = [arg for arg in args if arg != "--no-daemon"]
+        return
+    if os.environ.get(IN_DAEMON_ENV) or not os.path.exists(DEFAULT_SOCKET):
+        return
+
+    from profiling import span
+
+    try:
+        with span("daemon"):
+            response = send_request({"op": "report", "report": report, "argv": args[1:],
+                                     "cwd": os.getcwd(), "format": "text"})
+    except (OSError, ValueError):
+        return  # no daemon listening any more: run the report here
+    if not response.get("ok"):
+        print(f"[WARN] The report daemon could not run the report ({response.get('error')}); running it here")
+        return
+
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    sys.stdout.flush()
+    sys.exit(response["exit_code"])
+
+
+# runs a report script as if it had been started with these arguments
+def run_script(report, argv):
+    import runpy
+    from profiling import split_flags
+
+    # profiling is done by the client; the daemon's own process is never profiled
+    _, argv = split_flags(list(argv))
+    sys.argv = [f"{report}.py"] + argv
+    runpy.run_module(report, run_name="__main__")
+
+
+# the report's figures as JSON-ready data (see the *_data functions)
+def report_data(report, argv):
+    return REPORT_DATA[report](list(argv))
+
+
+# (value, jobs) pairs of the distinct values of an array
+def value_counts(values):
+    import numpy as np
+
+    keys, counts = np.unique(values, return_counts=True)
+    return [[key, count] for key, count in zip(keys.tolist(), counts.tolist())]
+
+
+def analytics_data(argv):
+    import analytics
+    from jobtable import load_table
+
+    if len(argv) != 1:
+        print("Usage: analytics <ClusterId>")
+        sys.exit(1)
+    path = analytics.cluster_csv_path(argv[0])
+    if not os.path.exists(path):
+        print(f"File not found: {path}")
+        sys.exit(1)
+
+    table = load_table(path, analytics.COLUMNS)
+    rows = table.rows
+    summary = analytics.compute_summary(table, rows)
+
+    def usage(values):
+        stats = analytics.usage_stats(values)
+        return None if stats is None else dict(zip(["min", "q1", "median", "q3", "max", "stddev"], stats))
+
+    return {
+        "cluster_id": argv[0],
+        "total_jobs": rows,
+        "avg_runtime": summary["avg_runtime"],
+        "requests": {
+            "memory_gib": value_counts(summary["mem_requested"]),
+            "disk_gib": value_counts(summary["disk_requested"]),
+            "cpus": value_counts(summary["cpu_requests"]),
+            "gpus": value_counts(summary["gpu_requests"]),
+        },
+        "usage": {
+            "memory_used_gib": usage(summary["mem_used"]),
+            "disk_used_gib": usage(summary["disk_used"]),
+            "cpu_usage_pct": usage(summary["cpu_usage"]),
+        },
+        "efficiency_pct": {"memory": summary["mem_eff"], "disk": summary["disk_eff"], "cpu": summary["cpu_eff"]},
+    }
+
+
+def histogram_data(argv):
+    import numpy as np
+    import histogram
+    from jobcache import float_column
+    from jobtable import load_table
+
+    if len(argv) != 1:
+        print("Usage: histogram <clusterId>")
+        sys.exit(1)
+    path = histogram.ensure_csv(argv[0])
+    if path is None:
+        sys.exit(1)
+
+    columns = load_table(path, histogram.COLUMNS)
+    rows = columns.rows
+    runtimes = float_column(columns, "RemoteWallClockTime", rows)
+    runtimes = runtimes[~np.isnan(runtimes)]
+    if not len(runtimes):
+        print("[WARN] No valid data to plot.")
+        sys.exit(1)
+
+    bins = histogram.percentile_bins(runtimes)
+    submit = float_column(columns, "QDate", rows)
+    completion = float_column(columns, "CompletionDate", rows)
+    return {
+        "cluster_id": argv[0],
+        "first_submit": None if np.isnan(submit).all() else float(np.nanmin(submit)),
+        "last_completion": None if np.isnan(completion).all() else float(np.nanmax(completion)),
+        "bins": [
+            {
+                "percentiles": [float(bins["percentiles"][i]), float(bins["percentiles"][i + 1])],
+                "runtime": [float(bins["edges"][i]), float(bins["edges"][i + 1])],
+                "jobs": int(bins["counts"][i]),
+                "median_runtime": float(bins["medians"][i]),
+                "fast": bool(bins["medians"][i] < histogram.FAST_JOB_SECONDS),
+            }
+            for i in range(len(bins["counts"]))
+        ],
+    }
+
+
+def summarise_data(argv):
+    import summarise
+
+    if not argv:
+        print("Usage: summarise <ClusterId> [param1 param2 ...]")
+        sys.exit(1)
+    selected = argv[1:] or summarise.DEFAULT_PARAMS
+    _, columns, rows = summarise.load_job_columns(argv[0], selected)
+    return {"cluster_id": argv[0], "total_jobs": rows,
+            "jobs": list(summarise.summary_rows(columns, selected, rows))}
+
+
+def hold_bucket_data(argv):
+    import hold_bucket
+    from hold_templates import TemplateCache
+    from schedd_cache import QueryCache, CachedSchedd
+
+    flags = {"--normalize", "--templates", "--no-cache"}
+    options = {arg for arg in argv if arg in flags}
+    args = [arg for arg in argv if arg not in flags]
+    if len(args) != 1:
+        print("Usage: hold_bucket <ClusterId> [--normalize] [--templates] [--no-cache]")
+        sys.exit(1)
+
+    query_cache = None if "--no-cache" in options else QueryCache()
+    try:
+        schedd = None if query_cache is None else CachedSchedd(query_cache)
+        total_jobs, reasons_by_code = hold_bucket.group_by_code(args[0], schedd)
+        if "--templates" in options:
+            with TemplateCache() as cache:
+                buckets = hold_bucket.bucket_held_jobs(reasons_by_code, cache=cache)
+        else:
+            buckets = hold_bucket.bucket_held_jobs(reasons_by_code, normalize="--normalize" in options)
+    finally:
+        if query_cache is not None:
+            query_cache.close()
+
+    return {
+        "cluster_id": args[0],
+        "total_jobs": total_jobs,
+        "held_jobs": sum(len(pairs) for pairs in reasons_by_code.values()),
+        "buckets": [{"code": code, "label": label, "subcode": subcode, "jobs": count, "example": example}
+                    for code, label, subcode, count, example in buckets],
+    }
+
+
+def dashboard_data(argv):
+    import argparse
+    import dashboard
+    from schedd_cache import QueryCache, CachedSchedd
+
+    parser = argparse.ArgumentParser(prog="dashboard")
+    parser.add_argument("cluster_ids", nargs="*", type=int)
+    parser.add_argument("--owner")
+    parser.add_argument("--constraint")
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args(argv)
+    if not (args.cluster_ids or args.owner or args.constraint):
+        print("Usage: dashboard <ClusterId> [ClusterId ...] [--owner USER] [--constraint EXPR]")
+        sys.exit(1)
+
+    query_cache = None if args.no_cache else QueryCache()
+    try:
+        schedd = None if query_cache is None else CachedSchedd(query_cache)
+        counts = dashboard.fetch_counts_batch(dashboard.JOB_STATES, args.cluster_ids, args.owner,
+                                              args.constraint, schedd)
+        if schedd is not None:
+            schedd.wait()
+    finally:
+        if query_cache is not None:
+            query_cache.close()
+    return {"clusters": {str(cluster_id): counts[cluster_id] for cluster_id in sorted(counts)}}
+
+
+REPORT_DATA = {
+    "analytics": analytics_data,
+    "histogram": histogram_data,
+    "summarise": summarise_data,
+    "hold_bucket": hold_bucket_data,
+    "dashboard": dashboard_data,
+}
+
+
+"""
+Runs one report request, capturing what it prints.
+
+    Parameters:
+        request (dict): "report", "argv", "cwd" and "format" ("text" or "json").
+
+    Returns:
+        dict: The response: "ok", "exit_code", "stdout", "stderr", "seconds",
+              and "data" for the json format.
+"""
+def run_request(request):
+    import traceback
+    from contextlib import redirect_stdout, redirect_stderr
+
+    report = request.get("report")
+    if report not in REPORTS:
+        return {"ok": False, "error": f"unknown report {report!r}"}
+
+    out, err = io.StringIO(), io.StringIO()
+    exit_code, data = 0, None
+    start = time.perf_counter()
+    previous_cwd, previous_argv = os.getcwd(), sys.argv
+    try:
+        os.chdir(request.get("cwd") or previous_cwd)
+        with redirect_stdout(out), redirect_stderr(err):
+            if request.get("format") == "json":
+                data = report_data(report, request.get("argv", []))
+            else:
+                run_script(report, request.get("argv", []))
+    except SystemExit as e:
+        if isinstance(e.code, str):
+            err.write(e.code + "\n")
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception:
+        err.write(traceback.format_exc())
+        exit_code = 1
+    finally:
+        os.chdir(previous_cwd)
+        sys.argv = previous_argv
+
+    return {"ok": True, "exit_code": exit_code, "stdout": out.getvalue(), "stderr": err.getvalue(),
+            "data": data, "seconds": time.perf_counter() - start}
+
+
+"""
+The daemon: accepts requests on a unix socket and runs the reports with warm caches.
+
+    Parameters:
+        path (str): The socket to listen on.
+        max_table_bytes (int): Memory kept for loaded columns.
+        max_templates (int): Hold-reason templates kept in memory.
+"""
+class ReportServer:
+    def __init__(self, path=DEFAULT_SOCKET, max_table_bytes=MAX_TABLE_BYTES, max_templates=MAX_TEMPLATES):
+        self.path = path
+        self.tables = LRUCache(max_bytes=max_table_bytes)
+        self.templates = LRUCache(max_entries=max_templates)
+        self.started = time.time()
+        self.requests = 0
+        self.busy = 0
+
+    # imports the reports and installs the memory caches
+    def warm_up(self):
+        import jobcache
+        import hold_templates
+
+        os.environ[IN_DAEMON_ENV] = "1"
+        jobcache.set_memory_cache(self.tables)
+        hold_templates.set_memory_cache(self.templates)
+        for report in REPORTS:
+            try:
+                __import__(report)
+            except ImportError as e:
+                print(f"[WARN] {report} is not available in the daemon: {e}")
+
+    def status(self):
+        import schedd_cache
+
+        return {
+            "ok": True,
+            "pid": os.getpid(),
+            "uptime": time.time() - self.started,
+            "requests": self.requests,
+            "busy": self.busy,
+            "tables": self.tables.stats(),
+            "templates": self.templates.stats(),
+            "schedd_connected": schedd_cache._local_schedd is not None,
+        }
+
+    async def respond(self, request):
+        import asyncio
+
+        op = request.get("op", "report")
+        if op == "status":
+            return self.status()
+        if op == "stop":
+            self.stopping.set()
+            return {"ok": True}
+        if op != "report":
+            return {"ok": False, "error": f"unknown op {op!r}"}
+
+        self.requests += 1
+        self.busy += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, run_request, request)
+        finally:
+            self.busy -= 1
+
+    async def handle(self, reader, writer):
+        try:
+            line = await reader.readline()
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {"ok": False, "error": "invalid request"}
+            else:
+                response = await self.respond(request)
+            writer.write(json.dumps(response).encode("utf-8") + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.stopping = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        server = await asyncio.start_unix_server(self.handle, path=self.path)
+        os.chmod(self.path, 0o600)
+        print(f"Report daemon {os.getpid()} listening on {self.path}")
+        async with server:
+            await self.stopping.wait()
+        self.executor.shutdown(wait=True)
+
+    # serves until stopped, removing the socket afterwards
+    def run(self):
+        import asyncio
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if os.path.exists(self.path):
+            try:
+                send_request({"op": "status"}, self.path, timeout=1)
+            except (OSError, ValueError):
+                os.remove(self.path)  # left behind by a daemon that died
+            else:
+                print(f"Error: a report daemon is already listening on {self.path}")
+                sys.exit(1)
+
+        self.warm_up()
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+# prints the daemon status
+def print_status(status):
+    tables, templates = status["tables"], status["templates"]
+    print(f"Report daemon {status['pid']}: up {status['uptime']:.0f}s, {status['requests']} request(s), "
+          f"{status['busy']} running")
+    print(f"  Tables   : {tables['entries']} cached, {tables['bytes'] / (1024 * 1024):.1f} MiB, "
+          f"{tables['hits']} hit(s), {tables['misses']} miss(es)")
+    print(f"  Templates: {templates['entries']} cached, {templates['hits']} hit(s), {templates['misses']} miss(es)")
+    print(f"  Schedd   : {'connected' if status['schedd_connected'] else 'not connected yet'}")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Long-lived report server for the CHTC tools.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help=f"unix socket (default: {DEFAULT_SOCKET})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the daemon in the foreground")
+    serve.add_argument("--max-table-mb", type=int, default=MAX_TABLE_BYTES // (1024 * 1024),
+                       help="memory kept for loaded cluster columns (default: %(default)s)")
+    commands.add_parser("status", help="print the daemon's uptime and cache statistics")
+    commands.add_parser("stop", help="stop the daemon")
+    run = commands.add_parser("run", help="run a report in the daemon")
+    run.add_argument("report", choices=REPORTS)
+    run.add_argument("--json", action="store_true", help="print the report's figures as JSON")
+    args, report_argv = parser.parse_known_args(argv)
+    if args.command != "run" and report_argv:
+        parser.error(f"unrecognized arguments: {' '.join(report_argv)}")
+
+    if args.command == "serve":
+        ReportServer(args.socket, args.max_table_mb * 1024 * 1024).run()
+        return
+
+    if args.command == "status":
+        request = {"op": "status"}
+    elif args.command == "stop":
+        request = {"op": "stop"}
+    else:
+        request = {"op": "report", "report": args.report, "argv": report_argv,
+                   "cwd": os.getcwd(), "format": "json" if args.json else "text"}
+    try:
+        response = send_request(request, args.socket, timeout=None if args.command == "run" else 10)
+    except (OSError, ValueError) as e:
+        print(f"Error: no report daemon on {args.socket} ({e}). Start one with: python daemon.py serve")
+        sys.exit(1)
+    if not response.get("ok"):
+        print(f"Error: {response.get('error')}")
+        sys.exit(1)
+
+    if args.command == "status":
+        print_status(response)
+    elif args.command == "stop":
+        print("Report daemon stopped")
+    else:
+        sys.stderr.write(response["stderr"])
+        if args.json and response["exit_code"] == 0:
+            print(json.dumps(response["data"], indent=2))
+        else:
+            sys.stdout.write(response["stdout"])
+        sys.exit(response["exit_code"])
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,251 @@
+import os
 import sys
 import math
-import htcondor
-import classad
+import time
+import argparse
+from schedd_cache import QueryCache, CachedSchedd, DEFAULT_TTL, local_schedd, print_stats
+from profiling import span, setup_from_argv
+from daemon import serve_from_daemon
 
 
 """
 This program provides an ASCII dashboard for the status of jobs in a cluster
+
+Several clusters can be shown at once, by listing their IDs or selecting them by
+Owner or a ClassAd constraint. All of them are then counted with one history query
+and one queue query, and printed as a per-cluster table.
+
+With --watch the dashboard of one cluster is redrawn in place every few seconds.
+The counts are computed once, then kept up to date from the cluster's job event
+log (or, if it has none, by polling the queue), so each refresh only costs as much
+as the number of new events.
+
+Outside --watch the query results are kept for a minute in a local cache shared
+by every process of the user (see schedd_cache.py), so dashboards opened again
+within that time do not contact the schedd. Use --no-cache for live counts.
 """
 
-# get data from the schedd
-def fetch_counts(clusterId, job_states):
-    schedd = htcondor.Schedd()
-    counts = { state: 0 for state in job_states }
+JOB_STATES = [
+    "Idle", "Running", "Removing", "Completed",
+    "Held", "Transferring Output", "Suspended"
+]
+
+# builds the ClassAd constraint for the selected clusters
+def cluster_constraint(cluster_ids=None, owner=None, constraint=None):
+    parts = []
+    if cluster_ids:
+        ids = ", ".join(str(int(cid)) for cid in cluster_ids)
+        parts.append(f"member(ClusterId, {{{ids}}})")
+    if owner:
+        import classad  # the bindings are imported on first use to keep startup fast
+        parts.append(f"Owner == {classad.quote(owner)}")
+    if constraint:
+        parts.append(f"({constraint})")
+    return " && ".join(parts) if parts else "true"
+
+
+"""
+Counts the jobs of many clusters per status with one history and one queue query,
+both projected to ClusterId and JobStatus.
+
+    Parameters:
+        job_states (List[str]): Status labels, indexed by JobStatus - 1.
+        cluster_ids (List[int] or None): Clusters to count.
+        owner (str or None): Only count jobs of this Owner.
+        constraint (str or None): Extra ClassAd constraint.
+        schedd (htcondor.Schedd or None): Schedd to query, the local one by default.
+
+    Returns:
+        Dict[int, Dict[str, int]]: Counts per status for each ClusterId. Every requested
+                                   cluster is present, even if no job was found.
+"""
+def fetch_counts_batch(job_states, cluster_ids=None, owner=None, constraint=None, schedd=None):
+    if schedd is None:
+        schedd = local_schedd()
+    query = cluster_constraint(cluster_ids, owner, constraint)
+    projection = ["ClusterId", "JobStatus"]
+
+    counts = {int(cid): {state: 0 for state in job_states} for cid in cluster_ids or []}
+
+    def add(ad):
+        cluster = counts.setdefault(ad.eval("ClusterId"), {state: 0 for state in job_states})
+        cluster[job_states[ad.eval("JobStatus") - 1]] += 1
+
     # history (finished jobs)
-    for ad in schedd.history(
-            constraint = f"ClusterId == {clusterId}",
-            projection = ["JobStatus"],
-            match = -1
-        ):
-        counts[job_states[ad.eval("JobStatus")]] += 1
+    with span("fetch history") as fetch_span:
+        fetch_span.rows = 0
+        for ad in schedd.history(
+                constraint = query,
+                projection = projection,
+                match = -1
+            ):
+            add(ad)
+            fetch_span.rows += 1
     # queue (running / pending jobs)
-    for ad in schedd.query(
-            constraint = f"ClusterId == {clusterId}",
-            projection = ["JobStatus"],
-            limit = -1
-        ):
-        counts[job_states[ad.eval("JobStatus")-1]] += 1
+    with span("fetch queue") as fetch_span:
+        fetch_span.rows = 0
+        for ad in schedd.query(
+                constraint = query,
+                projection = projection,
+                limit = -1
+            ):
+            add(ad)
+            fetch_span.rows += 1
     return counts
 
+# get data from the schedd
+def fetch_counts(clusterId, job_states, schedd=None):
+    return fetch_counts_batch(job_states, [clusterId], schedd=schedd)[int(clusterId)]
+
+"""
+Keeps the status counts of one cluster up to date without re-reading its history.
+The history is counted once; the jobs still in the queue are tracked by ProcId.
+Each refresh() then reads only the new events of the job event log (htcondor.JobEventLog).
+If the jobs have no event log, refresh() polls the queue instead and asks the history
+only for the jobs that have left the queue since the previous poll.
+
+    Parameters:
+        cluster_id (str or int): The cluster to watch.
+        job_states (List[str]): Status labels, indexed by JobStatus - 1.
+        schedd (htcondor.Schedd or None): Schedd to query, the local one by default.
+"""
+class ClusterWatcher:
+    # JobStatus a job has after each kind of event
+    EVENT_STATUS = {
+        "SUBMIT": 1,
+        "JOB_EVICTED": 1,
+        "JOB_RELEASED": 1,
+        "EXECUTE": 2,
+        "JOB_UNSUSPENDED": 2,
+        "JOB_ABORTED": 3,
+        "JOB_TERMINATED": 4,
+        "JOB_HELD": 5,
+        "JOB_SUSPENDED": 7,
+    }
+
+    def __init__(self, cluster_id, job_states, schedd=None):
+        self.schedd = schedd if schedd is not None else local_schedd()
+        self.cluster_id = int(cluster_id)
+        self.job_states = job_states
+        self.constraint = f"ClusterId == {self.cluster_id}"
+
+        self.finished = {state: 0 for state in job_states}
+        for ad in self.schedd.history(
+                constraint = self.constraint,
+                projection = ["JobStatus"],
+                match = -1
+            ):
+            self.finished[job_states[ad.eval("JobStatus") - 1]] += 1
+
+        self.states = {}
+        log_path = None
+        for ad in self.schedd.query(
+                constraint = self.constraint,
+                projection = ["ProcId", "JobStatus", "UserLog", "Iwd"],
+                limit = -1
+            ):
+            self.states[ad.eval("ProcId")] = ad.eval("JobStatus")
+            if log_path is None and "UserLog" in ad:
+                iwd = ad.eval("Iwd") if "Iwd" in ad else ""
+                log_path = os.path.join(iwd, ad.eval("UserLog"))
+
+        self.event_log = self.open_event_log(log_path)
+
+    # opens the job event log and skips the events that happened before the snapshot;
+    # returns None if there is no usable log (missing, unreadable, or a relative path
+    # without an Iwd to resolve it against), so refresh() polls the queue instead
+    def open_event_log(self, log_path):
+        if not log_path or not os.path.isabs(log_path) or not os.path.exists(log_path):
+            return None
+        import htcondor  # the bindings are imported on first use to keep startup fast
+
+        try:
+            event_log = htcondor.JobEventLog(log_path)
+            for _ in event_log.events(stop_after=0):
+                pass
+        except event_log_errors(htcondor) as e:
+            print(f"[WARN] Cannot read the job event log {log_path}, polling the queue instead: {e}")
+            return None
+        return event_log
+
+    # current counts per status
+    def counts(self):
+        counts = dict(self.finished)
+        for status in self.states.values():
+            counts[self.job_states[status - 1]] += 1
+        return counts
+
+    # True once no job of the cluster is idle, running, held or suspended
+    def done(self):
+        return all(status in (3, 4) for status in self.states.values())
+
+    def refresh(self):
+        if self.event_log is not None:
+            import htcondor
+
+            try:
+                self.read_events()
+                return
+            except event_log_errors(htcondor) as e:
+                # the log was removed or rotated away: poll from now on
+                print(f"[WARN] Cannot read the job event log any more, polling the queue instead: {e}")
+                self.event_log = None
+        self.poll_queue()
+
+    # applies the events written since the last refresh
+    def read_events(self):
+        for event in self.event_log.events(stop_after=0):
+            if event.cluster != self.cluster_id:
+                continue
+            status = self.EVENT_STATUS.get(event.type.name)
+            if status is not None:
+                self.states[event.proc] = status
+
+    # re-reads the queue, and the history of the jobs that left it
+    def poll_queue(self):
+        queued = {}
+        for ad in self.schedd.query(
+                constraint = self.constraint,
+                projection = ["ProcId", "JobStatus"],
+                limit = -1
+            ):
+            queued[ad.eval("ProcId")] = ad.eval("JobStatus")
+
+        left = [proc for proc, status in self.states.items()
+                if proc not in queued and status not in (3, 4)]
+        if left:
+            procs = ", ".join(str(proc) for proc in left)
+            for ad in self.schedd.history(
+                    constraint = f"{self.constraint} && member(ProcId, {{{procs}}})",
+                    projection = ["ProcId", "JobStatus"],
+                    match = len(left)
+                ):
+                queued[ad.eval("ProcId")] = ad.eval("JobStatus")
+
+        for proc, status in self.states.items():
+            queued.setdefault(proc, status)
+        self.states = queued
+
+# exceptions reading a job event log can raise, depending on the version of the bindings
+def event_log_errors(htcondor):
+    return (OSError, RuntimeError) + tuple(
+        error for error in (getattr(htcondor, "HTCondorException", None),) if error is not None)
+
+# redraws the dashboard of one cluster in place until it finishes or Ctrl-C
+def watch(clusterId, job_states, interval=5, schedd=None):
+    watcher = ClusterWatcher(clusterId, job_states, schedd)
+    try:
+        while True:
+            print("\033[H\033[J", end="")
+            print(f"\nCluster {clusterId} Status Dashboard (refreshed {time.strftime('%H:%M:%S')})\n")
+            draw_bars(watcher.counts(), job_states)
+            if watcher.done():
+                break
+            time.sleep(interval)
+            watcher.refresh()
+    except KeyboardInterrupt:
+        print()
+
 #print the dashboard
 def draw_bars(counts, job_states, bar_width=50):
     # compute column widths
@@ -61,18 +279,72 @@ def draw_bars(counts, job_states, bar_width=50):
 
         print(f"{state_str} | {bar_str} | {cnt_str} | {per_str}")
 
+#print one row of counts per cluster
+def draw_table(counts_by_cluster, job_states):
+    columns = ["Cluster"] + job_states + ["Total"]
+    rows = []
+    for cluster_id in sorted(counts_by_cluster):
+        counts = counts_by_cluster[cluster_id]
+        rows.append([str(cluster_id)] + [str(counts[state]) for state in job_states]
+                    + [str(sum(counts.values()))])
+
+    widths = [max(len(row[i]) for row in rows + [columns]) for i in range(len(columns))]
+    header = " | ".join(name.rjust(width) for name, width in zip(columns, widths))
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(" | ".join(value.rjust(width) for value, width in zip(row, widths)))
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python dashboard_once.py <ClusterId>")
+    parser = argparse.ArgumentParser(description="ASCII status dashboard for HTCondor clusters.")
+    parser.add_argument("cluster_ids", nargs="*", type=int, help="ClusterIds to show")
+    parser.add_argument("--owner", help="show every cluster of this Owner")
+    parser.add_argument("--constraint", help="extra ClassAd constraint for the jobs")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep redrawing the dashboard of one cluster")
+    parser.add_argument("--interval", type=float, default=5,
+                        help="seconds between refreshes with --watch (default: 5)")
+    parser.add_argument("--no-cache", action="store_true", help="always query the schedd")
+    parser.add_argument("--ttl", type=float, default=DEFAULT_TTL,
+                        help=f"seconds cached results are reused (default: {DEFAULT_TTL})")
+    parser.add_argument("--stale", type=float, default=0,
+                        help="seconds past the TTL a cached result is still shown while it is refreshed")
+    parser.add_argument("--cache-stats", action="store_true", help="print the query cache statistics")
+    setup_from_argv()
+    if "--watch" not in sys.argv:
+        serve_from_daemon("dashboard")
+    args = parser.parse_args()
+
+    if not (args.cluster_ids or args.owner or args.constraint):
+        print("Usage: python dashboard_once.py <ClusterId> [ClusterId ...] [--owner USER] [--constraint EXPR]")
         sys.exit(1)
 
-    clusterId  = sys.argv[1]
-    job_states = [
-        "Idle", "Running", "Removing", "Completed",
-        "Held", "Transferring Output", "Suspended"
-    ]
+    job_states = JOB_STATES
+
+    if args.watch:
+        if len(args.cluster_ids) != 1 or args.owner or args.constraint:
+            print("Error: --watch needs exactly one ClusterId.")
+            sys.exit(1)
+        watch(args.cluster_ids[0], job_states, args.interval)
+        sys.exit(0)
+
+    cache = None if args.no_cache else QueryCache()
+    schedd = None if cache is None else CachedSchedd(cache, ttl=args.ttl, stale_while_revalidate=args.stale)
 
-    counts = fetch_counts(clusterId, job_states)
-    print(f"\nCluster {clusterId} Status Dashboard\n")
-    draw_bars(counts, job_states)
+    if len(args.cluster_ids) == 1 and not (args.owner or args.constraint):
+        clusterId = args.cluster_ids[0]
+        counts = fetch_counts(clusterId, job_states, schedd)
+        with span("render"):
+            print(f"\nCluster {clusterId} Status Dashboard\n")
+            draw_bars(counts, job_states)
+    else:
+        counts_by_cluster = fetch_counts_batch(job_states, args.cluster_ids, args.owner, args.constraint, schedd)
+        with span("render", len(counts_by_cluster)):
+            print(f"\nStatus Dashboard for {len(counts_by_cluster)} Cluster(s)\n")
+            draw_table(counts_by_cluster, job_states)
 
+    if cache is not None:
+        schedd.wait()
+        if args.cache_stats:
+            print_stats(cache.stats())
+        cache.close()
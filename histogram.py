@@ -1,18 +1,52 @@
 import sys
 import os
-import pandas as pd
+from profiling import span, setup_from_argv
+from daemon import serve_from_daemon
+
+# run as a script, hand the report to the daemon (see daemon.py) before the
+# statistics modules below are imported; they are not needed when it answers
+if __name__ == "__main__":
+    setup_from_argv()
+    serve_from_daemon("histogram")
+
 import numpy as np
-import subprocess
 from datetime import datetime, timedelta
+from jobcache import float_column, iter_column_chunks, CHUNK_SIZE
+from jobtable import load_table
+from store import load_report_table, store_filters_from_argv
+from sketch import KLLSketch
+from sampling import read_sample_info, describe_sample, bootstrap, bootstrap_percentiles, print_estimates
+from utils import REPORT_COLUMNS, sample_csv_path
 
 """
 This program takes data from the cluster_data folder and gives an ASCII histogram
 of the runtimes for a cluster. The runtimes are grouped by percentile range of the runtimes
 
+Every job is assigned to its bin once (np.searchsorted on the percentile edges), and
+the per-bin medians and job lists come from one sort, so the cost does not grow with
+the number of bins.
+
+With --stream the CSV is read in chunks and only sketches are kept in memory: a
+first pass estimates the percentile edges with a KLL sketch (each edge's rank is
+within about 1% of the exact percentile, see sketch.py), a second pass counts the
+jobs of every bin exactly for those edges and sketches the per-bin medians, and a
+third pass, only if the job list was asked for, prints the IDs of the fast bins.
+
+With --sample the histogram is drawn from the random sample written by
+"query.py <clusterId> --sample N", and is followed by the estimated bin edges
+and share of fast jobs of the whole cluster, with bootstrap confidence
+intervals (see sampling.py).
+
 """
 
+# columns of the cluster CSV that the histogram reads
+COLUMNS = REPORT_COLUMNS["histogram"]
+
 # Time limit for fast jobs, 600 by default
-is_red = median_time < 600
+FAST_JOB_SECONDS = 600
+
+RED = "\033[91m"
+RESET = "\033[0m"
 
 # function to format seconds into human readable format
 def format_seconds_human(seconds):
@@ -58,50 +92,90 @@ def format_epoch_human_relative(epoch_seconds):
 
 
 
-# function to print the output
-def histogram(cluster_id, df, percentiles=10, max_width=20, show_fast_jobs=False):
-    if df.empty or "RemoteWallClockTime" not in df.columns:
-        print("[WARN] No valid data to plot.")
-        return
-    
-    cluster_id = cluster_id
-    runtimes = df["RemoteWallClockTime"].astype(float).to_numpy()
-    cluster_ids = df["ClusterId"].astype(str).to_numpy()
-    proc_ids = df["ProcId"].astype(str).to_numpy()
-
+"""
+Splits the runtimes into percentile bins in a single pass.
+Bins are [left, right), except the last one which is [left, right].
+
+    Parameters:
+        runtimes (np.ndarray): Runtime of every job, in seconds (no NaN).
+        percentiles (int): Number of bins.
+
+    Returns:
+        dict: "percentiles" (bin boundaries in %), "edges" (boundaries in seconds),
+              "counts" and "medians" (per bin, 0 for an empty bin), and "order" and
+              "starts": the job indices grouped by bin (in their original order) and the
+              offset of each bin in that grouping.
+"""
+def percentile_bins(runtimes, percentiles=10):
     percentiles_list = np.linspace(0, 100, percentiles + 1)
     bin_edges = np.percentile(runtimes, percentiles_list)
-    counts, _ = np.histogram(runtimes, bins=bin_edges)
-    max_count = counts.max()
-
-    print("\nHistogram of Job Runtimes by Percentiles:\n")
-    print(f"ClusterId: {cluster_id}\n")
 
-    # Show submission and completion times
+    bin_index = np.searchsorted(bin_edges, runtimes, side="right") - 1
+    bin_index = np.clip(bin_index, 0, percentiles - 1)
+    counts = np.bincount(bin_index, minlength=percentiles)
+    starts = np.concatenate(([0], np.cumsum(counts)))
+
+    # bin index grows with the runtime, so every bin is a contiguous run of the sorted runtimes
+    sorted_times = np.sort(runtimes)
+    last = max(len(sorted_times) - 1, 0)
+    lower = np.minimum(starts[:-1] + (counts - 1) // 2, last)
+    upper = np.minimum(starts[:-1] + counts // 2, last)
+    if len(sorted_times):
+        medians = np.where(counts > 0, (sorted_times[lower] + sorted_times[upper]) / 2, 0)
+    else:
+        medians = np.zeros(percentiles)
+
+    return {
+        "percentiles": percentiles_list,
+        "edges": bin_edges,
+        "counts": counts,
+        "medians": medians,
+        "order": np.argsort(bin_index, kind="stable"),
+        "starts": starts,
+    }
+
+
+# function to print the first submission and last completion of the cluster
+def print_time_span(df):
     if "QDate" in df.columns and "CompletionDate" in df.columns:
         submit_times = df["QDate"].dropna().astype(float)
         completion_times = df["CompletionDate"].dropna().astype(float)
 
-        if not submit_times.empty:
-            cluster_submit_time = format_epoch_human_relative(submit_times.min())
-            print(f"First Submitted : {cluster_submit_time}")
-        else:
-            print("First Submitted : N/A")
+        print_time_span_values(
+            submit_times.min() if not submit_times.empty else None,
+            completion_times.max() if not completion_times.empty else None,
+        )
 
-        if not completion_times.empty:
-            cluster_completion_time = format_epoch_human_relative(completion_times.max())
-            print(f"Last Completed  : {cluster_completion_time}")
-        else:
-            print("Last Completed  : N/A")
 
-        print("") 
+# function to print the time span from the earliest QDate and latest CompletionDate (None if unknown)
+def print_time_span_values(first_submit, last_completion):
+    if first_submit is not None:
+        cluster_submit_time = format_epoch_human_relative(first_submit)
+        print(f"First Submitted : {cluster_submit_time}")
+    else:
+        print("First Submitted : N/A")
 
+    if last_completion is not None:
+        cluster_completion_time = format_epoch_human_relative(last_completion)
+        print(f"Last Completed  : {cluster_completion_time}")
+    else:
+        print("Last Completed  : N/A")
+
+    print("") 
+
+
+# function to print the histogram rows and notes for computed bins
+# and return the mask of bins whose median runtime is under FAST_JOB_SECONDS
+def print_bins(bins, max_width=20):
+    percentiles_list = bins["percentiles"]
+    bin_edges = bins["edges"]
+    counts = bins["counts"]
+    max_count = counts.max()
+    is_red = bins["medians"] < FAST_JOB_SECONDS
 
     pct_width = 11
     label_width = 30
     count_width = 7
-    RED = "\033[91m"
-    RESET = "\033[0m"
 
     header = (
         f"{'Percentile':<{pct_width}}"
@@ -112,25 +186,10 @@ def histogram(cluster_id, df, percentiles=10, max_width=20, show_fast_jobs=False
     print(header)
     print("-" * len(header))
 
-    jobs_under_10_min_median = 0
-    fast_job_ids = []
-
     for i in range(len(counts)):
         left = bin_edges[i]
         right = bin_edges[i + 1]
-
-        in_bin_mask = (runtimes >= left) & (runtimes <= right) if i == len(counts) - 1 else (runtimes >= left) & (runtimes < right)
-        in_bin_times = runtimes[in_bin_mask]
-        in_bin_clusters = cluster_ids[in_bin_mask]
-        in_bin_procs = proc_ids[in_bin_mask]
-
-        median_time = np.median(in_bin_times) if len(in_bin_times) > 0 else 0
-
-
-        color = RED if is_red else ""
-        if is_red:
-            jobs_under_10_min_median += len(in_bin_times)
-            fast_job_ids.extend([f"{cid}.{pid}" for cid, pid in zip(in_bin_clusters, in_bin_procs)])
+        color = RED if is_red[i] else ""
 
         left_label = format_seconds_human(left)
         right_label = format_seconds_human(right)
@@ -146,38 +205,231 @@ def histogram(cluster_id, df, percentiles=10, max_width=20, show_fast_jobs=False
         print(f"{pct_range}{time_range} | {colored_bar} {counts[i]:>{count_width}}")
 
     print(f"\n{RED}Note:{RESET} Bars in red represent bins with median runtime < 10 minutes.")
-    print(f"{RED}Info:{RESET} Total number of jobs in such bins: {jobs_under_10_min_median}")
+    print(f"{RED}Info:{RESET} Total number of jobs in such bins: {counts[is_red].sum()}")
+    return is_red
 
-    if show_fast_jobs and fast_job_ids:
-        print(f"\nList of Job IDs with median runtime < 10 minutes:")
-        print(", ".join(fast_job_ids))
 
+# function to print the output
+def histogram(cluster_id, df, percentiles=10, max_width=20, show_fast_jobs=False):
+    if df.empty or "RemoteWallClockTime" not in df.columns:
+        print("[WARN] No valid data to plot.")
+        return
+    
+    cluster_id = cluster_id
+    runtimes = df["RemoteWallClockTime"].astype(float).to_numpy()
+    # jobs without a runtime are left out, as in histogram_streaming()
+    valid = np.isfinite(runtimes)
+    if not valid.any():
+        print("[WARN] No valid data to plot.")
+        return
+    runtimes = runtimes[valid]
+    cluster_ids = df["ClusterId"].astype(str).to_numpy()[valid]
+    proc_ids = df["ProcId"].astype(str).to_numpy()[valid]
+
+    with span("compute", len(runtimes)):
+        bins = percentile_bins(runtimes, percentiles)
+
+    with span("render"):
+        print("\nHistogram of Job Runtimes by Percentiles:\n")
+        print(f"ClusterId: {cluster_id}\n")
+
+        # Show submission and completion times
+        print_time_span(df)
+
+        is_red = print_bins(bins, max_width)
+
+        if show_fast_jobs and is_red.any():
+            order, starts = bins["order"], bins["starts"]
+            fast_jobs = np.concatenate([order[starts[i]:starts[i + 1]] for i in np.flatnonzero(is_red)])
+            if len(fast_jobs):
+                print(f"\nList of Job IDs with median runtime < 10 minutes:")
+                print(", ".join(f"{cid}.{pid}" for cid, pid in zip(cluster_ids[fast_jobs], proc_ids[fast_jobs])))
+
+
+"""
+Prints the histogram in bounded memory by streaming the CSV in chunks (see the module notes).
+Takes the same options as histogram().
+"""
+def histogram_streaming(cluster_id, path, percentiles=10, max_width=20, show_fast_jobs=False,
+                        chunk_size=CHUNK_SIZE):
+    # Pass 1: percentile edges and time span
+    runtime_sketch = KLLSketch()
+    first_submit, last_completion = None, None
+    has_time_columns = False
+    with span("pass 1: edges") as pass_span:
+        for columns, rows in iter_column_chunks(path, COLUMNS, chunk_size):
+            runtimes = float_column(columns, "RemoteWallClockTime", rows)
+            runtime_sketch.update(runtimes[np.isfinite(runtimes)])
+            if "QDate" in columns and "CompletionDate" in columns:
+                has_time_columns = True
+                submit = float_column(columns, "QDate", rows)
+                completion = float_column(columns, "CompletionDate", rows)
+                if not np.isnan(submit).all():
+                    first_submit = np.nanmin(submit) if first_submit is None else min(first_submit, np.nanmin(submit))
+                if not np.isnan(completion).all():
+                    last_completion = np.nanmax(completion) if last_completion is None else max(last_completion, np.nanmax(completion))
+        pass_span.rows = runtime_sketch.count
+
+    if not runtime_sketch.count:
+        print("[WARN] No valid data to plot.")
+        return
+
+    percentiles_list = np.linspace(0, 100, percentiles + 1)
+    bin_edges = runtime_sketch.quantiles(percentiles_list / 100)
+
+    # Pass 2: exact counts for those edges and a median sketch per bin
+    counts = np.zeros(percentiles, dtype=np.int64)
+    median_sketches = [KLLSketch() for _ in range(percentiles)]
+    with span("pass 2: counts", runtime_sketch.count):
+        for columns, rows in iter_column_chunks(path, COLUMNS, chunk_size):
+            runtimes = float_column(columns, "RemoteWallClockTime", rows)
+            runtimes = runtimes[np.isfinite(runtimes)]
+            bin_index = np.clip(np.searchsorted(bin_edges, runtimes, side="right") - 1, 0, percentiles - 1)
+            counts += np.bincount(bin_index, minlength=percentiles)
+            order = np.argsort(bin_index, kind="stable")
+            starts = np.concatenate(([0], np.cumsum(np.bincount(bin_index, minlength=percentiles))))
+            for i in np.flatnonzero(starts[1:] > starts[:-1]):
+                median_sketches[i].update(runtimes[order[starts[i]:starts[i + 1]]])
+
+    medians = np.array([sketch.quantile(0.5) if sketch.count else 0 for sketch in median_sketches])
+    bins = {"percentiles": percentiles_list, "edges": bin_edges, "counts": counts, "medians": medians}
+
+    with span("render"):
+        print("\nHistogram of Job Runtimes by Percentiles:\n")
+        print(f"ClusterId: {cluster_id}\n")
+        if has_time_columns:
+            print_time_span_values(first_submit, last_completion)
+
+        is_red = print_bins(bins, max_width)
+
+    # Pass 3: the IDs of the jobs in fast bins, printed as they are found
+    with span("pass 3: fast jobs"):
+        if show_fast_jobs and counts[is_red].sum():
+            print(f"\nList of Job IDs with median runtime < 10 minutes:")
+            separator = ""
+            for columns, rows in iter_column_chunks(path, COLUMNS, chunk_size):
+                runtimes = float_column(columns, "RemoteWallClockTime", rows)
+                valid = np.isfinite(runtimes)
+                bin_index = np.clip(np.searchsorted(bin_edges, runtimes[valid], side="right") - 1, 0, percentiles - 1)
+                fast = is_red[bin_index]
+                cluster_ids = columns["ClusterId"][valid][fast].astype(str)
+                proc_ids = columns["ProcId"][valid][fast].astype(str)
+                if len(cluster_ids):
+                    print(separator + ", ".join(f"{cid}.{pid}" for cid, pid in zip(cluster_ids, proc_ids)), end="")
+                    separator = ", "
+            print()
+
+
+# function to print the histogram of a random sample of the cluster and the
+# confidence intervals of its bin edges and of the share of fast jobs
+def histogram_sample(cluster_id, df, path, percentiles=10, max_width=20, show_fast_jobs=False):
+    print(describe_sample(read_sample_info(path), len(df)))
+    histogram(cluster_id, df, percentiles, max_width, show_fast_jobs)
+    if df.empty or "RemoteWallClockTime" not in df.columns:
+        return
+
+    runtimes = df["RemoteWallClockTime"].astype(float).dropna().to_numpy()
+    with span("bootstrap", len(runtimes)):
+        percentiles_list = np.linspace(0, 100, percentiles + 1)
+        edges, low, high = bootstrap_percentiles(runtimes, percentiles_list)
+        share, share_low, share_high = bootstrap(
+            runtimes, lambda rows: (rows < FAST_JOB_SECONDS).mean(axis=1)[:, np.newaxis] * 100)
+
+    with span("render"):
+        estimates = [(f"{int(p):02}% runtime", edges[i], low[i], high[i], format_seconds_human)
+                     for i, p in enumerate(percentiles_list)]
+        estimates.append(("Jobs under 10 minutes (%)", share[0], share_low[0], share_high[0], "{:.1f}%".format))
+        print()
+        print_estimates("Sample Estimates", estimates)
+
+
+# function to run query.py, printing its output through sys.stdout so that it is
+# captured along with the report (batch.py workers, the daemon) instead of going
+# straight to the terminal
+def run_query_script(*args):
+    import subprocess
+
+    query_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query.py")
+    result = subprocess.run([sys.executable, query_script, *args],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    print(result.stdout, end="")
+    result.check_returncode()
+
+
+# function to make sure the CSV of a cluster exists, running query.py if needed,
+# and return its path (None if it could not be fetched)
+# with refresh=True an existing CSV is brought up to date with query.py --incremental
+def ensure_csv(cluster_id, refresh=False):
+    from subprocess import CalledProcessError
 
-# function to get data from the folder or call the query 
-def load_data_for_cluster(cluster_id):
     path = f"cluster_data/cluster_{cluster_id}_jobs.csv"
     if not os.path.exists(path):
         print(f"[INFO] CSV for ClusterId {cluster_id} not found. Attempting to run query.py...")
         try:
-            subprocess.run([sys.executable, "query.py", cluster_id], check=True)
-        except subprocess.CalledProcessError as e:
+            with span("fetch"):
+                run_query_script(cluster_id)
+        except CalledProcessError as e:
             print(f"[ERROR] query.py failed: {e}")
             return None
+    elif refresh:
+        print(f"[INFO] Refreshing CSV for ClusterId {cluster_id} with query.py --incremental...")
+        try:
+            with span("fetch"):
+                run_query_script(cluster_id, "--incremental")
+        except CalledProcessError as e:
+            print(f"[WARN] query.py refresh failed, using the existing CSV: {e}")
+    return path
+
+
+# function to get data from the folder or call the query, or from the job store given store filters
+def load_data_for_cluster(cluster_id, refresh=False, store_filters=None):
+    if store_filters is not None:
+        with span("load") as load_span:
+            df = load_report_table(cluster_id, COLUMNS, store_filters).to_frame()
+            load_span.rows = len(df)
+        return df
+
+    path = ensure_csv(cluster_id, refresh)
+    if path is None:
+        return None
     try:
-        df = pd.read_csv(path)
+        with span("load") as load_span:
+            df = load_table(path, COLUMNS).to_frame()
+            load_span.rows = len(df)
         return df
     except Exception as e:
         print(f"[ERROR] Could not load CSV: {e}")
         return None
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python histogram.py <clusterId> [printList]")
+    store_filters = store_filters_from_argv()
+    refresh_flag = "--refresh" in sys.argv
+    stream_flag = "--stream" in sys.argv
+    sample_flag = "--sample" in sys.argv
+    if len(sys.argv) < 2 or (store_filters is not None and (refresh_flag or stream_flag or sample_flag)):
+        print("Usage: python histogram.py <clusterId> [printList] [--refresh] [--stream | --sample | --store [filters]] [--profile]")
         sys.exit(1)
 
-    cluster_id = sys.argv[1]
-    print_list_flag = sys.argv[2].lower() in ("true", "yes", "1") if len(sys.argv) > 2 else False
-
-    df = load_data_for_cluster(cluster_id)
-    if df is not None:
-        histogram(cluster_id, df, percentiles=10, max_width=20, show_fast_jobs=print_list_flag)
+    args = [arg for arg in sys.argv[1:] if arg not in ("--refresh", "--stream", "--sample")]
+
+    cluster_id = args[0]
+    print_list_flag = args[1].lower() in ("true", "yes", "1") if len(args) > 1 else False
+
+    if sample_flag:
+        path = sample_csv_path(cluster_id, "cluster_data")
+        if not os.path.exists(path):
+            print(f"[ERROR] No sample for ClusterId {cluster_id}. "
+                  f"Fetch one first with: python query.py {cluster_id} --sample <N>")
+            sys.exit(1)
+        with span("load") as load_span:
+            df = load_table(path, COLUMNS).to_frame()
+            load_span.rows = len(df)
+        histogram_sample(cluster_id, df, path, percentiles=10, max_width=20, show_fast_jobs=print_list_flag)
+    elif stream_flag:
+        path = ensure_csv(cluster_id, refresh=refresh_flag)
+        if path is not None:
+            histogram_streaming(cluster_id, path, percentiles=10, max_width=20, show_fast_jobs=print_list_flag)
+    else:
+        df = load_data_for_cluster(cluster_id, refresh=refresh_flag, store_filters=store_filters)
+        if df is not None:
+            histogram(cluster_id, df, percentiles=10, max_width=20, show_fast_jobs=print_list_flag)
@@ -1,16 +1,21 @@
+import re
 import sys
-import htcondor
-import classad
+from bisect import bisect_left, bisect_right
 from difflib import SequenceMatcher
 from tabulate import tabulate
+from hold_templates import TemplateCache
+from schedd_cache import QueryCache, CachedSchedd, local_schedd, print_stats
+from profiling import span, setup_from_argv
+from daemon import serve_from_daemon
 
 
 """
 This program buckets and tabulates the held jobs for a cluster
 
+The schedd query is answered from a local cache for up to a minute (see
+schedd_cache.py), so running the report again right away does not contact the
+schedd. Use --no-cache to always query it.
 """
-# Global variable to keep track of total jobs
-total_jobs = 0
 
 # Mapping of HoldReasonCodes to their explanations
 HOLD_REASON_CODES = {
@@ -54,75 +59,227 @@ HOLD_REASON_CODES = {
 }
 
 
+# volatile parts of hold messages, replaced when normalize=True
+VOLATILE_TOKENS = [
+    (re.compile(r"\bslot\d+(?:_\d+)?@\S+"), "<slot>"),
+    (re.compile(r"(?:/[^\s/:'\"]+)+/?"), "<path>"),
+    (re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"), "<ip>"),
+    (re.compile(r"\b[\w-]+(?:\.[\w-]+)+\.(?:edu|org|com|net|io|gov)\b"), "<host>"),
+    (re.compile(r"\d+"), "<n>"),
+]
+
+# replaces paths, hosts, slot names and numbers in a hold reason with placeholders
+def normalize_reason(reason):
+    for pattern, placeholder in VOLATILE_TOKENS:
+        reason = pattern.sub(placeholder, reason)
+    return reason
+
+
 """
 Groups similar hold reason messages using fuzzy string matching (difflib.SequenceMatcher).
 The default threshold has been kept as 0.7 as was found optimal by testing error messages
 
+Each reason joins the first (oldest) bucket whose first reason has a similarity ratio
+of at least the threshold, otherwise it starts a new bucket. To make this scale:
+    - identical reasons are only matched once; repeats go straight to the same bucket,
+    - buckets are indexed by the length of their first reason, and only buckets whose
+      length allows a ratio above the threshold are looked at,
+    - candidates are filtered with the real_quick_ratio() and quick_ratio() upper
+      bounds before the exact ratio() is computed,
+    - each bucket keeps one SequenceMatcher, so its first reason is indexed only once.
+None of these steps change the result, so the buckets are the same as comparing every
+reason to every bucket.
+
     Parameters:
         reason_list (List[str]): List of textual hold reasons for the jobs.
         subcodes (List[int]): Corresponding subcodes for the reasons.
         threshold (float): Similarity ratio (between 0 and 1) above which reasons are considered similar.
+        normalize (bool): Compare the reasons after normalize_reason(), so messages that only
+                          differ in paths, hosts or numbers are matched as one. This can
+                          merge buckets that would otherwise stay separate.
 
     Returns:
         List[List[Tuple[str, int]]]: A list of "buckets", where each bucket contains tuples of (reason, subcode)
                                      that are textually similar to each other.
 """
 
-def bucket_reasons_with_subcodes(reason_list, subcodes, threshold=0.7):
+def bucket_reasons_with_subcodes(reason_list, subcodes, threshold=0.7, normalize=False):
     buckets = []
+    matchers = []
+    bucket_of = {}
+    lengths = []
+    buckets_by_length = {}
+
     for reason, subcode in zip(reason_list, subcodes):
-        placed = False
-        for bucket in buckets:
-            ratio = SequenceMatcher(None, reason, bucket[0][0]).ratio()
-            if ratio >= threshold:
-                bucket.append((reason, subcode))
-                placed = True
-                break
-        if not placed:
+        key = normalize_reason(reason) if normalize else reason
+
+        index = bucket_of.get(key)
+        if index is None:
+            index = find_bucket(key, matchers, lengths, buckets_by_length, threshold)
+            bucket_of[key] = index
+
+        if index is None:
+            bucket_of[key] = len(buckets)
             buckets.append([(reason, subcode)])
+            matchers.append(SequenceMatcher(None, b=key))
+            if len(key) not in buckets_by_length:
+                lengths.insert(bisect_left(lengths, len(key)), len(key))
+                buckets_by_length[len(key)] = []
+            buckets_by_length[len(key)].append(len(buckets) - 1)
+        else:
+            buckets[index].append((reason, subcode))
     return buckets
 
+# returns the index of the first bucket similar enough to the reason, or None
+def find_bucket(reason, matchers, lengths, buckets_by_length, threshold):
+    size = len(reason)
+    if threshold > 0:
+        # ratio <= 2 * min(la, lb) / (la + lb), which bounds the lengths that can match
+        low = bisect_left(lengths, int(size * threshold / (2 - threshold)) - 1)
+        high = bisect_right(lengths, int(size * (2 - threshold) / threshold) + 1)
+    else:
+        low, high = 0, len(lengths)
+
+    candidates = sorted(i for length in lengths[low:high] for i in buckets_by_length[length])
+    for i in candidates:
+        matcher = matchers[i]
+        matcher.set_seq1(reason)
+        if (matcher.real_quick_ratio() >= threshold
+                and matcher.quick_ratio() >= threshold
+                and matcher.ratio() >= threshold):
+            return i
+    return None
+
+
+
+"""
+Buckets the hold reasons of one HoldReasonCode using the persistent template cache.
+Reasons whose normalized form is already in the cache are assigned to their template
+directly. The remaining reasons are bucketed with bucket_reasons_with_subcodes(), with
+the code's known templates placed first so a new message that resembles one of them
+joins it; every other bucket becomes a new template. The new mappings are saved.
+
+    Parameters:
+        code (int): HoldReasonCode the reasons belong to.
+        reason_list (List[str]): List of textual hold reasons for the jobs.
+        subcodes (List[int]): Corresponding subcodes for the reasons.
+        cache (TemplateCache): The open template cache.
+        threshold (float): Similarity threshold for the fuzzy path.
+
+    Returns:
+        List[List[Tuple[str, int]]]: Buckets of (reason, subcode), one per template,
+                                     in order of first appearance.
+"""
+def bucket_with_templates(code, reason_list, subcodes, cache, threshold=0.7):
+    normalized_list = [normalize_reason(reason) for reason in reason_list]
+    template_of = {}
+    unseen = []
+    for normalized in normalized_list:
+        if normalized in template_of:
+            continue
+        template_of[normalized] = cache.lookup(code, normalized)
+        if template_of[normalized] is None:
+            unseen.append(normalized)
+
+    if unseen:
+        known = cache.templates(code)
+        candidates = [normalized for _, normalized in known] + unseen
+        for bucket in bucket_reasons_with_subcodes(candidates, range(len(candidates)), threshold):
+            first = bucket[0][1]
+            template_id = known[first][0] if first < len(known) else cache.add_template(code, bucket[0][0])
+            for normalized, position in bucket:
+                if position >= len(known):
+                    template_of[normalized] = template_id
+                    cache.remember(code, normalized, template_id)
+        cache.commit()
+
+    buckets = {}
+    for reason, normalized, subcode in zip(reason_list, normalized_list, subcodes):
+        buckets.setdefault(template_of[normalized], []).append((reason, subcode))
+    return list(buckets.values())
+
 
 
 """ 
-Queries the HTCondor schedd for held jobs in the specified cluster and groups them by their HoldReasonCode.
+Queries the HTCondor schedd for the jobs in the specified cluster and groups the held ones by their HoldReasonCode.
+A single projected query is made for the whole cluster; its ads are streamed (xquery() in the
+version 1 bindings) to count the jobs and collect the hold reasons in the same pass.
 The function then sends the groups of jobs with the same code to be bucketed by string similarity in bucket_reasons_with_subcodes()
 
     Parameters:
         cluster_id (str or int): The ID of the cluster to analyze.
+        schedd (htcondor.Schedd or None): Schedd to query, the local one by default.
 
     Returns:
-        Dict[int, List[Tuple[str, int]]]: A dictionary mapping each HoldReasonCode to a list of (HoldReason, HoldReasonSubCode) tuples.
+        Tuple[int, Dict[int, List[Tuple[str, int]]]]: The number of jobs in the cluster, and a dictionary
+                                                      mapping each HoldReasonCode to a list of
+                                                      (HoldReason, HoldReasonSubCode) tuples.
 """
-def group_by_code(cluster_id):
-    global total_jobs
-    schedd = htcondor.Schedd()
+def group_by_code(cluster_id, schedd=None):
+    if schedd is None:
+        schedd = local_schedd()
+    query = getattr(schedd, "xquery", schedd.query)
+
+    total_jobs = 0
     reasons_by_code = {}
 
-    jobs_q = schedd.query(constraint=f"ClusterId == {cluster_id}")
-    total_jobs = len(jobs_q)
+    with span("fetch") as fetch_span:
+        for ad in query(
+            f"ClusterId == {cluster_id}",
+            ["JobStatus", "HoldReasonCode", "HoldReason", "HoldReasonSubCode"],
+            limit=-1
+        ):
+            total_jobs += 1
+            if ad.eval("JobStatus") != 5:
+                continue
 
-    for ad in schedd.query(
-        constraint=f"ClusterId == {cluster_id} && JobStatus == 5",
-        projection=["HoldReasonCode", "HoldReason", "HoldReasonSubCode"],
-        limit=-1
-    ):
-        code = ad.eval("HoldReasonCode")
-        subcode = ad.eval("HoldReasonSubCode")
+            code = ad.eval("HoldReasonCode")
+            subcode = ad.eval("HoldReasonSubCode")
+            reasons_by_code.setdefault(code, []).append((clean_reason(ad.eval("HoldReason")), subcode))
+        fetch_span.rows = total_jobs
 
-        reason = ad.eval("HoldReason").split('. ')[0]
-        if "Error from" in reason and ": " in reason:
-            parts = reason.split(": ", 1)
-            if len(parts) == 2:
-                reason = parts[1]
+    return total_jobs, reasons_by_code
 
-        reasons_by_code.setdefault(code, []).append((reason, subcode))
+# keeps only the error message of a HoldReason
+def clean_reason(reason):
+    reason = reason.split('. ')[0]
+    if "Error from" in reason and ": " in reason:
+        parts = reason.split(": ", 1)
+        if len(parts) == 2:
+            reason = parts[1]
+    return reason
 
-    return reasons_by_code
 
 
 
 
+"""
+Buckets the grouped hold reasons of every HoldReasonCode.
+
+    Parameters:
+        reasons_by_code (Dict[int, List[Tuple[str, int]]]): Dictionary grouping hold reasons by HoldReasonCode.
+        normalize (bool): Passed to bucket_reasons_with_subcodes().
+        cache (TemplateCache or None): If given, reasons are bucketed with bucket_with_templates().
+
+    Returns:
+        List[Tuple[int, str, int, int, str]]: (HoldReasonCode, label, subcode, jobs, example reason)
+                                              per bucket.
+"""
+def bucket_held_jobs(reasons_by_code, normalize=False, cache=None):
+    rows = []
+    for code, pairs in reasons_by_code.items():
+        reasons, subcodes = zip(*pairs)
+        label = HOLD_REASON_CODES.get(code, {}).get("label", f"Code {code}")
+        if cache is not None:
+            buckets = bucket_with_templates(code, reasons, subcodes, cache)
+        else:
+            buckets = bucket_reasons_with_subcodes(reasons, subcodes, normalize=normalize)
+        for bucket in buckets:
+            example_reason, subcode = bucket[0]
+            rows.append((code, label, subcode, len(bucket), example_reason))
+    return rows
+
+
 
 """ 
 Processes grouped hold reasons and prints:
@@ -135,37 +292,36 @@ NOTE: The information about the slots which sent the error which can be a future
     Parameters:
         reasons_by_code (Dict[int, List[Tuple[str, int]]]): Dictionary grouping hold reasons by HoldReasonCode.
         cluster_id (str or int): The cluster ID being analyzed.
+        normalize (bool): Passed to bucket_reasons_with_subcodes().
+        cache (TemplateCache or None): If given, reasons are bucketed with bucket_with_templates().
 
 """
-def bucket_and_print_table(reasons_by_code, cluster_id):
+def bucket_and_print_table(reasons_by_code, cluster_id, normalize=False, cache=None):
     print()
     print("Cluster ID:", cluster_id)
 
     held_jobs = sum(len(pairs) for pairs in reasons_by_code.values())
     print("Held Jobs in Cluster:", held_jobs)
 
-    example_rows = []
-    seen_codes = set()
+    with span("bucket", held_jobs):
+        buckets = bucket_held_jobs(reasons_by_code, normalize, cache)
 
-    for code, pairs in reasons_by_code.items():
-        reasons, subcodes = zip(*pairs)
-        label = HOLD_REASON_CODES.get(code, {}).get("label", f"Code {code}")
-        seen_codes.add(code)
-        buckets = bucket_reasons_with_subcodes(reasons, subcodes)
-        for bucket in buckets:
-            example_reason, subcode = bucket[0]
-            percent = (len(bucket) / held_jobs) * 100 if held_jobs > 0 else 0
-            example_rows.append([label, subcode, f"{percent:.1f}% ({len(bucket)})", example_reason])
+    seen_codes = set(reasons_by_code)
+    example_rows = []
+    for _, label, subcode, count, example_reason in buckets:
+        percent = (count / held_jobs) * 100 if held_jobs > 0 else 0
+        example_rows.append([label, subcode, f"{percent:.1f}% ({count})", example_reason])
 
-    headers = ["Hold Reason Label", "SubCode", "% of Held Jobs (Count)", "Example Reason"]
-    print(tabulate(example_rows, headers=headers, tablefmt="grid"))
+    with span("render", len(example_rows)):
+        headers = ["Hold Reason Label", "SubCode", "% of Held Jobs (Count)", "Example Reason"]
+        print(tabulate(example_rows, headers=headers, tablefmt="grid"))
 
-    print("\nLegend:")
-    legend = []
-    for code in sorted(seen_codes):
-        entry = HOLD_REASON_CODES.get(code, {})
-        legend.append([code, entry.get("label", "Unknown"), entry.get("reason", "No description available.")])
-    print(tabulate(legend, headers=["Code", "Label", "Reason"], tablefmt="fancy_grid"))
+        print("\nLegend:")
+        legend = []
+        for code in sorted(seen_codes):
+            entry = HOLD_REASON_CODES.get(code, {})
+            legend.append([code, entry.get("label", "Unknown"), entry.get("reason", "No description available.")])
+        print(tabulate(legend, headers=["Code", "Label", "Reason"], tablefmt="fancy_grid"))
 
 
 
@@ -176,16 +332,39 @@ Main Execution Block:
     - Parses the cluster ID from command-line arguments.
     - Calls `group_by_code()` to gather held job reasons.
     - Passes the results to `bucket_and_print_table()` to display the report.
+      With --normalize, reasons differing only in paths, hosts or numbers are bucketed together.
+      With --templates, reasons are classified through the persistent template cache
+      (hold_templates.py); --cache-stats also prints its hit/miss counters.
 
 Example:
     $ python condor_hold_bucket.py 123456
 """
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python hold_bucket.py <ClusterId>")
+    setup_from_argv()
+    serve_from_daemon("hold_bucket")
+    flags = {"--normalize", "--templates", "--cache-stats", "--no-cache"}
+    options = {arg for arg in sys.argv[1:] if arg in flags}
+    args = [arg for arg in sys.argv[1:] if arg not in flags]
+    if len(args) != 1:
+        print("Usage: python hold_bucket.py <ClusterId> [--normalize] [--templates] [--no-cache] [--cache-stats] [--profile]")
         sys.exit(1)
 
-    cluster_id = sys.argv[1]
-    reasons_by_code = group_by_code(cluster_id)
-    bucket_and_print_table(reasons_by_code, cluster_id)
-
+    cluster_id = args[0]
+    query_cache = None if "--no-cache" in options else QueryCache()
+    schedd = None if query_cache is None else CachedSchedd(query_cache)
+    _, reasons_by_code = group_by_code(cluster_id, schedd)
+    if "--templates" in options:
+        with TemplateCache() as cache:
+            bucket_and_print_table(reasons_by_code, cluster_id, cache=cache)
+            if "--cache-stats" in options:
+                stats = cache.stats()
+                print(f"\nTemplate cache: {stats['hits']} hit(s), {stats['misses']} miss(es) this run; "
+                      f"{stats['total_hits']} hit(s), {stats['total_misses']} miss(es) in total, "
+                      f"{stats['entries']} reason(s) stored")
+    else:
+        bucket_and_print_table(reasons_by_code, cluster_id, normalize="--normalize" in options)
+
+    if query_cache is not None:
+        if "--cache-stats" in options:
+            print_stats(query_cache.stats())
+        query_cache.close()
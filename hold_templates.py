@@ -0,0 +1,181 @@
+import os
+import time
+import sqlite3
+
+"""
+Persistent cache of hold-reason templates.
+
+Hold messages repeat the same few templates across many clusters, so the
+result of the fuzzy bucketing in hold_bucket.py is remembered between runs.
+For every HoldReasonCode the cache maps a normalized reason (see
+hold_bucket.normalize_reason) to a template ID. The store is a small SQLite
+file, shared by every process of the user, and the least recently used
+reasons are evicted once it holds more than max_entries of them.
+
+Lookups only read the file: the last use of the reasons found is written
+back in one short transaction when the cache is closed, so a run does not
+hold the write lock while it works. New mappings are committed as soon as
+they are recorded (see commit()).
+
+A long-lived process (see daemon.py) can keep the known reasons in memory as
+well with set_memory_cache(), so repeated lookups skip SQLite. Every eviction
+that deletes reasons, made by any process, bumps an "evictions" counter in
+the file; the in-memory entries are keyed by the count read when the cache
+was opened, so none of them outlives an eviction (template IDs can be reused
+once deleted).
+"""
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "chtc-tools", "hold_templates.sqlite")
+MAX_ENTRIES = 50000
+
+# in-process cache of (path, evictions, code, normalized reason) -> template ID, see set_memory_cache()
+_memory_cache = None
+
+
+# installs an in-process cache with get(key) and put(key, value, size), or None to turn it off
+def set_memory_cache(cache):
+    global _memory_cache
+    _memory_cache = cache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    id INTEGER PRIMARY KEY,
+    code INTEGER NOT NULL,
+    normalized TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reasons (
+    code INTEGER NOT NULL,
+    normalized TEXT NOT NULL,
+    template_id INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (code, normalized)
+);
+CREATE INDEX IF NOT EXISTS reasons_last_used ON reasons (last_used);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+"""
+Maps normalized hold reasons to template IDs, per HoldReasonCode.
+
+    Parameters:
+        path (str): Location of the SQLite file (created if missing).
+        max_entries (int): Number of reasons kept before LRU eviction.
+
+Attributes hits and misses count the lookups made by this process;
+stats() also returns the totals over every run.
+"""
+class TemplateCache:
+    def __init__(self, path=DEFAULT_PATH, max_entries=MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # reasons found by lookup(), whose last_used is updated on close()
+        self.touched = set()
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.executescript(SCHEMA)
+        row = self.db.execute("SELECT value FROM counters WHERE name = 'evictions'").fetchone()
+        self.generation = row[0] if row else 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # key of a reason in the in-process cache, only valid until the next eviction
+    def memory_key(self, code, normalized):
+        return (self.path, self.generation, code, normalized)
+
+    # returns the template ID of a known reason, or None
+    def lookup(self, code, normalized):
+        if _memory_cache is not None:
+            template_id = _memory_cache.get(self.memory_key(code, normalized))
+            if template_id is not None:
+                self.hits += 1
+                self.touched.add((code, normalized))
+                return template_id
+
+        row = self.db.execute(
+            "SELECT template_id FROM reasons WHERE code = ? AND normalized = ?",
+            (code, normalized)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touched.add((code, normalized))
+        if _memory_cache is not None:
+            _memory_cache.put(self.memory_key(code, normalized), row[0], len(normalized))
+        return row[0]
+
+    # returns (template_id, normalized reason) for every template of a code
+    def templates(self, code):
+        return self.db.execute(
+            "SELECT id, normalized FROM templates WHERE code = ? ORDER BY id", (code,)).fetchall()
+
+    # creates a new template for a code and returns its ID
+    def add_template(self, code, normalized):
+        cursor = self.db.execute(
+            "INSERT INTO templates (code, normalized) VALUES (?, ?)", (code, normalized))
+        return cursor.lastrowid
+
+    # records the template a reason belongs to
+    def remember(self, code, normalized, template_id):
+        self.db.execute(
+            "INSERT OR REPLACE INTO reasons (code, normalized, template_id, last_used) "
+            "VALUES (?, ?, ?, ?)",
+            (code, normalized, template_id, time.time()))
+        if _memory_cache is not None:
+            _memory_cache.put(self.memory_key(code, normalized), template_id, len(normalized))
+
+    # ends the write transaction of add_template()/remember(), releasing the lock on the file
+    def commit(self):
+        self.db.commit()
+
+    # drops the least recently used reasons and the templates nothing points to any more,
+    # counting the eviction so the in-process caches stop using their entries
+    def evict(self):
+        evicted = self.db.execute(
+            "DELETE FROM reasons WHERE rowid IN ("
+            " SELECT rowid FROM reasons ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)).rowcount
+        self.db.execute(
+            "DELETE FROM templates WHERE id NOT IN (SELECT DISTINCT template_id FROM reasons)")
+        if evicted:
+            self.db.execute(
+                "INSERT INTO counters (name, value) VALUES ('evictions', 1) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + 1")
+
+    # hit/miss counters of this process and of every run so far
+    def stats(self):
+        totals = dict(self.db.execute("SELECT name, value FROM counters"))
+        entries = self.db.execute("SELECT COUNT(*) FROM reasons").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_hits": totals.get("hits", 0) + self.hits,
+            "total_misses": totals.get("misses", 0) + self.misses,
+            "entries": entries,
+        }
+
+    def close(self):
+        if self.db is None:
+            return
+        now = time.time()
+        self.db.executemany(
+            "UPDATE reasons SET last_used = ? WHERE code = ? AND normalized = ?",
+            [(now, code, normalized) for code, normalized in self.touched])
+        for name, value in (("hits", self.hits), ("misses", self.misses)):
+            self.db.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                (name, value))
+        self.evict()
+        self.db.commit()
+        self.db.close()
+        self.db = None
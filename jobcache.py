@@ -0,0 +1,522 @@
+import os
+import csv
+import json
+import shutil
+import numpy as np
+from profiling import span
+from utils import FIELD_TYPES
+
+"""
+Columnar cache for the job dumps in 'cluster_data/'.
+
+The first time a column of a cluster CSV is read, it is parsed once, given a
+type (int64, float64 with NaN for missing values, or dictionary-encoded text,
+see TextColumn) and saved as .npy files in a '<csv name>.cols/' directory next
+to the CSV.
+Columns are parsed on demand: a report only parses and keeps in memory the
+columns it asks for, so its cost grows with the number of columns it uses, not
+with the width of the file. Later reads memory-map the cached columns. The
+cache is dropped whenever the CSV's mtime or size no longer match the cache
+metadata.
+
+iter_column_chunks() reads a few columns in fixed-size chunks instead, for
+reports that must run in bounded memory on very large clusters.
+
+A long-lived process (see daemon.py) can also keep loaded columns in memory
+with set_memory_cache(); they are then read from disk once, and again only
+when the CSV changes.
+"""
+
+CACHE_VERSION = 2
+META_FILE = "meta.json"
+
+# jobs per chunk when streaming a CSV
+CHUNK_SIZE = 100000
+
+# in-process cache of loaded columns, see set_memory_cache()
+_memory_cache = None
+
+
+# directory holding the cached columns for a CSV
+def cache_dir_for(csv_path):
+    root, _ = os.path.splitext(csv_path)
+    return root + ".cols"
+
+
+# the mtime/size pair the cache is validated against
+def source_signature(csv_path):
+    st = os.stat(csv_path)
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+# reads the cache metadata, or None if there is no usable cache
+def read_meta(csv_path):
+    meta_path = os.path.join(cache_dir_for(csv_path), META_FILE)
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != CACHE_VERSION:
+        return None
+    return meta
+
+
+# checks that the cache exists and was built from the current CSV
+def is_fresh(csv_path):
+    meta = read_meta(csv_path)
+    return meta is not None and meta.get("source") == source_signature(csv_path)
+
+
+# checks that the cache is fresh and already holds the given columns
+def has_columns(csv_path, columns):
+    meta = read_meta(csv_path)
+    if meta is None or meta.get("source") != source_signature(csv_path) or meta.get("rows") is None:
+        return False
+    return all(name in meta["columns"] for name in columns if name in meta["header"])
+
+
+# narrowest unsigned type that numbers this many distinct values
+def code_dtype(distinct):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if distinct <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+"""
+A text column stored dictionary-encoded: every distinct value is kept once, as
+UTF-8 bytes packed into one buffer, and every job only holds the number of its
+value, in the narrowest unsigned type that fits. Repeated values such as Owner,
+AcctGroup or the execute hosts then cost a byte or two per job instead of four
+bytes per character of the longest value.
+
+    Attributes:
+        codes (np.ndarray): Number of the value of every job.
+        offsets (np.ndarray): int64 start of every distinct value in blob, followed by the end.
+        blob (np.ndarray): uint8 UTF-8 bytes of the distinct values.
+"""
+class TextColumn:
+    __slots__ = ("codes", "offsets", "blob")
+
+    def __init__(self, codes, offsets, blob):
+        self.codes = codes
+        self.offsets = offsets
+        self.blob = blob
+
+    # encodes a list of strings, numbering the values in the order they first appear
+    @classmethod
+    def from_values(cls, values):
+        index = {}
+        codes = [index.setdefault(value, len(index)) for value in values]
+        encoded = [value.encode("utf-8") for value in index]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8).copy()
+        return cls(np.array(codes, dtype=code_dtype(len(index))), offsets, blob)
+
+    def __len__(self):
+        return len(self.codes)
+
+    # the jobs selected by an index, slice or mask; the distinct values are shared
+    def __getitem__(self, index):
+        return TextColumn(self.codes[index], self.offsets, self.blob)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.offsets.nbytes + self.blob.nbytes
+
+    # the distinct values, as a string array indexed by code
+    def labels(self):
+        data = self.blob.tobytes()
+        bounds = self.offsets.tolist()
+        return np.array([data[start:end].decode("utf-8") for start, end in zip(bounds, bounds[1:])], dtype=str)
+
+    # the value of every job, as the string array a plain text column would be
+    def decode(self, labels=None):
+        return (self.labels() if labels is None else labels)[self.codes]
+
+
+# a column as a plain array, decoding text columns
+def decoded(values):
+    return values.decode() if isinstance(values, TextColumn) else values
+
+
+# picks the narrowest type that holds every value of a column; text is kept as a
+# string array, or as a TextColumn with encode_text
+def infer_column(values, encode_text=False):
+    present = [v for v in values if v != ""]
+    if present and len(present) == len(values):
+        try:
+            return np.array([int(v) for v in present], dtype=np.int64)
+        except (ValueError, OverflowError):
+            pass
+    if present:
+        try:
+            return np.array([float(v) if v != "" else np.nan for v in values], dtype=np.float64)
+        except ValueError:
+            pass
+    else:
+        return np.full(len(values), np.nan)
+    if encode_text:
+        return TextColumn.from_values(values)
+    return np.array(values, dtype=str)
+
+
+# parses the values of a chunk as the kind its column was given: "i" (int64, unless
+# some values are missing or fractional: float64 with NaN), "f" (float64) or "U" (text)
+def chunk_column(values, kind):
+    if kind == "U":
+        return np.array(values, dtype=str)
+    column = infer_column(values)
+    if column.dtype.kind == "i" and kind == "i":
+        return column
+    column = as_float(column)
+    if kind == "i" and len(column) and np.isfinite(column).all() and (column == np.floor(column)).all():
+        return column.astype(np.int64)
+    return column
+
+
+# reads the header (first line) of a CSV
+def read_csv_header(csv_path):
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f), [])
+
+
+"""
+Parses some columns of a CSV into typed arrays. Only the values of those columns
+are kept, so memory grows with the number of columns asked for.
+
+    Parameters:
+        csv_path (str): The CSV file.
+        header (List[str]): Its header.
+        names (List[str]): Columns to parse (may be empty, to count the rows).
+
+    Returns:
+        Tuple[int, Dict[str, np.ndarray or TextColumn]]: The number of jobs and the typed
+            array (or encoded text) per column.
+"""
+def parse_columns(csv_path, header, names):
+    indexes = [header.index(name) for name in names]
+    values = [[] for _ in names]
+    rows = 0
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            # blank lines are skipped, as csv.DictReader does
+            if not row:
+                continue
+            rows += 1
+            width = len(row)
+            for column, i in zip(values, indexes):
+                column.append(row[i] if i < width else "")
+
+    return rows, {name: infer_column(column, encode_text=True) for name, column in zip(names, values)}
+
+
+# writes the metadata atomically
+def write_meta(cache_dir, meta):
+    tmp_path = os.path.join(cache_dir, f"{META_FILE}.tmp-{os.getpid()}")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(cache_dir, META_FILE))
+
+
+# writes one array of the cache atomically
+def save_array(cache_dir, filename, values):
+    tmp_path = os.path.join(cache_dir, f"{filename}.tmp-{os.getpid()}.npy")
+    np.save(tmp_path, values)
+    os.replace(tmp_path, os.path.join(cache_dir, filename))
+
+
+# saves parsed columns into the cache directory and records them in the metadata
+def save_columns(csv_path, meta, columns):
+    cache_dir = cache_dir_for(csv_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    for name, values in columns.items():
+        stem = f"c{meta['header'].index(name):04d}"
+        if isinstance(values, TextColumn):
+            info = {"file": f"{stem}.npy", "dtype": values.codes.dtype.str,
+                    "offsets": f"{stem}.offsets.npy", "blob": f"{stem}.blob.npy"}
+            save_array(cache_dir, info["offsets"], values.offsets)
+            save_array(cache_dir, info["blob"], values.blob)
+            save_array(cache_dir, info["file"], values.codes)
+        else:
+            info = {"file": f"{stem}.npy", "dtype": values.dtype.str}
+            save_array(cache_dir, info["file"], values)
+        meta["columns"][name] = info
+
+    # keep the columns another process may have cached in the meantime
+    current = read_meta(csv_path)
+    if current is not None and current.get("source") == meta["source"]:
+        for name, info in current["columns"].items():
+            meta["columns"].setdefault(name, info)
+    write_meta(cache_dir, meta)
+
+
+"""
+Makes sure the given columns of a CSV are cached, parsing the missing ones,
+and returns the cache metadata. A stale cache is dropped first.
+
+    Parameters:
+        csv_path (str): The CSV file.
+        names (List[str] or None): Columns needed, or None for all of them.
+                                   Names missing from the CSV are skipped.
+
+    Returns:
+        dict: The cache metadata (header, rows, cached columns). If the cache
+              cannot be written, the parsed columns are returned in "arrays".
+"""
+def ensure_columns(csv_path, names=None):
+    meta = read_meta(csv_path)
+    signature = source_signature(csv_path)
+    if meta is None or meta.get("source") != signature:
+        shutil.rmtree(cache_dir_for(csv_path), ignore_errors=True)
+        meta = {
+            "version": CACHE_VERSION,
+            "source": signature,
+            "rows": None,
+            "header": read_csv_header(csv_path),
+            "columns": {},
+        }
+
+    wanted = meta["header"] if names is None else [name for name in names if name in meta["header"]]
+    missing = [name for name in dict.fromkeys(wanted) if name not in meta["columns"]]
+    if not missing and meta["rows"] is not None:
+        return meta
+
+    with span("parse csv") as s:
+        rows, columns = parse_columns(csv_path, meta["header"], missing)
+        s.rows = rows
+    meta["rows"] = rows
+    try:
+        with span("write column cache"):
+            save_columns(csv_path, meta, columns)
+    except OSError as e:
+        print(f"[WARN] Could not write column cache for {csv_path}: {e}")
+        meta = dict(meta, arrays=columns)
+    return meta
+
+
+# parses and caches every column of a CSV, and returns the cache metadata
+def ensure_cache(csv_path):
+    return ensure_columns(csv_path)
+
+
+# returns the CSV header (all column names, in file order)
+def read_header(csv_path):
+    meta = read_meta(csv_path)
+    if meta is not None and meta.get("source") == source_signature(csv_path):
+        return meta["header"]
+    return read_csv_header(csv_path)
+
+
+# returns the number of jobs in the CSV
+def row_count(csv_path):
+    if _memory_cache is not None:
+        return cached_table_info(csv_path)["rows"]
+    return ensure_columns(csv_path, [])["rows"]
+
+
+"""
+Keeps the columns returned by load_columns() (and the header and row count of
+each CSV) in an in-process cache, for processes that serve many reports.
+
+    Parameters:
+        cache (object or None): Has get(key) and put(key, value, size), e.g.
+                                daemon.LRUCache; None turns the cache off.
+
+Entries are keyed by the CSV path and its mtime/size, so a changed CSV is read
+again and its old columns are left for the cache to evict.
+"""
+def set_memory_cache(cache):
+    global _memory_cache
+    _memory_cache = cache
+
+
+# key of a CSV entry in the memory cache
+def memory_key(csv_path, name):
+    signature = source_signature(csv_path)
+    return (os.path.abspath(csv_path), signature["mtime_ns"], signature["size"], name)
+
+
+# header and row count of a CSV, through the memory cache
+def cached_table_info(csv_path):
+    key = memory_key(csv_path, None)
+    info = _memory_cache.get(key)
+    if info is None:
+        meta = ensure_columns(csv_path, [])
+        info = {"header": meta["header"], "rows": meta["rows"]}
+        _memory_cache.put(key, info, 0)
+    return info
+
+
+"""
+Loads the requested columns of a cluster CSV through the cache, parsing the
+ones that are not cached yet.
+
+    Parameters:
+        csv_path (str): Path to the cluster_<id>_jobs.csv file.
+        columns (List[str] or None): Columns to load, or None for all of them.
+                                     Names missing from the CSV are skipped.
+
+    Returns:
+        Dict[str, np.ndarray]: Typed array per column; numbers are read-only (memory-mapped)
+                               and text is decoded into string arrays.
+"""
+def load_columns(csv_path, columns=None):
+    return {name: decoded(values) for name, values in load_encoded_columns(csv_path, columns).items()}
+
+
+# load_columns() without decoding the text columns: they are returned as TextColumns
+def load_encoded_columns(csv_path, columns=None):
+    if _memory_cache is not None:
+        return load_columns_cached(csv_path, columns)
+    return read_columns(csv_path, columns)
+
+
+# an array (or the arrays of a TextColumn) copied into memory, read-only
+def in_memory(values):
+    if isinstance(values, TextColumn):
+        return TextColumn(in_memory(values.codes), in_memory(values.offsets), in_memory(values.blob))
+    values = np.array(values)
+    values.flags.writeable = False
+    return values
+
+
+# load_encoded_columns() through the memory cache: the columns not in memory yet
+# are read in full (not memory-mapped) and added to it
+def load_columns_cached(csv_path, columns=None):
+    header = cached_table_info(csv_path)["header"]
+    names = header if columns is None else [c for c in dict.fromkeys(columns) if c in header]
+
+    loaded = {name: _memory_cache.get(memory_key(csv_path, name)) for name in names}
+    missing = [name for name, values in loaded.items() if values is None]
+    if missing:
+        for name, values in read_columns(csv_path, missing).items():
+            values = in_memory(values)
+            _memory_cache.put(memory_key(csv_path, name), values, values.nbytes)
+            loaded[name] = values
+    return loaded
+
+
+# memory-maps one cached column
+def map_column(cache_dir, info):
+    def load(filename):
+        return np.load(os.path.join(cache_dir, filename), mmap_mode="r")
+
+    if "blob" in info:
+        return TextColumn(load(info["file"]), load(info["offsets"]), load(info["blob"]))
+    return load(info["file"])
+
+
+# loads the requested columns from the column cache on disk (text stays encoded)
+def read_columns(csv_path, columns=None):
+    meta = ensure_columns(csv_path, columns)
+    names = meta["header"] if columns is None else [c for c in columns if c in meta["header"]]
+
+    arrays = meta.get("arrays", {})
+    cache_dir = cache_dir_for(csv_path)
+    return {
+        name: arrays[name] if name in arrays else map_column(cache_dir, meta["columns"][name])
+        for name in names
+    }
+
+
+# converts a column to a plain list, with None for missing values
+def to_list(values, rows):
+    if values is None:
+        return [None] * rows
+    if values.dtype.kind == "f":
+        return [None if v != v else v for v in values.tolist()]
+    if values.dtype.kind == "U":
+        return [v if v != "" else None for v in values.tolist()]
+    return values.tolist()
+
+
+# returns a column as float64, with NaN where the value is missing or not a number
+def float_column(columns, name, rows):
+    values = columns.get(name)
+    if values is None:
+        return np.full(rows, np.nan)
+    return as_float(values)
+
+
+# converts an array to float64, with NaN where a value is not a number
+def as_float(values):
+    if values.dtype.kind in "iuf":
+        return values.astype(np.float64)
+    converted = []
+    for value in values.tolist():
+        try:
+            converted.append(float(value))
+        except ValueError:
+            converted.append(np.nan)
+    return np.array(converted, dtype=np.float64)
+
+
+"""
+Reads the requested columns of a cluster CSV in chunks, so memory use is bounded
+by the chunk size. If the column cache is fresh and holds the columns, the chunks
+are slices of the memory-mapped columns; otherwise the CSV itself is read row by
+row (without building the cache, which needs whole columns in memory).
+
+    Parameters:
+        csv_path (str): Path to the cluster_<id>_jobs.csv file.
+        columns (List[str]): Columns to read; names missing from the CSV are skipped.
+        chunk_size (int): Maximum number of jobs per chunk.
+
+    Yields:
+        Tuple[Dict[str, np.ndarray], int]: Typed arrays of the chunk and its number of jobs.
+"""
+def iter_column_chunks(csv_path, columns, chunk_size=CHUNK_SIZE):
+    if has_columns(csv_path, columns):
+        arrays = load_encoded_columns(csv_path, columns)
+        # the distinct values of the text columns are decoded once, not per chunk
+        labels = {name: values.labels() for name, values in arrays.items() if isinstance(values, TextColumn)}
+        rows = row_count(csv_path)
+        for start in range(0, rows, chunk_size):
+            chunk = {name: values[start:start + chunk_size] for name, values in arrays.items()}
+            yield ({name: values.decode(labels[name]) if name in labels else values
+                    for name, values in chunk.items()},
+                   min(chunk_size, rows - start))
+        return
+
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        wanted = [(header.index(name), name) for name in columns if name in header]
+
+        # the kind of each column is fixed once, from its known type or else from
+        # the first chunk, so a column has the same dtype in every chunk
+        kinds = {}
+
+        def make_chunk(rows):
+            chunk = {}
+            for i, name in wanted:
+                values = [row[i] if i < len(row) else "" for row in rows]
+                if name not in kinds:
+                    known = FIELD_TYPES.get(name)
+                    if known is int or known is str:
+                        kinds[name] = "i" if known is int else "U"
+                    elif any(values):
+                        kinds[name] = infer_column(values).dtype.kind
+                    else:
+                        # nothing to tell the kind from yet
+                        chunk[name] = infer_column(values)
+                        continue
+                chunk[name] = chunk_column(values, kinds[name])
+            return chunk, len(rows)
+
+        buffer = []
+        for row in reader:
+            if not row:
+                continue
+            buffer.append(row)
+            if len(buffer) == chunk_size:
+                yield make_chunk(buffer)
+                buffer = []
+        if buffer:
+            yield make_chunk(buffer)
@@ -0,0 +1,105 @@
+from jobcache import TextColumn, decoded, load_encoded_columns, row_count
+
+"""
+The jobs of a cluster as one compact, typed table, shared by the reports.
+
+A JobTable holds one array per column (struct of arrays), straight from the
+column cache (see jobcache.py): numbers as int64/float64 arrays and text
+dictionary-encoded as TextColumns, so a job costs a few bytes per numeric
+column and a byte or two per repeated text value such as Owner, AcctGroup or
+LastRemoteHost, instead of a dict of strings with the header repeated in it.
+load_table() is the one loader the reports go through.
+
+A table reads like the dict of columns the reports compute from: table[name]
+and table.get(name) return a column as a plain array, text decoded on access.
+
+The columns are memory-mapped read-only from the cache files, so worker
+processes (batch.py) that load the same table share its pages through the
+page cache instead of each holding a copy.
+"""
+
+
+"""
+Typed, column-oriented table of the jobs of a cluster.
+
+    Parameters:
+        columns (Dict[str, np.ndarray or TextColumn]): The columns, text encoded.
+        rows (int): Number of jobs.
+        path (str or None): The CSV the table was loaded from.
+"""
+class JobTable:
+    __slots__ = ("columns", "rows", "path")
+
+    def __init__(self, columns, rows, path=None):
+        self.columns = columns
+        self.rows = rows
+        self.path = path
+
+    def __len__(self):
+        return self.rows
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def keys(self):
+        return self.columns.keys()
+
+    # a column as a plain array, text decoded
+    def __getitem__(self, name):
+        return decoded(self.columns[name])
+
+    def get(self, name, default=None):
+        return self[name] if name in self.columns else default
+
+    def items(self):
+        return ((name, self[name]) for name in self.columns)
+
+    # codes and distinct values of a text column
+    def codes(self, name):
+        return self.text_column(name).codes
+
+    def labels(self, name):
+        return self.text_column(name).labels()
+
+    def text_column(self, name):
+        values = self.columns[name]
+        if not isinstance(values, TextColumn):
+            raise TypeError(f"{name} is not a text column")
+        return values
+
+    # bytes held by the columns
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.columns.values())
+
+    # the table as a pandas DataFrame; text columns become categoricals, without decoding every job
+    def to_frame(self, names=None):
+        import pandas as pd  # only the reports that work on frames need it
+
+        data = {}
+        for name in (self.columns if names is None else names):
+            values = self.columns[name]
+            if isinstance(values, TextColumn):
+                values = pd.Categorical.from_codes(values.codes, categories=values.labels())
+            data[name] = values
+        return pd.DataFrame(data)
+
+
+"""
+Loads the requested columns of a cluster CSV as a JobTable, through the column
+cache (and the in-process cache of a daemon, see jobcache.set_memory_cache).
+
+    Parameters:
+        csv_path (str): Path to the cluster_<id>_jobs.csv file.
+        columns (List[str] or None): Columns to load, or None for all of them.
+                                     Names missing from the CSV are skipped.
+
+    Returns:
+        JobTable: The table, its columns memory-mapped read-only.
+"""
+def load_table(csv_path, columns=None):
+    loaded = load_encoded_columns(csv_path, columns)
+    return JobTable(loaded, row_count(csv_path), csv_path)
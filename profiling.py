@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import atexit
+import resource
+import threading
+from contextlib import contextmanager
+
+"""
+Stage timing for the CHTC tools.
+
+The tools wrap their stages (fetch, parse, compute, render) in span("name")
+blocks. Spans cost next to nothing until profiling is enabled, which every
+tool does when it is run with --profile:
+
+    --profile                print a per-stage breakdown to stderr at exit
+    --profile-trace FILE     also write the spans as a Chrome/Perfetto trace (JSON)
+    --profile-cprofile FILE  also run cProfile, save its stats to FILE and print
+                             the 20 functions with the highest cumulative time
+
+For each stage the breakdown shows how often it ran, its total time and share of
+the run, the number of rows it handled (when the stage reports it), the change in
+resident memory and the peak resident memory of the process when it ended.
+"""
+
+FLAGS = ("--profile", "--profile-trace", "--profile-cprofile")
+
+_state = {"enabled": False, "start": None, "spans": [], "stack": [], "trace": None, "cprofile": None}
+
+
+# resident memory of the process in KiB (the peak so far where the current value is not available)
+def current_rss_kib():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return peak_rss_kib()
+
+
+# peak resident memory of the process in KiB
+def peak_rss_kib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def enabled():
+    return _state["enabled"]
+
+
+# one timed stage; set .rows inside the block to report how many rows it handled
+class Span:
+    __slots__ = ("name", "path", "start", "end", "rows", "rss_start", "rss_end", "peak_rss")
+
+    def __init__(self, name, path, rows=None):
+        self.name = name
+        self.path = path
+        self.rows = rows
+        self.start = self.end = None
+        self.rss_start = self.rss_end = self.peak_rss = None
+
+
+# span() yields this when profiling is off, so "s.rows = n" still works
+class _NullSpan:
+    def __init__(self, rows=None):
+        self.rows = rows
+
+
+"""
+Times the enclosed block as a stage. Spans nest: a span opened inside another
+one is shown below it in the breakdown.
+
+    Parameters:
+        name (str): Stage name, e.g. "fetch" or "render".
+        rows (int or None): Rows handled, if known up front (can also be set on the span).
+"""
+@contextmanager
+def span(name, rows=None):
+    # spans are only recorded on the main thread, so the nesting stays meaningful
+    if not _state["enabled"] or threading.current_thread() is not threading.main_thread():
+        yield _NullSpan(rows)
+        return
+
+    stack = _state["stack"]
+    s = Span(name, tuple(parent.name for parent in stack) + (name,), rows)
+    stack.append(s)
+    s.rss_start = current_rss_kib()
+    s.start = time.perf_counter()
+    try:
+        yield s
+    finally:
+        s.end = time.perf_counter()
+        s.rss_end = current_rss_kib()
+        s.peak_rss = peak_rss_kib()
+        stack.pop()
+        _state["spans"].append(s)
+
+
+"""
+Turns profiling on and registers the report to be printed at exit.
+
+    Parameters:
+        trace (str or None): File to write the Chrome/Perfetto trace to.
+        cprofile (str or None): File to save the cProfile stats to.
+"""
+def enable(trace=None, cprofile=None):
+    if _state["enabled"]:
+        return
+    _state.update(enabled=True, start=time.perf_counter(), trace=trace)
+    if cprofile:
+        import cProfile
+        _state["cprofile"] = (cProfile.Profile(), cprofile)
+        _state["cprofile"][0].enable()
+    atexit.register(finish)
+
+
+# splits an argument list into ({profiling flag: value}, other arguments)
+def split_flags(args):
+    options = {}
+    rest = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        name, _, value = arg.partition("=")
+        if name in FLAGS:
+            if name != "--profile" and not value:
+                i += 1
+                value = args[i] if i < len(args) else None
+            options[name] = value or True
+        else:
+            rest.append(arg)
+        i += 1
+    return options, rest
+
+
+"""
+Removes the profiling flags from an argument list (sys.argv by default, in place)
+and enables profiling if --profile was given.
+
+    Returns:
+        List[str]: The arguments without the profiling flags.
+"""
+def setup_from_argv(argv=None):
+    args = sys.argv if argv is None else argv
+    options, rest = split_flags(args)
+    args[:] = rest
+    if options:
+        enable(trace=options.get("--profile-trace"), cprofile=options.get("--profile-cprofile"))
+    return args
+
+
+# aggregates the spans by stage path, in the order the stages first started
+def summarize_spans(spans):
+    stages = {}
+    for s in sorted(spans, key=lambda s: s.start):
+        stage = stages.setdefault(s.path, {"calls": 0, "seconds": 0.0, "rows": None,
+                                           "rss_delta_kib": 0, "peak_rss_kib": 0})
+        stage["calls"] += 1
+        stage["seconds"] += s.end - s.start
+        if s.rows is not None:
+            stage["rows"] = (stage["rows"] or 0) + s.rows
+        stage["rss_delta_kib"] += s.rss_end - s.rss_start
+        stage["peak_rss_kib"] = max(stage["peak_rss_kib"], s.peak_rss)
+    return stages
+
+
+# prints the per-stage breakdown
+def print_report(out=sys.stderr):
+    total = time.perf_counter() - _state["start"]
+    stages = summarize_spans(_state["spans"])
+
+    print("", file=out)
+    print(f"{'Stage':<32} {'Calls':>6} {'Time (s)':>9} {'%':>6} {'Rows':>10} {'RSS Δ (MiB)':>12} {'Peak (MiB)':>11}",
+          file=out)
+    print("-" * 92, file=out)
+    for path, stage in stages.items():
+        label = "  " * (len(path) - 1) + path[-1]
+        rows = str(stage["rows"]) if stage["rows"] is not None else "-"
+        share = stage["seconds"] / total * 100 if total > 0 else 0
+        print(f"{label:<32} {stage['calls']:>6} {stage['seconds']:>9.3f} {share:>5.1f}% {rows:>10} "
+              f"{stage['rss_delta_kib'] / 1024:>12.1f} {stage['peak_rss_kib'] / 1024:>11.1f}", file=out)
+    print("-" * 92, file=out)
+    print(f"{'total':<32} {'':>6} {total:>9.3f} {100:>5.1f}% {'':>10} {'':>12} {peak_rss_kib() / 1024:>11.1f}",
+          file=out)
+
+
+# writes the spans in the Chrome trace event format (chrome://tracing, ui.perfetto.dev)
+def write_trace(path):
+    start = _state["start"]
+    events = [
+        {
+            "name": s.name,
+            "cat": "/".join(s.path[:-1]) or "tool",
+            "ph": "X",
+            "ts": (s.start - start) * 1e6,
+            "dur": (s.end - s.start) * 1e6,
+            "pid": os.getpid(),
+            "tid": 0,
+            "args": {"rows": s.rows, "rss_delta_kib": s.rss_end - s.rss_start, "peak_rss_kib": s.peak_rss},
+        }
+        for s in _state["spans"]
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+# prints the report and writes the trace and cProfile output (runs at exit)
+def finish():
+    if not _state["enabled"]:
+        return
+    if _state["cprofile"]:
+        import pstats
+        profile, path = _state["cprofile"]
+        profile.disable()
+        profile.dump_stats(path)
+        print(f"\ncProfile stats saved to {path}; top functions by cumulative time:", file=sys.stderr)
+        pstats.Stats(profile, stream=sys.stderr).sort_stats("cumulative").print_stats(20)
+    print_report()
+    if _state["trace"]:
+        write_trace(_state["trace"])
+        print(f"Trace written to {_state['trace']}", file=sys.stderr)
+    _state["enabled"] = False
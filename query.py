@@ -1,7 +1,14 @@
 import os
 import csv
 import sys
-import elasticsearch
+import json
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils import REPORT_FIELDS, FIELD_TYPES, safe_float, sample_csv_path
+from profiling import span, setup_from_argv
 
 
 """
@@ -12,8 +19,38 @@ for a given ClusterId (and optionally, a specific User), using the Scroll API
 (to handle large result sets), and writes them into a CSV file inside the
 'cluster_data/' directory.
 
+Each scroll page is appended to a JSON-lines spill file as soon as it arrives,
+while the set of field names is collected. The CSV is written from the spill
+file once the scroll ends, so memory use depends on the page size and not on
+the number of jobs in the cluster.
+
+With --slices N the cluster is fetched with N parallel sliced scrolls, one
+thread and one spill file per slice, which are merged into the same CSV.
+
+With --fields only the listed attributes are requested from Elasticsearch
+(a _source filter) and written, with known attributes converted to a fixed
+type (see utils.FIELD_TYPES). "--fields reports" requests the union of the
+columns the analysis tools read.
+
+Every dump records its high-water mark (the largest EnteredCurrentStatus) in
+a 'cluster_<id>_jobs.json' file next to the CSV. With --incremental only
+jobs whose EnteredCurrentStatus is at or after that mark are fetched, and
+they replace the existing rows with the same GlobalJobId; without a mark
+(no earlier dump, or no job with the attribute) it falls back to a full dump.
+
+With --sample N only N jobs picked at random from the whole cluster (it
+takes no User) are fetched, into 'cluster_<id>_sample_jobs.csv'. The jobs are ranked by a random_score seeded
+with --seed and computed from their GlobalJobId, so the same seed gives the
+same sample. The size of the whole cluster is recorded in the metadata file,
+and the reports run on the sample with --sample (see sampling.py).
+
+With --store the jobs are ingested into the local job store instead of a CSV
+(see store.py), replacing the stored jobs with the same GlobalJobId; with
+--incremental the high-water mark is taken from the store.
+
 Usage:
-    query.py <ClusterId> [User]
+    query.py <ClusterId> [User] [--slices N] [--page-size N] [--fields reports|A,B,...]
+             [--incremental] [--sample N [--seed S]] [--store]
 
 NOTE: You need authentication to access data from the Elasticsearch database, that is why the ES_USER and ES_PASS are blanked 
 
@@ -24,89 +61,406 @@ ES_HOST = "https://elastic.osg.chtc.io/q"
 ES_INDEX = "adstash-ospool-job-history-*"
 MAX_RESULTS = 1000000
 SCROLL_DURATION = "5m"
+PAGE_SIZE = 1000
+
+# attributes used to refresh a dump incrementally
+KEY_FIELD = "GlobalJobId"
+HIGH_WATER_FIELD = "EnteredCurrentStatus"
 
 #Authenticaion to be filled
 ES_USER = "*****"  
 ES_PASS = "************"
 
 def connect_to_elasticsearch():
+    import elasticsearch  # imported here to keep startup fast for --help and argument errors
+
     es = elasticsearch.Elasticsearch(ES_HOST, http_auth=(ES_USER, ES_PASS))
     if not es.ping():
         print("Error: Failed to connect to Elasticsearch.")
         sys.exit(1)
     return es
 
-def build_query(cluster_id, user=None):
+def build_query(cluster_id, user=None, fields=None, since=None, sample_seed=None):
     filters = [{"match": {"ClusterId": cluster_id}}]
     if user:
         filters.append({"match": {"Owner": user}})
+    if since is not None:
+        filters.append({"range": {HIGH_WATER_FIELD: {"gte": since}}})
     
-    return {
+    query = {
         "query": {
             "bool": {
                 "must": filters
             }
         }
     }
+    if sample_seed is not None:
+        # rank the jobs by a reproducible random score, the scroll returns the best first
+        query["query"] = {
+            "function_score": {
+                "query": query["query"],
+                "random_score": {"seed": sample_seed, "field": KEY_FIELD},
+                "boost_mode": "replace",
+            }
+        }
+    if fields:
+        query["_source"] = {"includes": list(fields)}
+    return query
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python dump_cluster_jobs.py <ClusterId> [User]")
-        sys.exit(1)
+# converts the known attributes of a hit to their fixed type, so a column
+# is written the same way whatever type the document stored it with; an
+# integer attribute holding a fraction (or inf/nan) is left as it was
+def coerce_types(source):
+    typed = {}
+    for name, value in source.items():
+        convert = FIELD_TYPES.get(name)
+        if convert is not None and value is not None:
+            try:
+                if convert is int:
+                    number = float(value)
+                    if number.is_integer():
+                        value = int(number)
+                else:
+                    value = convert(value)
+            except (ValueError, TypeError, OverflowError):
+                pass
+        typed[name] = value
+    return typed
 
-    try:
-        cluster_id = int(sys.argv[1])
-    except ValueError:
-        print("Error: ClusterId must be an integer.")
-        sys.exit(1)
+"""
+Shares the MAX_RESULTS cap between concurrent slice scrolls.
+"""
+class ScrollBudget:
+    def __init__(self, limit):
+        self.remaining = limit
+        self.lock = threading.Lock()
 
-    user = sys.argv[2] if len(sys.argv) > 2 else None
+    # reserves up to n hits and returns how many may be written
+    def take(self, n):
+        with self.lock:
+            n = min(n, self.remaining)
+            self.remaining -= n
+            return n
 
-    es = connect_to_elasticsearch()
-    query = build_query(cluster_id, user)
+    def exhausted(self):
+        with self.lock:
+            return self.remaining <= 0
 
-    # Start scroll
-    response = es.search(index=ES_INDEX, body=query, scroll=SCROLL_DURATION)
+
+# runs the scroll and appends every hit's _source to the spill file as one JSON line,
+# returning the number of hits written and the set of field names seen
+def scroll_to_spill(es, query, spill, budget, page_size=PAGE_SIZE, typed=False):
+    response = es.search(index=ES_INDEX, body=query, scroll=SCROLL_DURATION, size=page_size)
     scroll_id = response['_scroll_id']
     hits = response['hits']['hits']
 
-    all_hits = []
+    total = 0
     fieldnames = set()
 
-    while hits and len(all_hits) < MAX_RESULTS:
-        remaining = MAX_RESULTS - len(all_hits)
-        to_add = hits[:remaining]
-        all_hits.extend(to_add)
+    try:
+        while hits:
+            for hit in hits[:budget.take(len(hits))]:
+                source = coerce_types(hit['_source']) if typed else hit['_source']
+                fieldnames.update(source.keys())
+                spill.write(json.dumps(source))
+                spill.write("\n")
+                total += 1
 
-        for hit in to_add:
-            fieldnames.update(hit['_source'].keys())
+            if budget.exhausted():
+                break
 
-        if len(all_hits) >= MAX_RESULTS:
-            break
+            response = es.scroll(scroll_id=scroll_id, scroll=SCROLL_DURATION)
+            scroll_id = response['_scroll_id']
+            hits = response['hits']['hits']
+    finally:
+        # Clean up scroll
+        es.clear_scroll(scroll_id=scroll_id)
 
-        response = es.scroll(scroll_id=scroll_id, scroll=SCROLL_DURATION)
-        scroll_id = response['_scroll_id']
-        hits = response['hits']['hits']
+    return total, fieldnames
 
-    # Output directory and file
-    output_dir = os.path.join(os.getcwd(), "cluster_data")
-    os.makedirs(output_dir, exist_ok=True)
 
-    user_suffix = f"_{user}" if user else ""
-    csv_filename = os.path.join(output_dir, f"cluster_{cluster_id}{user_suffix}_jobs.csv")
+"""
+Fetches the query results into one spill file per slice.
+With more than one slice, each slice is a separate sliced scroll
+({"slice": {"id": i, "max": slices}}) running in its own thread.
+
+    Parameters:
+        es (Elasticsearch): Connected client (shared between threads).
+        query (dict): Query body from build_query().
+        spills (List[file]): One open spill file per slice.
+        page_size (int): Hits requested per scroll page.
+        typed (bool): Convert known attributes with coerce_types().
+        limit (int): Most hits written in total.
 
-    print(f"📂 Writing to: {csv_filename}")
+    Returns:
+        Tuple[int, Set[str]]: Total hits written and the union of field names.
+"""
+def fetch_to_spills(es, query, spills, page_size=PAGE_SIZE, typed=False, limit=MAX_RESULTS):
+    budget = ScrollBudget(limit)
+    if len(spills) == 1:
+        return scroll_to_spill(es, query, spills[0], budget, page_size, typed)
+
+    def run_slice(slice_id):
+        sliced_query = dict(query, slice={"id": slice_id, "max": len(spills)})
+        return scroll_to_spill(es, sliced_query, spills[slice_id], budget, page_size, typed)
+
+    total = 0
+    fieldnames = set()
+    with ThreadPoolExecutor(max_workers=len(spills)) as pool:
+        for count, names in pool.map(run_slice, range(len(spills))):
+            total += count
+            fieldnames.update(names)
+    return total, fieldnames
 
+# number of jobs matching a query, without fetching them
+def count_jobs(es, query):
+    inner = query["query"].get("function_score", {}).get("query", query["query"])
+    return es.count(index=ES_INDEX, body={"query": inner})["count"]
+
+# raises the high-water mark to the job's EnteredCurrentStatus if it is later
+def update_high_water_mark(mark, job):
+    value = safe_float(job.get(HIGH_WATER_FIELD))
+    if value is None or value != value:
+        return mark
+    return value if mark is None else max(mark, value)
+
+# writes the spilled hits into the CSV with the merged header
+# and returns the high-water mark of the written jobs
+def write_csv_from_spills(spills, fieldnames, csv_filename):
+    mark = None
     with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.DictWriter(csvfile, fieldnames=sorted(fieldnames))
         writer.writeheader()
-        for hit in all_hits:
-            writer.writerow(hit['_source'])
+        for spill in spills:
+            spill.seek(0)
+            for line in spill:
+                job = json.loads(line)
+                mark = update_high_water_mark(mark, job)
+                writer.writerow(job)
+    return mark
+
 
-    print(f"Dumped {len(all_hits)} jobs for ClusterId {cluster_id}" + (f" and user '{user}'" if user else "") + f" to {csv_filename}")
+"""
+Merges freshly fetched jobs into an existing dump.
+Rows of the old CSV whose GlobalJobId was fetched again are replaced by the new
+version; jobs not seen before are appended. The header is the union of both.
+Only the new jobs are held in memory, the old CSV is streamed.
+
+    Parameters:
+        spills (List[file]): Spill files holding the new jobs as JSON lines.
+        fieldnames (Set[str]): Field names seen in the new jobs.
+        csv_filename (str): The existing dump, rewritten in place.
+
+    Returns:
+        float or None: High-water mark over the merged dump.
+"""
+def upsert_csv_from_spills(spills, fieldnames, csv_filename):
+    updates = {}
+    unkeyed = []
+    for spill in spills:
+        spill.seek(0)
+        for line in spill:
+            key = json.loads(line).get(KEY_FIELD)
+            if key is None:
+                unkeyed.append(line)
+            else:
+                updates[key] = line
+
+    mark = None
+    tmp_filename = csv_filename + ".tmp"
+    with open(csv_filename, newline='', encoding='utf-8') as old_file:
+        reader = csv.DictReader(old_file)
+        header = sorted(set(reader.fieldnames or []) | set(fieldnames))
+
+        with open(tmp_filename, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=header)
+            writer.writeheader()
+            for row in reader:
+                if row.get(KEY_FIELD) in updates:
+                    continue
+                mark = update_high_water_mark(mark, row)
+                writer.writerow(row)
+            for line in list(updates.values()) + unkeyed:
+                job = json.loads(line)
+                mark = update_high_water_mark(mark, job)
+                writer.writerow(job)
+
+    os.replace(tmp_filename, csv_filename)
+    return mark
+
+# path of the metadata file kept next to a dump
+def dump_meta_path(csv_filename):
+    return os.path.splitext(csv_filename)[0] + ".json"
+
+# reads the metadata of a previous dump, or None if there is none
+def read_dump_meta(csv_filename):
+    try:
+        with open(dump_meta_path(csv_filename), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_dump_meta(csv_filename, meta):
+    with open(dump_meta_path(csv_filename), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+# the jobs spilled by the slices, one dict per job
+def read_spills(spills):
+    for spill in spills:
+        spill.seek(0)
+        for line in spill:
+            yield json.loads(line)
+
+# high-water mark of a dump that has no metadata file yet
+def high_water_mark_from_csv(csv_filename):
+    mark = None
+    with open(csv_filename, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            mark = update_high_water_mark(mark, row)
+    return mark
+
+# parses the command line arguments
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Dump all jobs of a cluster from Elasticsearch into cluster_data/.")
+    parser.add_argument("cluster_id", type=int, help="ClusterId to dump")
+    parser.add_argument("user", nargs="?", help="only dump jobs owned by this user")
+    parser.add_argument("--slices", type=int, default=1,
+                        help="number of parallel sliced scrolls (default: 1)")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE,
+                        help=f"hits per scroll page (default: {PAGE_SIZE})")
+    parser.add_argument("--fields",
+                        help="comma-separated attributes to fetch, or 'reports' for "
+                             "the columns the analysis tools read (default: all)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only fetch jobs changed since the last dump and merge them in")
+    parser.add_argument("--sample", type=int, metavar="N",
+                        help="only fetch N jobs picked at random, into cluster_<id>_sample_jobs.csv")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of --sample (default: 0)")
+    parser.add_argument("--store", action="store_true",
+                        help="ingest the jobs into the local job store (see store.py) instead of a CSV")
+    args = parser.parse_args(argv)
+    if args.slices < 1 or args.page_size < 1:
+        parser.error("--slices and --page-size must be at least 1")
+    if args.sample is not None:
+        if args.sample < 1:
+            parser.error("--sample must be at least 1")
+        # a sample is the best-ranked jobs of a single scroll, it cannot be split or merged
+        if args.slices > 1 or args.incremental or args.store:
+            parser.error("--sample cannot be combined with --slices, --incremental or --store")
+        # the reports read the sample of a whole cluster (see utils.sample_csv_path)
+        if args.user:
+            parser.error("--sample cannot be combined with a User")
+    args.fields = parse_fields(args.fields)
+    return args
+
+# turns the --fields value into a list of attribute names (None means all)
+def parse_fields(value):
+    if not value:
+        return None
+    if value == "reports":
+        fields = list(REPORT_FIELDS)
+    else:
+        fields = [name.strip() for name in value.split(",") if name.strip()]
+    # keep the attributes needed for later incremental refreshes
+    return fields + [name for name in (KEY_FIELD, HIGH_WATER_FIELD) if name not in fields]
+
+def main(argv=None):
+    args = parse_args(argv)
+    cluster_id = args.cluster_id
+    user = args.user
+
+    # Output directory and file
+    output_dir = os.path.join(os.getcwd(), "cluster_data")
+    os.makedirs(output_dir, exist_ok=True)
+
+    if args.sample:
+        csv_filename = sample_csv_path(cluster_id, output_dir)
+    else:
+        user_suffix = f"_{user}" if user else ""
+        csv_filename = os.path.join(output_dir, f"cluster_{cluster_id}{user_suffix}_jobs.csv")
+
+    # An incremental refresh reuses the projection and high-water mark of the last dump
+    fields = args.fields
+    since = None
+    if args.store:
+        from store import JobStore  # only needed with --store
+        store = JobStore()
+        if args.incremental:
+            since = store.high_water_mark(cluster_id, user)
+    elif args.incremental and os.path.exists(csv_filename):
+        meta = read_dump_meta(csv_filename) or {}
+        fields = fields or meta.get("fields")
+        since = meta.get("high_water_mark")
+        if since is None:
+            since = high_water_mark_from_csv(csv_filename)
+    if args.incremental:
+        if since is not None:
+            print(f"🔄 Refreshing jobs with {HIGH_WATER_FIELD} >= {since}")
+        else:
+            # nothing to refresh from: no earlier dump, or none of its jobs has the attribute
+            print(f"[WARN] No {HIGH_WATER_FIELD} high-water mark for ClusterId {cluster_id}, "
+                  f"falling back to a full dump")
+
+    with span("connect"):
+        es = connect_to_elasticsearch()
+    query = build_query(cluster_id, user, fields, since, args.seed if args.sample else None)
+    population = count_jobs(es, query) if args.sample else None
+
+    spills = [
+        tempfile.NamedTemporaryFile("w+", dir=output_dir, suffix=".jsonl",
+                                    encoding="utf-8", delete=False)
+        for _ in range(args.slices)
+    ]
+    try:
+        start = time.perf_counter()
+        with span("fetch") as fetch_span:
+            total, fieldnames = fetch_to_spills(es, query, spills, args.page_size,
+                                                typed=bool(fields), limit=args.sample or MAX_RESULTS)
+            fetch_span.rows = total
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed > 0 else 0
+        print(f"⏱  Fetched {total} jobs in {elapsed:.1f}s ({rate:.0f} docs/sec, "
+              f"{args.slices} slice(s), page size {args.page_size})")
+        if fields:
+            # a projected dump always has the same header, even for unseen fields
+            fieldnames = set(fields)
+
+        if args.store:
+            print(f"📂 Storing in: {store.path}")
+            with span("ingest", total), store:
+                store.ingest(read_spills(spills))
+        else:
+            print(f"📂 Writing to: {csv_filename}")
+            with span("write csv", total):
+                if since is None:
+                    mark = write_csv_from_spills(spills, fieldnames, csv_filename)
+                else:
+                    mark = upsert_csv_from_spills(spills, fieldnames, csv_filename)
+    finally:
+        for spill in spills:
+            spill.close()
+            os.remove(spill.name)
+
+    if args.store:
+        verb = "Merged" if since is not None else "Stored"
+        print(f"{verb} {total} jobs for ClusterId {cluster_id}" + (f" and user '{user}'" if user else "") + f" in {store.path}")
+        return
+
+    meta = {
+        "cluster_id": cluster_id,
+        "user": user,
+        "fields": fields,
+        "high_water_mark": mark if mark is not None else since,
+        "updated": int(time.time()),
+    }
+    if args.sample:
+        meta["sample"] = {"size": total, "seed": args.seed, "population": population}
+    write_dump_meta(csv_filename, meta)
 
-    # Clean up scroll
-    es.clear_scroll(scroll_id=scroll_id)
+    verb = "Merged" if since is not None else "Sampled" if args.sample else "Dumped"
+    print(f"{verb} {total} jobs for ClusterId {cluster_id}" + (f" and user '{user}'" if user else "") + f" to {csv_filename}")
 
 if __name__ == "__main__":
+    setup_from_argv()
     main()
@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import glob
+import argparse
+import numpy as np
+from datetime import timedelta
+from utils import REPORT_COLUMNS
+from jobcache import source_signature, iter_column_chunks, to_list, CHUNK_SIZE
+from store import open_store, add_store_arguments, filters_from_args, format_time, FILTER_OPTIONS
+from analytics import (
+    COLUMNS, SummarySketch, job_metrics, print_number_summary, print_utilization,
+)
+
+"""
+This program rolls up the resource usage of many clusters, per user or accounting group
+
+Each cluster's report is kept as a compact summary sketch in
+'cluster_data/cluster_<ClusterId>_summary.json', one SummarySketch (see analytics.py)
+per (Owner, AcctGroup, AcctGroupUser) found in the cluster. A sketch is built from the
+cluster CSV the first time it is needed and rebuilt whenever the CSV changes, so a
+rollup only reads and merges the small sketch files. Quantiles are approximate, with
+the error bound of the KLL sketches they come from; counts, means and standard
+deviations are exact. The sketches are seeded (see sketch.py), so a sketch rebuilt
+from an unchanged CSV is the same as the one saved before, and a rollup gives the
+same report whether its sketches were rebuilt or read back.
+
+With --store the jobs are read from the job store instead (see store.py), in
+chunks, with the owner filters, --host, --since and --until applied by the store.
+
+The output uses the "Number Summary Table" and "Overall Utilization" layout of analytics.py.
+"""
+
+# version 2: seeded sketches, so the files built before are rebuilt once
+SUMMARY_VERSION = 2
+
+# columns naming who a job belongs to
+GROUP_COLUMNS = REPORT_COLUMNS["rollup"]
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cluster_data")
+
+
+# path of the CSV dump of a cluster
+def csv_path_for(cluster_id, data_dir=DATA_DIR):
+    return os.path.join(data_dir, f"cluster_{cluster_id}_jobs.csv")
+
+
+# path of the saved summary sketch of a cluster
+def summary_path_for(cluster_id, data_dir=DATA_DIR):
+    return os.path.join(data_dir, f"cluster_{cluster_id}_summary.json")
+
+
+# ClusterIds of every CSV dump in the data directory
+def known_clusters(data_dir=DATA_DIR):
+    clusters = []
+    for path in glob.glob(os.path.join(data_dir, "cluster_*_jobs.csv")):
+        cluster_id = os.path.basename(path)[len("cluster_"):-len("_jobs.csv")]
+        if cluster_id.isdigit():
+            clusters.append(cluster_id)
+    return sorted(clusters, key=int)
+
+
+"""
+Builds one SummarySketch per (Owner, AcctGroup, AcctGroupUser) of a cluster CSV,
+reading it in chunks.
+
+    Parameters:
+        csv_path (str): Path to the cluster_<id>_jobs.csv file.
+        chunk_size (int): Maximum number of jobs read at once.
+
+    Returns:
+        Dict[Tuple[str, str, str], SummarySketch]: Sketch per group; missing values are "".
+"""
+def build_group_sketches(csv_path, chunk_size=CHUNK_SIZE):
+    sketches = {}
+    for columns, rows in iter_column_chunks(csv_path, COLUMNS + GROUP_COLUMNS, chunk_size):
+        labels = [[value if value is not None else "" for value in to_list(columns.get(name), rows)]
+                  for name in GROUP_COLUMNS]
+        group_index = {}
+        codes = np.array([group_index.setdefault(key, len(group_index)) for key in zip(*labels)])
+        for key, code in group_index.items():
+            mask = codes == code
+            subset = {name: values[mask] for name, values in columns.items()}
+            sketch = sketches.setdefault(key, SummarySketch())
+            sketch.update(job_metrics(subset, int(mask.sum())), int(mask.sum()))
+    return sketches
+
+
+# writes the sketches of a cluster next to its CSV
+def save_group_sketches(cluster_id, sketches, signature, data_dir=DATA_DIR):
+    data = {
+        "version": SUMMARY_VERSION,
+        "cluster_id": int(cluster_id),
+        "source": signature,
+        "groups": [
+            dict(zip(GROUP_COLUMNS, key), summary=sketch.to_dict())
+            for key, sketch in sketches.items()
+        ],
+    }
+    path = summary_path_for(cluster_id, data_dir)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+# reads the saved sketch file of a cluster, or None if it is missing or unreadable
+def read_summary_file(cluster_id, data_dir=DATA_DIR):
+    try:
+        with open(summary_path_for(cluster_id, data_dir), encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != SUMMARY_VERSION:
+        return None
+    return data
+
+
+"""
+Returns the sketches of a cluster, building and saving them first if the saved
+ones are missing or older than the cluster CSV.
+
+    Parameters:
+        cluster_id (str or int): The cluster.
+        data_dir (str): Directory holding the cluster CSVs and sketch files.
+
+    Returns:
+        List[Tuple[Dict[str, str], SummarySketch]]: (group labels, sketch) pairs,
+                                                    or None if the cluster has no data.
+"""
+def load_group_sketches(cluster_id, data_dir=DATA_DIR):
+    data = read_summary_file(cluster_id, data_dir)
+    csv_path = csv_path_for(cluster_id, data_dir)
+
+    if os.path.exists(csv_path):
+        signature = source_signature(csv_path)
+        if data is None or data.get("source") != signature:
+            sketches = build_group_sketches(csv_path)
+            try:
+                save_group_sketches(cluster_id, sketches, signature, data_dir)
+            except OSError as e:
+                print(f"[WARN] Could not save summary sketch for cluster {cluster_id}: {e}")
+            return [(dict(zip(GROUP_COLUMNS, key)), sketch) for key, sketch in sketches.items()]
+    elif data is None:
+        return None
+
+    return [({name: group.get(name, "") for name in GROUP_COLUMNS},
+             SummarySketch.from_dict(group["summary"]))
+            for group in data["groups"]]
+
+
+"""
+Merges the sketches of the selected clusters, keeping only the groups that match
+every given filter.
+
+    Parameters:
+        cluster_ids (List[str]): Clusters to roll up.
+        filters (Dict[str, str]): Required value per group column (Owner, AcctGroup, AcctGroupUser).
+        data_dir (str): Directory holding the cluster CSVs and sketch files.
+
+    Returns:
+        Tuple[SummarySketch, List[str]]: The merged sketch and the clusters that contributed to it.
+"""
+def rollup(cluster_ids, filters=None, data_dir=DATA_DIR):
+    filters = filters or {}
+    merged = SummarySketch()
+    used = []
+    for cluster_id in cluster_ids:
+        groups = load_group_sketches(cluster_id, data_dir)
+        if groups is None:
+            print(f"[WARN] No data for cluster {cluster_id}, skipping.")
+            continue
+        matched = False
+        for labels, sketch in groups:
+            if all(labels[name] == value for name, value in filters.items()):
+                merged.merge(sketch)
+                matched = True
+        if matched:
+            used.append(cluster_id)
+    return merged, used
+
+
+"""
+Rolls up the jobs of the job store that match the filters, reading them in chunks.
+
+    Parameters:
+        cluster_ids (List[str]): Clusters to roll up (every cluster in the store if empty).
+        filters (Dict[str, str]): Required value per group column (Owner, AcctGroup, AcctGroupUser).
+        store_filters (dict): The other store filters (host, since, until; see store.where_clause).
+
+    Returns:
+        Tuple[SummarySketch, List[int]]: The merged sketch and the clusters that contributed to it.
+"""
+def rollup_store(cluster_ids, filters, store_filters):
+    selection = dict(store_filters)
+    for name, column in (("owner", "Owner"), ("acct_group", "AcctGroup"), ("acct_group_user", "AcctGroupUser")):
+        if column in filters:
+            selection[name] = filters[column]
+    if cluster_ids:
+        selection["cluster_ids"] = cluster_ids
+
+    merged = SummarySketch()
+    with open_store() as store:
+        for table in store.iter_tables(COLUMNS, **selection):
+            merged.update(job_metrics(table, table.rows), table.rows)
+        used = sorted({row[0] for row in store.clusters(**selection)})
+    return merged, used
+
+
+# prints the rollup report
+def print_rollup(sketch, cluster_ids, filters):
+    avg_runtime = sketch.runtime.mean if sketch.runtime.count else 0
+    avg_runtime_str = str(timedelta(seconds=int(avg_runtime))) if avg_runtime else "N/A"
+    selection = ", ".join(f"{name}={value}" for name, value in filters.items()) or "all jobs"
+
+    print("=" * 80)
+    print(f"{'HTCondor Multi-Cluster Resource Rollup':^80}")
+    print("=" * 80)
+    print(f"{'Selection':>20}: {selection}")
+    print(f"{'Clusters':>20}: {len(cluster_ids)}")
+    print(f"{'Job Count':>20}: {sketch.total_jobs}")
+    print(f"{'Avg Runtime':>20}: {avg_runtime_str}")
+    print()
+
+    print_number_summary(
+        sketch.usage_stats("mem_used"),
+        sketch.usage_stats("disk_used"),
+        sketch.usage_stats("cpu_eff"),
+    )
+    print_utilization(
+        sketch.median_efficiency("mem_eff"),
+        sketch.median_efficiency("disk_eff"),
+        sketch.median_efficiency("cpu_eff"),
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Roll up the resource usage of many clusters.")
+    parser.add_argument("cluster_ids", nargs="*",
+                        help="ClusterIds to roll up (default: every cluster in cluster_data/)")
+    parser.add_argument("--owner", help="only jobs of this Owner")
+    parser.add_argument("--acct-group", help="only jobs of this AcctGroup")
+    parser.add_argument("--acct-group-user", help="only jobs of this AcctGroupUser")
+    add_store_arguments(parser, owner_filters=False)
+    args = parser.parse_args()
+
+    filters = {}
+    for name, value in zip(GROUP_COLUMNS, (args.owner, args.acct_group, args.acct_group_user)):
+        if value is not None:
+            filters[name] = value
+    # the owner filters are applied as group filters above
+    store_filters = {name: value for name, value in filters_from_args(args).items()
+                     if name in ("host", "since", "until")}
+    if store_filters and not args.store:
+        parser.error("--host, --since and --until can only be used with --store")
+
+    if args.store:
+        sketch, used = rollup_store(args.cluster_ids, filters, store_filters)
+        for name, value in store_filters.items():
+            filters[FILTER_OPTIONS[name][2:]] = format_time(value) if name in ("since", "until") else value
+    else:
+        cluster_ids = args.cluster_ids or known_clusters()
+        if not cluster_ids:
+            print(f"No cluster data found in {DATA_DIR}")
+            sys.exit(1)
+        sketch, used = rollup(cluster_ids, filters)
+    if not sketch.total_jobs:
+        print("No jobs match the selection.")
+        sys.exit(1)
+    print_rollup(sketch, used, filters)
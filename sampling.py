@@ -0,0 +1,104 @@
+import os
+import json
+import numpy as np
+
+"""
+Estimates with bootstrap confidence intervals, for reports run on a sample.
+
+"query.py <ClusterId> --sample N" writes a reproducible random sample of a
+cluster's jobs to 'cluster_data/cluster_<id>_sample_jobs.csv'. The reports run
+on it with --sample and print, next to their usual output, how far each
+estimated quantile or median can be trusted: the statistic is recomputed on
+N_BOOTSTRAP resamples (drawn with replacement) of the sample, and the interval
+holds the middle CONFIDENCE share of those values (percentile bootstrap).
+
+The resamples are drawn in batches of at most BATCH_VALUES values, so memory
+stays bounded for large samples, and from a fixed seed, so the same sample
+always gives the same intervals.
+"""
+
+N_BOOTSTRAP = 1000
+CONFIDENCE = 0.95
+BATCH_VALUES = 10_000_000
+
+
+# the "sample" entry query.py records in the dump metadata, or None
+def read_sample_info(csv_path):
+    try:
+        with open(os.path.splitext(csv_path)[0] + ".json", encoding="utf-8") as f:
+            return json.load(f).get("sample")
+    except (OSError, ValueError):
+        return None
+
+# one line describing the sample a report is estimated from
+def describe_sample(info, rows):
+    if not info:
+        return f"Estimated from a random sample of {rows} jobs"
+    return (f"Estimated from a random sample of {rows} of {info['population']} jobs "
+            f"(seed {info['seed']}), {CONFIDENCE:.0%} bootstrap confidence intervals")
+
+
+"""
+Computes statistics of a sample and their percentile bootstrap confidence intervals.
+
+    Parameters:
+        values (np.ndarray): The sample.
+        statistic (Callable[[np.ndarray], np.ndarray]): Computes the statistics of every
+            row of a 2-D array (axis=1), returning an array of shape (rows, k).
+        n_bootstrap (int): Number of resamples.
+        confidence (float): Share of the resampled statistics inside the interval.
+        seed (int): Random seed of the resampling.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The k statistics of the sample and the
+            lower and upper bounds of their intervals (all NaN for an empty sample).
+"""
+def bootstrap(values, statistic, n_bootstrap=N_BOOTSTRAP, confidence=CONFIDENCE, seed=0):
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        # the statistic of a placeholder value only tells how many statistics there are
+        nan = np.full(np.shape(statistic(np.zeros((1, 1))))[1], np.nan)
+        return nan, nan, nan
+    estimate = np.asarray(statistic(values[np.newaxis, :]), dtype=np.float64)[0]
+
+    rng = np.random.default_rng(seed)
+    batch = max(1, BATCH_VALUES // len(values))
+    resampled = []
+    for start in range(0, n_bootstrap, batch):
+        rows = min(batch, n_bootstrap - start)
+        resampled.append(statistic(values[rng.integers(0, len(values), (rows, len(values)))]))
+    resampled = np.concatenate(resampled)
+
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(resampled, [tail, 100 - tail], axis=0)
+    return estimate, low, high
+
+# quantiles (0-100) of a sample with their confidence intervals
+def bootstrap_percentiles(values, percents, method="linear", **kwargs):
+    return bootstrap(values, lambda rows: np.percentile(rows, percents, axis=1, method=method).T, **kwargs)
+
+# mean of a sample with its confidence interval
+def bootstrap_mean(values, **kwargs):
+    estimate, low, high = bootstrap(values, lambda rows: rows.mean(axis=1)[:, np.newaxis], **kwargs)
+    return estimate[0], low[0], high[0]
+
+
+"""
+Prints a table of estimates and their confidence intervals.
+
+    Parameters:
+        title (str): Heading of the table.
+        rows (List[Tuple[str, float, float, float, Callable[[float], str]]]): Label,
+            estimate, lower and upper bound, and the function that formats the values.
+"""
+def print_estimates(title, rows):
+    print(f"{title:^80}")
+    print("=" * 80)
+    print(f"{'Statistic':<30} {'Estimate':>14}   {f'{CONFIDENCE:.0%} interval':<30}")
+    print("-" * 80)
+    for label, estimate, low, high, fmt in rows:
+        if np.isnan(estimate):
+            print(f"{label:<30} {'N/A':>14}")
+        else:
+            print(f"{label:<30} {fmt(estimate):>14}   [{fmt(low)}, {fmt(high)}]")
+    print()
@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+"""
+Persistent cache of schedd query and history results.
+
+Dashboards and hold reports are often run again and again against the same
+busy access point. CachedSchedd wraps an htcondor.Schedd and answers query()
+and history() from a small SQLite file shared by every process of the user,
+keyed by (schedd, method, constraint, projection, limit). Results younger than
+the TTL are returned without contacting the schedd. With stale_while_revalidate
+set, a result up to that many seconds past its TTL is returned at once while a
+background thread (one per entry, across processes) fetches a fresh copy for
+the next caller. Entries are evicted least recently used first once the cache
+holds more than max_entries results or max_bytes of data.
+
+Cached ads only carry the projected attributes, as plain values, and support
+the parts of the ClassAd interface the tools use: ad.eval(name), ad.get(name)
+and "name" in ad. An attribute that evaluates to Undefined or Error is kept and
+evaluates to classad.Value.Undefined or classad.Value.Error, as on a live ad.
+"""
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "chtc-tools", "schedd_cache.sqlite")
+DEFAULT_TTL = 60
+MAX_ENTRIES = 1000
+MAX_BYTES = 64 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    fetched REAL NOT NULL,
+    last_used REAL NOT NULL,
+    refreshing REAL,
+    size INTEGER NOT NULL,
+    ads TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# a background refresh older than this is assumed to have died
+REFRESH_TIMEOUT = 300
+
+_local_schedd = None
+
+
+# the local htcondor.Schedd, located once per process and reused by every query
+def local_schedd():
+    global _local_schedd
+    if _local_schedd is None:
+        import htcondor  # only needed when the schedd is queried
+        _local_schedd = htcondor.Schedd()
+    return _local_schedd
+
+
+# a job ad read from the cache
+class CachedAd(dict):
+    def eval(self, name):
+        value = self[name]
+        if isinstance(value, dict) and list(value) == ["Value"]:
+            import classad  # only needed for the Undefined and Error values
+            return getattr(classad.Value, value["Value"])
+        return value
+
+    def get(self, name, default=None):
+        return self.eval(name) if name in self else default
+
+
+"""
+Stores query results as JSON, with LRU eviction by entry count and size.
+
+    Parameters:
+        path (str): Location of the SQLite file (created if missing).
+        max_entries (int): Number of results kept.
+        max_bytes (int): Total size of the results kept.
+
+Attributes hits, stale_hits and misses count the lookups made by this process;
+stats() also returns the totals over every run.
+"""
+class QueryCache:
+    def __init__(self, path=DEFAULT_PATH, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # returns (ads, age in seconds) of a cached result, or None
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT ads, fetched FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+        return [CachedAd(ad) for ad in json.loads(row[0])], time.time() - row[1]
+
+    # stores the result of a query (a list of dicts)
+    def put(self, key, ads):
+        data = json.dumps(ads)
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results (key, fetched, last_used, refreshing, size, ads) "
+                "VALUES (?, ?, ?, NULL, ?, ?)",
+                (key, now, now, len(data), data))
+            self.db.commit()
+
+    # marks an entry as being refreshed; False if another process already is refreshing it
+    def claim_refresh(self, key):
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute(
+                "UPDATE results SET refreshing = ? WHERE key = ? "
+                "AND (refreshing IS NULL OR refreshing < ?)",
+                (now, key, now - REFRESH_TIMEOUT))
+            self.db.commit()
+        return cursor.rowcount == 1
+
+    # drops the least recently used results beyond max_entries or max_bytes (call with the lock held)
+    def evict(self):
+        self.db.execute(
+            "DELETE FROM results WHERE key IN ("
+            " SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,))
+        self.db.execute(
+            "DELETE FROM results WHERE key IN ("
+            " SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY last_used DESC) AS total"
+            " FROM results) WHERE total > ?)",
+            (self.max_bytes,))
+
+    # hit/miss counters of this process and of every run so far
+    def stats(self):
+        with self.lock:
+            totals = dict(self.db.execute("SELECT name, value FROM counters"))
+            entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "total_hits": totals.get("hits", 0) + self.hits,
+            "total_stale_hits": totals.get("stale_hits", 0) + self.stale_hits,
+            "total_misses": totals.get("misses", 0) + self.misses,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        if self.db is None:
+            return
+        with self.lock:
+            for name, value in (("hits", self.hits), ("stale_hits", self.stale_hits), ("misses", self.misses)):
+                self.db.execute(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    (name, value))
+            self.evict()
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+
+"""
+Drop-in replacement for htcondor.Schedd that answers query() and history() from a QueryCache.
+
+    Parameters:
+        cache (QueryCache): Where results are stored.
+        schedd (htcondor.Schedd or None): Schedd to query on a miss, the local one by default
+                                          (only created when it is first needed).
+        ttl (float): Seconds a result is served without contacting the schedd.
+        stale_while_revalidate (float): Seconds past the TTL a result may still be served
+                                        while it is refreshed in the background.
+        name (str): Identifies the schedd in the cache keys.
+"""
+class CachedSchedd:
+    def __init__(self, cache, schedd=None, ttl=DEFAULT_TTL, stale_while_revalidate=0, name="local"):
+        self.cache = cache
+        self._schedd = schedd
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.name = name
+        self.refreshers = []
+
+    @property
+    def schedd(self):
+        if self._schedd is None:
+            self._schedd = local_schedd()  # only needed on a cache miss
+        return self._schedd
+
+    def query(self, constraint="true", projection=None, limit=-1):
+        return self.cached("query", constraint, projection or [], limit)
+
+    # the cached results are already a list, so xquery() is the same as query()
+    xquery = query
+
+    def history(self, constraint="true", projection=None, match=-1):
+        return self.cached("history", constraint, projection or [], match)
+
+    # waits for the background refreshes started by this process
+    def wait(self):
+        for thread in self.refreshers:
+            thread.join()
+        self.refreshers = []
+
+    def key(self, method, constraint, projection, limit):
+        text = json.dumps([self.name, method, str(constraint), sorted(projection), limit])
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def cached(self, method, constraint, projection, limit):
+        key = self.key(method, constraint, projection, limit)
+        entry = self.cache.get(key)
+        if entry is not None:
+            ads, age = entry
+            if age <= self.ttl:
+                self.cache.hits += 1
+                return ads
+            if age <= self.ttl + self.stale_while_revalidate:
+                self.cache.stale_hits += 1
+                if self.cache.claim_refresh(key):
+                    thread = threading.Thread(
+                        target=self.refresh, args=(key, method, constraint, projection, limit))
+                    thread.start()
+                    self.refreshers.append(thread)
+                return ads
+
+        self.cache.misses += 1
+        ads = self.fetch(method, constraint, projection, limit)
+        self.cache.put(key, ads)
+        return [CachedAd(ad) for ad in ads]
+
+    def refresh(self, key, method, constraint, projection, limit):
+        try:
+            self.cache.put(key, self.fetch(method, constraint, projection, limit))
+        except Exception as e:
+            print(f"[WARN] Background refresh of a schedd {method} failed: {e}")
+
+    # runs the query on the schedd and keeps the projected attributes as plain values
+    def fetch(self, method, constraint, projection, limit):
+        if method == "history":
+            ads = self.schedd.history(constraint=constraint, projection=projection, match=limit)
+        else:
+            ads = self.schedd.query(constraint=constraint, projection=projection, limit=limit)
+
+        results = []
+        for ad in ads:
+            row = {}
+            for name in projection or ad.keys():
+                if name not in ad:
+                    continue
+                value = ad.eval(name)
+                if type(value) in (bool, int, float, str, list):
+                    row[name] = value
+                    continue
+                import classad
+                # Undefined and Error are stored by name (see CachedAd.eval); other
+                # values (nested ads, unevaluated expressions) are left out
+                if isinstance(value, classad.Value):
+                    row[name] = {"Value": value.name}
+            results.append(row)
+        return results
+
+
+# prints the statistics returned by QueryCache.stats()
+def print_stats(stats):
+    print(f"\nQuery cache: {stats['hits']} hit(s), {stats['stale_hits']} stale hit(s), "
+          f"{stats['misses']} miss(es) this run; {stats['total_hits']} hit(s), "
+          f"{stats['total_stale_hits']} stale hit(s), {stats['total_misses']} miss(es) in total, "
+          f"{stats['entries']} result(s) stored ({stats['bytes']} bytes)")
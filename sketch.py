@@ -0,0 +1,193 @@
+import math
+import random
+import numpy as np
+
+"""
+Mergeable summaries for computing report statistics in bounded memory.
+
+KLLSketch is the KLL quantile sketch (Karnin, Lang and Liberty, 2016). It keeps
+about 3 * k values whatever the number of updates. With the default k = 200 the
+rank of a reported quantile is within about 1% of the requested one (for the
+median: between the 49th and 51st percentile) with high probability. The error
+does not depend on the number of values or on how sketches were merged. The
+minimum and maximum are exact, and so is every quantile of up to k values
+(the sketch only compacts once it holds more). The random compaction offsets come from a
+generator with a fixed seed, so the same values, added and merged in the same
+order, always give the same sketch and a rerun of a report reproduces it.
+
+RunningStats keeps count, mean, sum of squared deviations, minimum and maximum
+(Welford's algorithm, merged with Chan et al.'s pairwise update), so mean and
+standard deviation are exact up to floating-point rounding.
+
+Both can be merged and round-tripped through plain dicts (to_dict/from_dict).
+"""
+
+DEFAULT_K = 200
+DEFAULT_SEED = 0
+
+
+"""
+KLL quantile sketch.
+
+    Parameters:
+        k (int): Accuracy parameter; the sketch keeps about 3 * k values.
+        seed (int): Seed for the random compaction offsets.
+"""
+class KLLSketch:
+    SHRINK = 2 / 3
+
+    def __init__(self, k=DEFAULT_K, seed=DEFAULT_SEED):
+        self.k = k
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.levels = []
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.max_size = 0
+        self.grow()
+
+    # number of items a level may hold before it is compacted
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return int(math.ceil(self.SHRINK ** depth * self.k)) + 1
+
+    def grow(self):
+        self.levels.append([])
+        self.max_size = sum(self.capacity(level) for level in range(len(self.levels)))
+
+    def size(self):
+        return sum(len(items) for items in self.levels)
+
+    # adds an array (or list) of values, ignoring NaN
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0].extend(values.tolist())
+        self.compress()
+
+    # halves the lowest full level into the next one until the sketch fits
+    def compress(self):
+        while self.size() >= self.max_size:
+            for level, items in enumerate(self.levels):
+                if len(items) >= self.capacity(level):
+                    if level + 1 == len(self.levels):
+                        self.grow()
+                    items.sort()
+                    # an odd item out stays behind; every other item of the rest moves up
+                    start = len(items) % 2
+                    self.levels[level + 1].extend(items[start + self.rng.randint(0, 1)::2])
+                    self.levels[level] = items[:start]
+                    break
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.grow()
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+        return self
+
+    """
+    Returns the values at the given quantiles (each between 0 and 1).
+    Quantile 0 and 1 are the exact minimum and maximum; NaN if the sketch is empty.
+    """
+    def quantiles(self, qs):
+        qs = np.asarray(qs, dtype=np.float64)
+        if not self.count:
+            return np.full(qs.shape, np.nan)
+
+        values = np.concatenate([np.asarray(items, dtype=np.float64) for items in self.levels])
+        weights = np.concatenate([np.full(len(items), 2.0 ** level)
+                                  for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values = values[order]
+        cumulative = np.cumsum(weights[order])
+
+        index = np.searchsorted(cumulative, qs * cumulative[-1], side="left")
+        result = values[np.clip(index, 0, len(values) - 1)]
+        result = np.where(qs <= 0, self.min, result)
+        return np.where(qs >= 1, self.max, result)
+
+    def quantile(self, q):
+        return float(self.quantiles([q])[0])
+
+    def to_dict(self):
+        return {"k": self.k, "seed": self.seed, "count": self.count, "min": self.min, "max": self.max,
+                "levels": self.levels}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(k=data["k"], seed=data.get("seed", DEFAULT_SEED))
+        sketch.levels = []
+        for items in data["levels"]:
+            sketch.grow()
+            sketch.levels[-1] = list(items)
+        sketch.count = data["count"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        return sketch
+
+
+"""
+Exact, mergeable count / mean / standard deviation / min / max.
+"""
+class RunningStats:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    # adds an array (or list) of values, ignoring NaN
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        chunk = RunningStats()
+        chunk.count = len(values)
+        chunk.mean = float(values.mean())
+        chunk.m2 = float(((values - chunk.mean) ** 2).sum())
+        chunk.min = float(values.min())
+        chunk.max = float(values.max())
+        self.merge(chunk)
+
+    def merge(self, other):
+        if not other.count:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    # sample standard deviation (ddof=1), NaN for fewer than 2 values
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else math.nan
+
+    def to_dict(self):
+        return {"count": self.count, "mean": self.mean, "m2": self.m2,
+                "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count = data["count"]
+        stats.mean = data["mean"]
+        stats.m2 = data["m2"]
+        stats.min = data["min"]
+        stats.max = data["max"]
+        return stats
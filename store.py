@@ -0,0 +1,496 @@
+import os
+import sys
+import csv
+import glob
+import json
+import math
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+from utils import FIELD_TYPES
+from profiling import span, setup_from_argv
+
+"""
+Local job-history store spanning many clusters.
+
+'cluster_data/' holds one CSV per cluster, with no index, so a question such as
+"all my clusters of the last week" or "every job that ran on host X" means
+reading every file or querying Elasticsearch again. "query.py <ClusterId>
+--store" ingests the jobs into one SQLite file instead ('~/.cache/chtc-tools/jobs.sqlite',
+or $CHTC_TOOLS_STORE), and "store.py ingest" loads existing CSV dumps into it.
+
+Every job is one row, keyed by GlobalJobId, so ingesting a cluster again
+replaces its jobs. The attributes of utils.FIELD_TYPES are typed columns; the
+whole job ad is kept as JSON, with its values written as in the CSV dumps.
+There are indexes on ClusterId, Owner and AcctGroup (each followed by
+CompletionDate, so "this owner since last week" is one index range),
+CompletionDate, LastRemoteHost and the machine part of it (LastRemoteMachine,
+after the last "@"), so the filters below are answered without a scan:
+
+    --cluster ID[,ID...]   --owner USER   --acct-group GROUP   --acct-group-user USER
+    --host HOST (slot@machine or machine)   --since TIME   --until TIME
+
+TIME is epoch seconds, a date (YYYY-MM-DD[THH:MM]) or an age such as 7d, 12h or
+30m, and applies to CompletionDate.
+
+analytics.py, histogram.py, summarise.py, rollup.py and batch.py run off the
+store with --store, plus any of these filters: only the matching rows and the
+columns the report reads are loaded (as a jobtable.JobTable). With --store the
+ClusterId of analytics, histogram and summarise may be "all", for every
+cluster matching the filters.
+
+    python store.py ingest [CSV ...]            (default: every cluster_data/cluster_*_jobs.csv)
+    python store.py clusters [filters]          one line per cluster
+    python store.py jobs [filters] [--columns A,B,...] [--limit N]
+    python store.py stats
+"""
+
+DEFAULT_PATH = os.environ.get("CHTC_TOOLS_STORE") or os.path.join(
+    os.path.expanduser("~"), ".cache", "chtc-tools", "jobs.sqlite")
+
+# jobs written per transaction when ingesting
+BATCH_ROWS = 10000
+
+KEY_COLUMN = "GlobalJobId"
+SQL_TYPES = {int: "INTEGER", float: "REAL", str: "TEXT"}
+TYPED_COLUMNS = [name for name in FIELD_TYPES if name != KEY_COLUMN]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS jobs (
+    {KEY_COLUMN} TEXT PRIMARY KEY,
+    {", ".join(f"{name} {SQL_TYPES[FIELD_TYPES[name]]}" for name in TYPED_COLUMNS)},
+    LastRemoteMachine TEXT,
+    ad TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_cluster ON jobs (ClusterId);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (Owner, CompletionDate);
+CREATE INDEX IF NOT EXISTS jobs_acct_group ON jobs (AcctGroup, CompletionDate);
+CREATE INDEX IF NOT EXISTS jobs_completion ON jobs (CompletionDate);
+CREATE INDEX IF NOT EXISTS jobs_host ON jobs (LastRemoteHost);
+CREATE INDEX IF NOT EXISTS jobs_machine ON jobs (LastRemoteMachine);
+CREATE TABLE IF NOT EXISTS attributes (
+    name TEXT PRIMARY KEY
+);
+"""
+
+# seconds per unit of an age such as "7d"
+AGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+# filter name -> command line option
+FILTER_OPTIONS = {
+    "owner": "--owner",
+    "acct_group": "--acct-group",
+    "acct_group_user": "--acct-group-user",
+    "host": "--host",
+    "since": "--since",
+    "until": "--until",
+}
+
+
+# parses a time given as epoch seconds, a date (YYYY-MM-DD[THH:MM]) or an age such as 7d
+def parse_time(text, now=None):
+    text = text.strip()
+    unit = AGE_UNITS.get(text[-1:].lower())
+    if unit is not None and text[:-1].replace(".", "", 1).isdigit():
+        return (time.time() if now is None else now) - float(text[:-1]) * unit
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+# converts a value to the type of its column, None if it is missing or does not convert;
+# a fractional value of an integer column is kept as a float rather than truncated
+def typed_value(convert, value):
+    if value is None or value == "":
+        return None
+    try:
+        if convert is not int:
+            return convert(value)
+        number = float(value)
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if not math.isfinite(number):
+        return None
+    return int(number) if number.is_integer() else number
+
+
+# the row of a job (a dict of attributes, as fetched or read from a CSV dump)
+def job_row(job):
+    values = [typed_value(FIELD_TYPES[name], job.get(name)) for name in TYPED_COLUMNS]
+    host = values[TYPED_COLUMNS.index("LastRemoteHost")]
+    key = job.get(KEY_COLUMN) or None
+    if key is None and job.get("ClusterId") not in (None, "") and job.get("ProcId") not in (None, ""):
+        key = f"{job['ClusterId']}.{job['ProcId']}"
+    # the ad keeps every value the way the CSV dumps write it
+    ad = {name: value if isinstance(value, str) else str(value)
+          for name, value in job.items() if value is not None and value != ""}
+    machine = host.rpartition("@")[2] if host else None
+    return [key] + values + [machine, json.dumps(ad)]
+
+
+"""
+Builds the WHERE clause of a selection of jobs.
+
+    Parameters:
+        cluster_ids (List[str or int] or None): Only these clusters.
+        owner, acct_group, acct_group_user (str or None): Only jobs with this value.
+        host (str or None): Only jobs whose LastRemoteHost, or its machine part, is this.
+        since, until (float or None): Only jobs with since <= CompletionDate < until.
+
+    Returns:
+        Tuple[str, List]: The clause (empty if nothing is filtered) and its parameters.
+"""
+def where_clause(cluster_ids=None, owner=None, acct_group=None, acct_group_user=None,
+                 host=None, since=None, until=None):
+    conditions = []
+    params = []
+    if cluster_ids:
+        conditions.append(f"ClusterId IN ({', '.join('?' * len(cluster_ids))})")
+        params += [int(cluster_id) for cluster_id in cluster_ids]
+    for column, value in (("Owner", owner), ("AcctGroup", acct_group), ("AcctGroupUser", acct_group_user)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if host is not None:
+        conditions.append("(LastRemoteHost = ? OR LastRemoteMachine = ?)")
+        params += [host, host]
+    if since is not None:
+        conditions.append("CompletionDate >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("CompletionDate < ?")
+        params.append(until)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+# a column fetched from the store as a typed array, typed as jobcache types a CSV column:
+# whole numbers with none missing are int64, other numbers float64 with NaN for missing values
+def typed_column(values):
+    import numpy as np
+    from jobcache import infer_column
+
+    if values and all(type(value) is int or (type(value) is float and value.is_integer() and abs(value) < 2 ** 63)
+                      for value in values):
+        return np.array(values, dtype=np.int64)
+    if all(value is None or type(value) in (int, float) for value in values):
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    return infer_column(["" if value is None else str(value) for value in values], encode_text=True)
+
+
+"""
+The job store: one SQLite file holding the jobs of many clusters.
+
+    Parameters:
+        path (str or None): Location of the SQLite file (DEFAULT_PATH by default).
+        create (bool): Create the file if it is missing; otherwise a missing
+                       store raises FileNotFoundError.
+"""
+class JobStore:
+    def __init__(self, path=None, create=True):
+        self.path = path or DEFAULT_PATH
+        if not create and not os.path.exists(self.path):
+            raise FileNotFoundError(self.path)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    """
+    Adds jobs to the store, replacing the stored jobs with the same GlobalJobId.
+
+        Parameters:
+            jobs (Iterable[dict]): The jobs, as fetched from Elasticsearch or read from a CSV dump.
+
+        Returns:
+            int: Number of jobs written.
+    """
+    def ingest(self, jobs):
+        columns = [KEY_COLUMN] + TYPED_COLUMNS + ["LastRemoteMachine", "ad"]
+        sql = f"INSERT OR REPLACE INTO jobs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        total = 0
+        names = set()
+        batch = []
+        for job in jobs:
+            names.update(name for name, value in job.items() if value is not None and value != "")
+            batch.append(job_row(job))
+            if len(batch) == BATCH_ROWS:
+                total += self.write_batch(sql, batch, names)
+                batch = []
+        total += self.write_batch(sql, batch, names)
+        return total
+
+    # writes one batch of rows and the attribute names seen, in one transaction
+    def write_batch(self, sql, rows, names):
+        with self.db:
+            self.db.executemany(sql, rows)
+            self.db.executemany("INSERT OR IGNORE INTO attributes (name) VALUES (?)", [(n,) for n in names])
+        return len(rows)
+
+    # every attribute seen in the stored jobs, sorted
+    def attributes(self):
+        return [row[0] for row in self.db.execute("SELECT name FROM attributes ORDER BY name")]
+
+    # the latest EnteredCurrentStatus stored for a cluster (and owner), or None
+    def high_water_mark(self, cluster_id, owner=None):
+        clause, params = where_clause([cluster_id], owner=owner)
+        return self.db.execute(f"SELECT MAX(EnteredCurrentStatus) FROM jobs{clause}", params).fetchone()[0]
+
+    # SELECT expression of an attribute: its typed column, or its value in the ad
+    def select_expressions(self, names):
+        expressions = []
+        params = []
+        for name in names:
+            if name in FIELD_TYPES:
+                expressions.append(name)
+            else:
+                expressions.append("json_extract(ad, ?)")
+                params.append('$."' + name.replace('"', '\\"') + '"')
+        return expressions, params
+
+    """
+    Loads the selected jobs as a JobTable, reading only the given attributes.
+
+        Parameters:
+            columns (List[str] or None): Attributes to load, or None for the typed
+                                         columns. Attributes never stored are skipped.
+            **filters: The selection (see where_clause).
+
+        Returns:
+            jobtable.JobTable: The jobs, typed as load_table() types a CSV dump.
+    """
+    def load_table(self, columns=None, **filters):
+        from jobtable import JobTable
+
+        known = set(self.attributes())
+        names = list(FIELD_TYPES) if columns is None else [name for name in dict.fromkeys(columns) if name in known]
+        clause, where_params = where_clause(**filters)
+        if not names:
+            rows = self.db.execute(f"SELECT COUNT(*) FROM jobs{clause}", where_params).fetchone()[0]
+            return JobTable({}, rows, self.path)
+
+        expressions, params = self.select_expressions(names)
+        result = self.db.execute(f"SELECT {', '.join(expressions)} FROM jobs{clause}",
+                                 params + where_params).fetchall()
+        values = list(zip(*result)) if result else [()] * len(names)
+        return JobTable({name: typed_column(list(column)) for name, column in zip(names, values)},
+                        len(result), self.path)
+
+    # yields the selected jobs as JobTables of at most chunk_size jobs (see load_table)
+    def iter_tables(self, columns, chunk_size=BATCH_ROWS, **filters):
+        from jobtable import JobTable
+
+        known = set(self.attributes())
+        names = [name for name in dict.fromkeys(columns) if name in known]
+        expressions, params = self.select_expressions(names)
+        clause, where_params = where_clause(**filters)
+        cursor = self.db.execute(f"SELECT {', '.join(expressions) or 'NULL'} FROM jobs{clause}",
+                                 params + where_params)
+        while True:
+            result = cursor.fetchmany(chunk_size)
+            if not result:
+                return
+            values = list(zip(*result))
+            yield JobTable({name: typed_column(list(column)) for name, column in zip(names, values)},
+                           len(result), self.path)
+
+    # one (ClusterId, Owner, jobs, first QDate, last CompletionDate) row per selected cluster
+    def clusters(self, **filters):
+        clause, params = where_clause(**filters)
+        return self.db.execute(
+            f"SELECT ClusterId, Owner, COUNT(*), MIN(QDate), MAX(CompletionDate) FROM jobs{clause} "
+            "GROUP BY ClusterId, Owner ORDER BY ClusterId, Owner", params).fetchall()
+
+    # the given attributes of the selected jobs, as rows of values
+    def find_jobs(self, columns, limit=None, **filters):
+        expressions, params = self.select_expressions(columns)
+        clause, where_params = where_clause(**filters)
+        sql = f"SELECT {', '.join(expressions)} FROM jobs{clause} ORDER BY ClusterId, ProcId"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return self.db.execute(sql, params + where_params).fetchall()
+
+    # number of jobs and clusters stored
+    def stats(self):
+        jobs, clusters = self.db.execute("SELECT COUNT(*), COUNT(DISTINCT ClusterId) FROM jobs").fetchone()
+        return {"jobs": jobs, "clusters": clusters, "bytes": os.path.getsize(self.path)}
+
+
+# adds --store and the store filters to an argument parser (owner filters only if asked)
+def add_store_arguments(parser, owner_filters=True):
+    parser.add_argument("--store", action="store_true",
+                        help=f"read the jobs from the job store ({DEFAULT_PATH}) instead of the CSV dumps")
+    if owner_filters:
+        parser.add_argument("--owner", help="with --store: only jobs of this Owner")
+        parser.add_argument("--acct-group", help="with --store: only jobs of this AcctGroup")
+        parser.add_argument("--acct-group-user", help="with --store: only jobs of this AcctGroupUser")
+    parser.add_argument("--host", help="with --store: only jobs that ran on this host (slot@machine or machine)")
+    parser.add_argument("--since", type=parse_time,
+                        help="with --store: only jobs completed at or after this time (epoch, date or age like 7d)")
+    parser.add_argument("--until", type=parse_time,
+                        help="with --store: only jobs completed before this time")
+
+
+# the store filters given on the command line, by filter name
+def filters_from_args(args):
+    return {name: getattr(args, name) for name in FILTER_OPTIONS
+            if getattr(args, name, None) is not None}
+
+
+"""
+Removes --store and the store filters from an argument list (sys.argv by default,
+in place), for the tools that read their other arguments by position.
+
+    Returns:
+        dict or None: The filters (see where_clause) if --store was given, else None.
+"""
+def store_filters_from_argv(argv=None):
+    args = sys.argv if argv is None else argv
+    parser = argparse.ArgumentParser(prog=os.path.basename(args[0]), add_help=False, allow_abbrev=False)
+    add_store_arguments(parser)
+    options, rest = parser.parse_known_args(args[1:])
+    args[1:] = rest
+    filters = filters_from_args(options)
+    if not options.store:
+        if filters:
+            print(f"Error: {', '.join(FILTER_OPTIONS[name] for name in filters)} can only be used with --store")
+            sys.exit(1)
+        return None
+    return filters
+
+
+# opens the existing store, exiting with a message if there is none
+def open_store(path=None):
+    try:
+        return JobStore(path, create=False)
+    except FileNotFoundError:
+        print(f"No job store at {path or DEFAULT_PATH}. Fill it with: python query.py <ClusterId> --store")
+        sys.exit(1)
+
+
+"""
+Loads the jobs a report reads from the store, exiting with a message if the
+store is missing or no job matches.
+
+    Parameters:
+        cluster_id (str): The cluster, or "all" for every cluster matching the filters.
+        columns (List[str] or None): Attributes to load.
+        filters (dict): The other filters (see where_clause).
+
+    Returns:
+        jobtable.JobTable: The selected jobs.
+"""
+def load_report_table(cluster_id, columns, filters):
+    selection = dict(filters)
+    if cluster_id != "all":
+        selection["cluster_ids"] = [cluster_id]
+    with open_store() as store, span("query store") as s:
+        table = store.load_table(columns, **selection)
+        s.rows = table.rows
+    if not table.rows:
+        print(f"No jobs in the job store match ClusterId {cluster_id}"
+              + "".join(f", {FILTER_OPTIONS[name]} {value}" for name, value in filters.items()))
+        sys.exit(1)
+    return table
+
+
+# reads the jobs of a CSV dump as dicts
+def read_csv_jobs(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        yield from csv.DictReader(f)
+
+
+# formats an epoch time for the listings
+def format_time(epoch):
+    return datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M") if epoch else "-"
+
+
+# prints the rows of a listing as aligned columns
+def print_rows(headers, rows):
+    rows = [["-" if value is None else str(value) for value in row] for row in rows]
+    widths = [max([len(header)] + [len(row[i]) for row in rows]) for i, header in enumerate(headers)]
+    print("  ".join(header.ljust(width) for header, width in zip(headers, widths)).rstrip())
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+
+# parses the command line arguments
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local job-history store spanning many clusters.")
+    parser.add_argument("--path", default=DEFAULT_PATH, help=f"store file (default: {DEFAULT_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="load CSV dumps into the store")
+    ingest.add_argument("csv_files", nargs="*",
+                        help="cluster CSV dumps (default: every cluster_data/cluster_*_jobs.csv)")
+
+    for name, help_text in (("clusters", "list the clusters matching the filters"),
+                            ("jobs", "list the jobs matching the filters")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--cluster", help="only these clusters (comma-separated ClusterIds)")
+        add_store_arguments(command)
+        if name == "jobs":
+            command.add_argument("--columns", default="GlobalJobId,Owner,LastRemoteHost,CompletionDate",
+                                 help="comma-separated attributes to print")
+            command.add_argument("--limit", type=int, default=100, help="most jobs printed (default: 100)")
+
+    commands.add_parser("stats", help="print the size of the store")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "ingest":
+        paths = args.csv_files or sorted(path for path in glob.glob(os.path.join("cluster_data", "cluster_*_jobs.csv"))
+                                         if not path.endswith("_sample_jobs.csv"))
+        if not paths:
+            print("No CSV dumps to ingest.")
+            sys.exit(1)
+        with JobStore(args.path) as store:
+            for path in paths:
+                start = time.perf_counter()
+                with span("ingest") as s:
+                    s.rows = store.ingest(read_csv_jobs(path))
+                print(f"Ingested {s.rows} jobs from {path} in {time.perf_counter() - start:.1f}s")
+        return
+
+    with open_store(args.path) as store:
+        if args.command == "stats":
+            stats = store.stats()
+            print(f"{stats['jobs']} jobs of {stats['clusters']} clusters in {args.path} "
+                  f"({stats['bytes'] / 1024 / 1024:.1f} MiB)")
+            return
+
+        filters = filters_from_args(args)
+        if args.cluster:
+            filters["cluster_ids"] = [c.strip() for c in args.cluster.split(",") if c.strip()]
+        start = time.perf_counter()
+        with span("query store") as s:
+            if args.command == "clusters":
+                headers = ["ClusterId", "Owner", "Jobs", "First submit", "Last completion"]
+                rows = [(cluster, owner, jobs, format_time(first), format_time(last))
+                        for cluster, owner, jobs, first, last in store.clusters(**filters)]
+            else:
+                headers = [name.strip() for name in args.columns.split(",") if name.strip()]
+                rows = store.find_jobs(headers, args.limit, **filters)
+            s.rows = len(rows)
+        elapsed = time.perf_counter() - start
+
+        print_rows(headers, rows)
+        print(f"\n{len(rows)} {args.command[:-1]}(s) ({elapsed * 1000:.1f} ms)")
+
+if __name__ == "__main__":
+    setup_from_argv()
+    main()
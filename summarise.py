@@ -1,26 +1,57 @@
 import os
-import csv
 import sys
+from profiling import span, setup_from_argv
+from daemon import serve_from_daemon
+
+# run as a script, hand the report to the daemon (see daemon.py) before the
+# modules below are imported; they are not needed when it answers
+if __name__ == "__main__":
+    setup_from_argv()
+    serve_from_daemon("summarise")
+
+import numpy as np
 from tabulate import tabulate
+from jobcache import read_header, to_list
+from jobtable import load_table
+from store import open_store, load_report_table, store_filters_from_argv
+from utils import REPORT_COLUMNS
 
 """
 This Python script prints a summary table for a given cluster's jobs
 using selected parameters from the corresponding CSV in 'cluster_data/'.
 It supports command-line parameter selection and auto-converts RAW values to GiB.
+
+Only the header and the columns of ProcId and the selected parameters are read
+(through the column cache, see jobcache.py). Each column is converted once as a
+whole, and the table rows are generated from the typed columns as they are
+rendered.
 """
 
-# finds the cluster data from the folder based on the clusterId
-def load_job_data(cluster_id, folder="cluster_data"):
+# default list of attributes to summarise if none have been passed
+DEFAULT_PARAMS = [param for param in REPORT_COLUMNS["summarise"] if param != "ProcId"]
+
+# finds the cluster data from the folder based on the clusterId, checks the
+# selected parameters against its header and loads the typed columns of
+# ProcId plus the selected parameters; returns (names, JobTable, number of jobs).
+# Given store filters, the jobs are read from the job store instead (see store.py)
+def load_job_columns(cluster_id, selected_params, folder="cluster_data", store_filters=None):
+    names = ["ProcId"] + [param for param in selected_params if param != "ProcId"]
+    if store_filters is not None:
+        with open_store() as store:
+            validate_params(store.attributes(), selected_params)
+        table = load_report_table(cluster_id, names, store_filters)
+        return names, table, table.rows
+
     filepath = os.path.join(folder, f"cluster_{cluster_id}_jobs.csv")
     if not os.path.exists(filepath):
         print(f"File not found: {filepath}")
         sys.exit(1)
 
-    with open(filepath, newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        jobs = list(reader)
+    header = read_header(filepath)
+    validate_params(header, selected_params)
 
-    return jobs
+    table = load_table(filepath, names)
+    return names, table, table.rows
 
 # safe conversion to float
 def safe_float(val):
@@ -30,11 +61,10 @@ def safe_float(val):
         return None
 
 # check if all selected parameters exist in the CSV header
-def validate_params(jobs, selected_params):
-    if not jobs:
+def validate_params(csv_keys, selected_params):
+    if not csv_keys:
         return
 
-    csv_keys = jobs[0].keys()
     missing = [param for param in selected_params if param not in csv_keys]
 
     if missing:
@@ -42,54 +72,67 @@ def validate_params(jobs, selected_params):
         print(f"Available columns: {', '.join(csv_keys)}")
         sys.exit(1)
 
-# extract selected parameter values for each job
-def extract_requested_vs_used(jobs, selected_params):
-    rows = []
-    for job in jobs:
-        row = {
-            "ProcId": job.get("ProcId")
-        }
-        for param in selected_params:
-            raw_val = job.get(param)
-            val = safe_float(raw_val)
-
-            # Use original value if not a float 
-            if val is None:
-                val = raw_val
-            elif "RAW" in param:
-                val = val / 1024  # Convert MiB to GiB
-
-            row[param] = val
-
-        rows.append(row)
-    return rows
+# converts one value: numbers become floats (RAW values are converted from MiB
+# to GiB), other values are kept as they are
+def convert_value(param, raw_val):
+    val = safe_float(raw_val)
+
+    # Use original value if not a float
+    if val is None:
+        return raw_val
+    if "RAW" in param:
+        val = val / 1024  # Convert MiB to GiB
+    return val
+
+# converts a whole column the way convert_value() converts each value; numeric
+# columns are converted as one array
+def convert_column(param, values, rows):
+    if values is None:
+        return [None] * rows
+    if values.dtype.kind in "iuf":
+        values = values.astype(np.float64)
+        if "RAW" in param:
+            values = values / 1024  # Convert MiB to GiB
+        return to_list(values, rows)
+
+    return [convert_value(param, raw_val) for raw_val in to_list(values, rows)]
+
+# generates the rows of the summary table from the typed columns, one job at a time
+def summary_rows(columns, selected_params, rows):
+    keys = ["ProcId"] + list(selected_params)
+    values = [to_list(columns.get("ProcId"), rows)]
+    values += [convert_column(param, columns.get(param), rows) for param in selected_params]
+    for job in zip(*values):
+        yield dict(zip(keys, job))
 
 # main execution logic
 def main():
+    store_filters = store_filters_from_argv()
     if len(sys.argv) < 2:
-        print("Usage: python summarise.py <ClusterId> [param1 param2 ...]")
+        print("Usage: python summarise.py <ClusterId> [param1 param2 ...] [--store [filters]] [--profile]")
         sys.exit(1)
 
     cluster_id = sys.argv[1]
 
-    # default list of attributes to summarise if none have been passed
-    selected_params = sys.argv[2:] if len(sys.argv) > 2 else [
-        "RequestCpus", "CpusProvisioned", "RemoteSysCpu", 
-        "RemoteUserCpu", "RemoteWallClockTime", "ResidentSetSize_RAW"
-    ]
+    selected_params = sys.argv[2:] if len(sys.argv) > 2 else DEFAULT_PARAMS
+
+    summarise(cluster_id, selected_params, store_filters)
 
-    jobs = load_job_data(cluster_id)
-    validate_params(jobs, selected_params)
-    data = extract_requested_vs_used(jobs, selected_params)
-    total_jobs = len(data)
+# prints the summary table of a cluster
+def summarise(cluster_id, selected_params=DEFAULT_PARAMS, store_filters=None):
+    with span("load") as load_span:
+        _, columns, total_jobs = load_job_columns(cluster_id, selected_params, store_filters=store_filters)
+        load_span.rows = total_jobs
 
-    if not data:
+    if not total_jobs:
         print("No valid job data found.")
         return
 
-    print(f"\nSummary for ClusterId: {cluster_id}")
-    print(f"Total Jobs: {total_jobs}\n")
-    print(tabulate(data, headers="keys", tablefmt="grid", floatfmt=".2f"))
+    with span("render", total_jobs):
+        print(f"\nSummary for ClusterId: {cluster_id}")
+        print(f"Total Jobs: {total_jobs}\n")
+        print(tabulate(summary_rows(columns, selected_params, total_jobs),
+                       headers="keys", tablefmt="grid", floatfmt=".2f"))
 
 if __name__ == "__main__":
     main()
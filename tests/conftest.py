@@ -0,0 +1,45 @@
+import os
+import sys
+import csv
+import random
+import shutil
+import pytest
+
+# the tools are flat scripts; the fakes live with the benchmarks
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+
+from synthetic import FIXTURE, write_cluster_csv
+
+FIXTURE_CLUSTER_ID = "4421577"
+
+
+# a copy of the fixture dump in cluster_data/ of a temporary working directory
+@pytest.fixture
+def fixture_csv(tmp_path, monkeypatch):
+    (tmp_path / "cluster_data").mkdir()
+    path = tmp_path / "cluster_data" / f"cluster_{FIXTURE_CLUSTER_ID}_jobs.csv"
+    shutil.copy(FIXTURE, path)
+    monkeypatch.chdir(tmp_path)
+    return str(path)
+
+
+# a synthetic cluster of 2000 jobs where some values are missing or zero, next to the fixture copy
+@pytest.fixture
+def synthetic_csv(fixture_csv):
+    path = os.path.join(os.path.dirname(fixture_csv), "cluster_synthetic_jobs.csv")
+    write_cluster_csv(path, 2000, seed=1)
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    rng = random.Random(1)
+    for row in rows:
+        for name in ("RequestMemory", "ResidentSetSize_RAW", "RequestDisk", "DiskUsage_RAW", "RequestCpus",
+                     "RemoteUserCpu", "RemoteSysCpu", "RemoteWallClockTime"):
+            if rng.random() < 0.05:
+                row[name] = rng.choice(["", "0"])
+    with open(path, "w", newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
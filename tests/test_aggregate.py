@@ -0,0 +1,49 @@
+import re
+import shutil
+import pytest
+import aggregate
+import analytics
+import histogram
+from synthetic import FakeElasticsearch, FIXTURE
+
+CLUSTER_ID = "4421577"
+
+
+# runs the tools in a directory holding a copy of the fixture dump, with aggregate.py served by a fake ES
+@pytest.fixture
+def cluster_dir(tmp_path, monkeypatch):
+    (tmp_path / "cluster_data").mkdir()
+    csv_path = tmp_path / "cluster_data" / f"cluster_{CLUSTER_ID}_jobs.csv"
+    shutil.copy(FIXTURE, csv_path)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(aggregate, "connect_to_elasticsearch", lambda: FakeElasticsearch(str(csv_path)))
+    return tmp_path
+
+
+# the numbers of a report line
+def numbers(line):
+    return [float(value) for value in re.findall(r"-?\d+(?:\.\d+)?", line)]
+
+
+def test_histogram_matches_histogram_py(cluster_dir, capsys):
+    histogram.histogram(CLUSTER_ID, histogram.load_data_for_cluster(CLUSTER_ID))
+    expected = capsys.readouterr().out
+
+    aggregate.main([CLUSTER_ID, "--report", "histogram"])
+    assert capsys.readouterr().out == expected
+
+
+def test_analytics_matches_analytics_py(cluster_dir, capsys):
+    analytics.summarize(CLUSTER_ID)
+    expected = capsys.readouterr().out.splitlines()
+
+    aggregate.main([CLUSTER_ID, "--report", "analytics"])
+    lines = capsys.readouterr().out.splitlines()
+
+    assert len(lines) == len(expected)
+    differing = [(line, want) for line, want in zip(lines, expected) if line != want]
+    # ES percentiles interpolate differently: one quartile of the CPU usage is off by 0.1
+    assert len(differing) <= 1
+    for line, want in differing:
+        assert line.startswith("CPU Usage (%)")
+        assert numbers(line) == pytest.approx(numbers(want), abs=0.1 + 1e-9)
@@ -0,0 +1,81 @@
+import csv
+import statistics
+import numpy as np
+import pytest
+import analytics
+from jobtable import load_table
+from utils import safe_float
+
+
+# the per-row computation the report was written with, each efficiency taken from one job's own values
+def baseline_summary(path):
+    values = {name: [] for name in ("mem_requested", "mem_used", "disk_requested", "disk_used", "cpu_requests",
+                                    "gpu_requests", "runtimes", "mem_eff", "disk_eff", "cpu_eff")}
+    with open(path, newline='', encoding='utf-8') as f:
+        jobs = list(csv.DictReader(f))
+    for job in jobs:
+        mem_req, mem_use = safe_float(job.get("RequestMemory")), safe_float(job.get("ResidentSetSize_RAW"))
+        if mem_req:
+            values["mem_requested"].append(round(mem_req / 1024, 2))
+        if mem_use:
+            values["mem_used"].append(mem_use / 1024 / 1024)
+        if mem_req and mem_use and round(mem_req / 1024, 2):
+            values["mem_eff"].append(mem_use / 1024 / 1024 / round(mem_req / 1024, 2) * 100)
+
+        disk_req, disk_use = safe_float(job.get("RequestDisk")), safe_float(job.get("DiskUsage_RAW"))
+        if disk_req:
+            values["disk_requested"].append(round(disk_req / (1024 * 1024), 2))
+        if disk_use:
+            values["disk_used"].append(disk_use / (1024 * 1024))
+        if disk_req and disk_use and round(disk_req / (1024 * 1024), 2):
+            values["disk_eff"].append(disk_use / (1024 * 1024) / round(disk_req / (1024 * 1024), 2) * 100)
+
+        cpus, gpus = safe_float(job.get("RequestCpus")), safe_float(job.get("RequestGpus"))
+        if cpus:
+            values["cpu_requests"].append(int(cpus))
+        if gpus:
+            values["gpu_requests"].append(int(gpus))
+
+        user_cpu = safe_float(job.get("RemoteUserCpu")) or 0
+        sys_cpu = safe_float(job.get("RemoteSysCpu")) or 0
+        wall_time = safe_float(job.get("RemoteWallClockTime"))
+        if wall_time and cpus and (user_cpu or sys_cpu):
+            values["cpu_eff"].append(sys_cpu / cpus / wall_time * 100)
+        if wall_time:
+            values["runtimes"].append(wall_time)
+    return len(jobs), values
+
+
+# min, Q1, median, Q3, max and stddev the way the per-row report computed them
+def baseline_usage_stats(data):
+    if len(data) < 2:
+        return None
+    quartiles = statistics.quantiles(sorted(data), n=4)
+    return (min(data), quartiles[0], statistics.median(data), quartiles[2], max(data), statistics.stdev(data))
+
+
+@pytest.mark.parametrize("csv_name", ["fixture_csv", "synthetic_csv"])
+def test_summary_matches_the_per_row_computation(csv_name, request):
+    path = request.getfixturevalue(csv_name)
+    total_jobs, expected = baseline_summary(path)
+
+    table = load_table(path, analytics.COLUMNS)
+    metrics = analytics.job_metrics(table, table.rows)
+    summary = analytics.compute_summary(table, table.rows, metrics)
+
+    assert summary["total_jobs"] == total_jobs
+    for name, values in expected.items():
+        assert metrics[name].tolist() == pytest.approx(values, rel=1e-12), name
+    for name in ("mem_requested", "disk_requested", "cpu_requests", "gpu_requests"):
+        assert sorted(summary[name].tolist()) == sorted(expected[name]), name
+
+    assert summary["avg_runtime"] == pytest.approx(statistics.mean(expected["runtimes"]))
+    for name in ("mem_eff", "disk_eff", "cpu_eff"):
+        assert summary[name] == pytest.approx(statistics.median(expected[name])), name
+    for name, data in (("mem_used", "mem_used"), ("disk_used", "disk_used"), ("cpu_usage", "cpu_eff")):
+        assert analytics.usage_stats(summary[name]) == pytest.approx(baseline_usage_stats(expected[data])), name
+
+
+def test_usage_stats_needs_two_values():
+    assert analytics.usage_stats(np.array([1.0])) is None
+    assert analytics.format_usage_row("CPU Usage (%)", None) == f"{'CPU Usage (%)':<25}: Not enough data"
@@ -0,0 +1,82 @@
+import io
+from contextlib import redirect_stdout
+import pytest
+import batch
+import hold_bucket
+import schedd_cache
+import summarise
+from synthetic import FakeSchedd, hold_reasons, write_cluster_csv
+
+
+# cluster_data/ with the fixture and two synthetic clusters, plus one cluster without a CSV
+@pytest.fixture
+def cluster_ids(fixture_csv, tmp_path):
+    ids = ["4421577"]
+    for seed, n in enumerate((500, 900)):
+        ids.append(str(write_cluster_csv(str(tmp_path / "cluster_data" / "tmp.csv"), n, seed=seed)))
+        (tmp_path / "cluster_data" / "tmp.csv").rename(tmp_path / "cluster_data" / f"cluster_{ids[-1]}_jobs.csv")
+    return ids + ["4400001"]
+
+
+# the output of each report run one after the other in this process
+def sequential_outputs(report, cluster_ids):
+    outputs = []
+    for cluster_id in cluster_ids:
+        output = io.StringIO()
+        with redirect_stdout(output):
+            if report == "histogram":
+                import histogram
+                df = histogram.load_data_for_cluster(cluster_id)
+                if df is not None:
+                    histogram.histogram(cluster_id, df, show_fast_jobs=True)
+            else:
+                try:
+                    summarise.summarise(cluster_id)
+                except SystemExit:
+                    pass
+        outputs.append(output.getvalue())
+    return outputs
+
+
+@pytest.mark.parametrize("report", ["histogram", "summarise"])
+def test_pool_output_is_in_input_order_and_matches_sequential_runs(report, cluster_ids, capfd):
+    expected = sequential_outputs(report, cluster_ids)
+    capfd.readouterr()
+
+    results = list(batch.run_batch(report, cluster_ids, 3, {"print_list": True}))
+
+    assert [cluster_id for cluster_id, _, _ in results] == cluster_ids
+    assert [output for _, output, _ in results] == expected
+    assert all(cluster_id in output for cluster_id, output, _ in results[:-1])
+    # nothing escapes the captured output, not even the query.py run for the missing cluster
+    assert capfd.readouterr() == ("", "")
+
+
+def test_histogram_captures_the_query_script_output(cluster_ids, capfd):
+    [(_, output, error)] = batch.run_batch("histogram", cluster_ids[-1:], 1)
+
+    assert error is None
+    assert "[INFO] CSV for ClusterId 4400001 not found" in output
+    assert "[ERROR] query.py failed" in output
+    out, err = capfd.readouterr()
+    assert out == "" and err == ""
+
+
+@pytest.mark.parametrize("no_cache", [False, True])
+def test_hold_bucket_workers_use_the_schedd_factory(no_cache, tmp_path, monkeypatch):
+    schedd = FakeSchedd(4421577, hold_reasons(40), running=5)
+    monkeypatch.setattr(schedd_cache, "_local_schedd", schedd)
+    monkeypatch.setattr(batch, "QueryCache", lambda: schedd_cache.QueryCache(str(tmp_path / "cache.sqlite")))
+
+    results = list(batch.run_batch("hold_bucket", ["4421577"], 1, {"no_cache": no_cache}))
+
+    if no_cache:
+        assert batch._worker["schedd"] is schedd
+    else:
+        assert isinstance(batch._worker["schedd"], schedd_cache.CachedSchedd)
+        assert batch._worker["schedd"].cache.misses == 1
+    expected = io.StringIO()
+    with redirect_stdout(expected):
+        _, reasons_by_code = hold_bucket.group_by_code("4421577", schedd)
+        hold_bucket.bucket_and_print_table(reasons_by_code, "4421577")
+    assert results == [("4421577", expected.getvalue(), None)]
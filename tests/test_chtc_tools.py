@@ -0,0 +1,63 @@
+import sys
+import subprocess
+import pytest
+import chtc_tools
+
+HEAVY = ("pandas", "htcondor", "classad", "elasticsearch")
+
+
+# modules of the given list that importing a tool loads, in a fresh interpreter
+def loaded_modules(module, names):
+    code = f"import sys, {module}; print(' '.join(n for n in {names!r} if n in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=chtc_tools.TOOLS_DIR,
+                            capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+@pytest.mark.parametrize("name", sorted(chtc_tools.SUBCOMMANDS))
+def test_no_subcommand_imports_heavy_dependencies(name):
+    assert loaded_modules(chtc_tools.SUBCOMMANDS[name], HEAVY) == []
+
+
+@pytest.mark.parametrize("module", ["chtc_tools", "daemon", "dashboard", "batch", "store", "query"])
+def test_tools_without_statistics_do_not_import_numpy(module):
+    assert loaded_modules(module, ("numpy",)) == []
+
+
+def test_entry_point_imports_only_the_chosen_subcommand():
+    loaded = loaded_modules("chtc_tools", tuple(chtc_tools.SUBCOMMANDS.values()))
+    assert loaded == ["daemon"]
+
+
+def test_parse_importtime():
+    text = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       120 |        120 |   _io",
+        "import time:      2500 |       4100 | numpy",
+        "Traceback (most recent call last):",
+    ])
+    assert chtc_tools.parse_importtime(text) == [("   _io", 120, 120), (" numpy", 2500, 4100)]
+
+
+def test_startup_report(capsys):
+    chtc_tools.main(["startup", "store", "--top", "2"])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith("store        startup")
+    assert "[WARN]" not in "\n".join(lines)
+    assert len([line for line in lines[1:] if line.strip()]) == 2
+
+
+@pytest.mark.parametrize("argv", [["nope"], ["startup", "nope"], ["startup", "--top"]])
+def test_bad_arguments_exit(argv, capsys):
+    with pytest.raises(SystemExit) as e:
+        chtc_tools.main(argv)
+    assert e.value.code == 1
+
+
+def test_subcommand_runs_as_its_script(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", list(sys.argv))
+    with pytest.raises(SystemExit) as e:
+        chtc_tools.main(["batch", "analytics"])
+    assert e.value.code == 1
+    assert capsys.readouterr().out.startswith("Usage: python batch.py")
+    assert sys.argv == ["chtc-tools batch", "analytics"]
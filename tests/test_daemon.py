@@ -0,0 +1,52 @@
+import os
+import sys
+import subprocess
+import pytest
+import daemon
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(daemon.__file__))
+
+# runs a report script with a stand-in daemon, then prints which heavy modules were imported
+CLIENT = """
+import os, sys, runpy, daemon
+if sys.argv[2] == "daemon":
+    daemon.DEFAULT_SOCKET = os.devnull
+    daemon.send_request = lambda request: {
+        "ok": True, "stdout": "from daemon: " + " ".join([request["report"]] + request["argv"]) + "\\n",
+        "stderr": "", "exit_code": 0}
+script = os.path.join(sys.argv[1], sys.argv[3] + ".py")
+sys.argv = [script] + sys.argv[4:]
+try:
+    runpy.run_path(script, run_name="__main__")
+except SystemExit:
+    pass
+print("loaded:", *[name for name in ("numpy", "tabulate", "jobtable", "store") if name in sys.modules])
+"""
+
+
+# output lines of a report script run through CLIENT
+def run_client(mode, report, *args, cwd):
+    env = {name: value for name, value in os.environ.items() if name != daemon.IN_DAEMON_ENV}
+    env["CHTC_TOOLS_SOCKET"] = os.path.join(str(cwd), "no-daemon.sock")
+    env["PYTHONPATH"] = TOOLS_DIR
+    result = subprocess.run([sys.executable, "-c", CLIENT, TOOLS_DIR, mode, report, *args],
+                            cwd=cwd, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.splitlines()
+
+
+@pytest.mark.parametrize("report", ["analytics", "histogram", "summarise"])
+def test_reports_are_sent_to_the_daemon_before_the_heavy_imports(report, tmp_path):
+    lines = run_client("daemon", report, "4421577", "--profile", cwd=tmp_path)
+    assert lines[0] == f"from daemon: {report} 4421577"
+    assert lines[-1] == "loaded:"
+
+
+@pytest.mark.parametrize("report", ["analytics", "histogram", "summarise"])
+@pytest.mark.parametrize("mode", ["local", "daemon"])
+def test_reports_run_locally_without_a_daemon(mode, report, fixture_csv, tmp_path):
+    args = ["4421577"] + (["--no-daemon"] if mode == "daemon" else [])
+    lines = run_client(mode, report, *args, cwd=tmp_path)
+    assert not any(line.startswith("from daemon") for line in lines)
+    assert any("4421577" in line for line in lines[:-1])
+    assert "numpy" in lines[-1].split()
@@ -0,0 +1,112 @@
+import sys
+import types
+import pytest
+import dashboard
+from synthetic import FakeAd
+
+
+# a schedd with a queue and a history of ads, answering the watcher's queries
+class WatchedSchedd:
+    def __init__(self, queue, history=()):
+        self.queue = list(queue)
+        self.finished = list(history)
+        self.queries = 0
+
+    def query(self, constraint="true", projection=None, limit=-1):
+        self.queries += 1
+        return iter(self.queue)
+
+    def history(self, constraint="true", projection=None, match=-1):
+        return iter(self.finished)
+
+
+# an event of htcondor.JobEventLog
+def event(proc, kind, cluster=7):
+    return types.SimpleNamespace(cluster=cluster, proc=proc, type=types.SimpleNamespace(name=kind))
+
+
+# a JobEventLog whose events are appended by the test, or that fails once broken
+class FakeEventLog:
+    def __init__(self, path):
+        self.path = path
+        self.pending = []
+        self.broken = False
+        FakeEventLog.opened.append(self)
+
+    def events(self, stop_after=None):
+        if self.broken:
+            raise OSError("log rotated away")
+        pending, self.pending = self.pending, []
+        return iter(pending)
+
+
+@pytest.fixture
+def htcondor(monkeypatch):
+    FakeEventLog.opened = []
+    module = types.ModuleType("htcondor")
+    module.JobEventLog = FakeEventLog
+    monkeypatch.setitem(sys.modules, "htcondor", module)
+    return module
+
+
+def queue_ads(log=None, iwd=None):
+    ads = []
+    for proc in range(3):
+        ad = FakeAd(ProcId=proc, JobStatus=1)
+        if log is not None:
+            ad["UserLog"] = log
+        if iwd is not None:
+            ad["Iwd"] = iwd
+        ads.append(ad)
+    return ads
+
+
+def test_watcher_follows_the_event_log(tmp_path, htcondor):
+    (tmp_path / "job.log").write_text("")
+    schedd = WatchedSchedd(queue_ads("job.log", str(tmp_path)), [FakeAd(JobStatus=4)])
+    watcher = dashboard.ClusterWatcher(7, dashboard.JOB_STATES, schedd)
+    log, = FakeEventLog.opened
+    assert log.path == str(tmp_path / "job.log")
+
+    log.pending = [event(0, "EXECUTE"), event(1, "JOB_HELD"), event(2, "EXECUTE", cluster=8)]
+    watcher.refresh()
+    counts = watcher.counts()
+    assert (counts["Idle"], counts["Running"], counts["Held"], counts["Completed"]) == (1, 1, 1, 1)
+    assert schedd.queries == 1
+
+
+def test_watcher_polls_when_the_log_breaks(tmp_path, htcondor):
+    (tmp_path / "job.log").write_text("")
+    schedd = WatchedSchedd(queue_ads("job.log", str(tmp_path)))
+    watcher = dashboard.ClusterWatcher(7, dashboard.JOB_STATES, schedd)
+
+    FakeEventLog.opened[0].broken = True
+    schedd.queue[0]["JobStatus"] = 2
+    watcher.refresh()
+    assert watcher.event_log is None
+    assert watcher.counts()["Running"] == 1
+    assert schedd.queries == 2
+
+
+@pytest.mark.parametrize("log, with_iwd", [("missing.log", True), ("job.log", False), (None, False)])
+def test_watcher_polls_without_a_usable_log(tmp_path, htcondor, log, with_iwd):
+    (tmp_path / "job.log").write_text("")
+    schedd = WatchedSchedd(queue_ads(log, str(tmp_path) if with_iwd else None))
+    watcher = dashboard.ClusterWatcher(7, dashboard.JOB_STATES, schedd)
+    assert watcher.event_log is None and not FakeEventLog.opened
+
+    schedd.queue = schedd.queue[1:]
+    schedd.finished = [FakeAd(ProcId=0, JobStatus=4)]
+    watcher.refresh()
+    assert watcher.counts()["Completed"] == 1
+
+
+def test_watcher_polls_when_the_log_cannot_be_opened(tmp_path, htcondor):
+    (tmp_path / "job.log").write_text("")
+
+    def unreadable(path):
+        raise PermissionError(13, "Permission denied", path)
+
+    htcondor.JobEventLog = unreadable
+    watcher = dashboard.ClusterWatcher(7, dashboard.JOB_STATES, WatchedSchedd(queue_ads("job.log", str(tmp_path))))
+    assert watcher.event_log is None
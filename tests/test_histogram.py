@@ -0,0 +1,69 @@
+import csv
+import re
+import numpy as np
+import pytest
+import histogram
+from jobtable import load_table
+
+
+# the binning the histogram was written with: one mask per bin, [left, right) and [left, right] for the last
+def baseline_bins(runtimes, percentiles=10):
+    bin_edges = np.percentile(runtimes, np.linspace(0, 100, percentiles + 1))
+    counts, _ = np.histogram(runtimes, bins=bin_edges)
+    members, medians = [], []
+    for i in range(len(counts)):
+        left, right = bin_edges[i], bin_edges[i + 1]
+        in_bin = (runtimes >= left) & (runtimes <= right) if i == len(counts) - 1 else (runtimes >= left) & (runtimes < right)
+        members.append(np.flatnonzero(in_bin).tolist())
+        medians.append(np.median(runtimes[in_bin]) if in_bin.any() else 0)
+    return bin_edges, counts, np.array(medians), members
+
+
+def runtime_sets(fixture_csv):
+    fixture = load_table(fixture_csv, ["RemoteWallClockTime"])["RemoteWallClockTime"].astype(float)
+    rng = np.random.default_rng(0)
+    return {
+        "fixture": fixture,
+        "lognormal": rng.lognormal(7, 2, 5000).round(),
+        "ties": rng.choice([5.0, 5.0, 5.0, 60.0, 600.0, 3600.0], 1000),
+        "one job": np.array([42.0]),
+    }
+
+
+@pytest.mark.parametrize("percentiles", [1, 4, 10, 25])
+def test_bins_match_the_baseline_binning(fixture_csv, percentiles):
+    for name, runtimes in runtime_sets(fixture_csv).items():
+        edges, counts, medians, members = baseline_bins(runtimes, percentiles)
+        bins = histogram.percentile_bins(runtimes, percentiles)
+
+        assert bins["edges"].tolist() == edges.tolist(), name
+        assert bins["counts"].tolist() == [len(m) for m in members], name
+        assert bins["counts"].tolist() == counts.tolist(), name
+        assert bins["medians"].tolist() == pytest.approx(medians.tolist()), name
+        order, starts = bins["order"], bins["starts"]
+        assert [order[starts[i]:starts[i + 1]].tolist() for i in range(percentiles)] == members, name
+
+
+# the job counts of the printed bins
+def printed_counts(output):
+    return [int(line.split()[-1]) for line in output.splitlines() if re.match(r"\d\d–\d\d+%", line)]
+
+
+def test_jobs_without_runtime_are_left_out_in_both_modes(fixture_csv, capsys):
+    with open(fixture_csv, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    for row in rows[::10]:
+        row["RemoteWallClockTime"] = ""
+    with open(fixture_csv, "w", newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    with_runtime = len(rows) - len(rows[::10])
+
+    histogram.histogram("4421577", load_table(fixture_csv, histogram.COLUMNS).to_frame())
+    in_memory = printed_counts(capsys.readouterr().out)
+    histogram.histogram_streaming("4421577", fixture_csv, chunk_size=100)
+    streamed = printed_counts(capsys.readouterr().out)
+
+    assert len(in_memory) == len(streamed) == 10
+    assert sum(in_memory) == sum(streamed) == with_runtime
@@ -0,0 +1,57 @@
+from difflib import SequenceMatcher
+import pytest
+import hold_bucket
+from synthetic import FakeSchedd, hold_reasons
+
+
+# the original bucketing: compares every reason with the first reason of every bucket
+def baseline_buckets(reason_list, subcodes, threshold=0.7):
+    buckets = []
+    for reason, subcode in zip(reason_list, subcodes):
+        for bucket in buckets:
+            if SequenceMatcher(None, reason, bucket[0][0]).ratio() >= threshold:
+                bucket.append((reason, subcode))
+                break
+        else:
+            buckets.append([(reason, subcode)])
+    return buckets
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_bucketing_matches_the_baseline(seed):
+    reasons = hold_reasons(150, seed=seed)
+    reason_list = [reason for reason, _, _ in reasons]
+    subcodes = [subcode for _, _, subcode in reasons]
+
+    buckets = hold_bucket.bucket_reasons_with_subcodes(reason_list, subcodes, threshold=0.7)
+    assert buckets == baseline_buckets(reason_list, subcodes, threshold=0.7)
+    assert len(buckets) > 1
+
+
+# records the queries made to the schedd
+class RecordingSchedd(FakeSchedd):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def query(self, constraint="true", projection=None, limit=-1):
+        self.calls.append((constraint, projection, limit))
+        return super().query(constraint, projection, limit)
+
+    xquery = query
+
+
+def test_group_by_code_makes_one_projected_query():
+    reasons = hold_reasons(300)
+    schedd = RecordingSchedd(4421577, reasons, running=50)
+
+    total, reasons_by_code = hold_bucket.group_by_code(4421577, schedd)
+
+    assert schedd.calls == [("ClusterId == 4421577",
+                             ["JobStatus", "HoldReasonCode", "HoldReason", "HoldReasonSubCode"], -1)]
+    assert total == 350
+    expected = {}
+    for reason, code, subcode in reasons:
+        expected.setdefault(code, []).append((hold_bucket.clean_reason(reason), subcode))
+    assert reasons_by_code == expected
+    assert sum(len(entries) for entries in reasons_by_code.values()) == 300
@@ -0,0 +1,59 @@
+import sqlite3
+import hold_bucket
+import hold_templates
+from daemon import LRUCache
+from hold_templates import TemplateCache
+from synthetic import hold_reasons
+
+
+# buckets the reasons of every code through the cache, like hold_bucket.py does
+def bucket_all(cache, reasons):
+    by_code = {}
+    for reason, code, subcode in reasons:
+        by_code.setdefault(code, ([], []))
+        by_code[code][0].append(reason)
+        by_code[code][1].append(subcode)
+    return {code: hold_bucket.bucket_with_templates(code, reason_list, subcodes, cache)
+            for code, (reason_list, subcodes) in by_code.items()}
+
+
+def test_lookups_do_not_hold_the_write_lock(tmp_path):
+    path = str(tmp_path / "templates.sqlite")
+    reasons = hold_reasons(200)
+    with TemplateCache(path) as cache:
+        first = bucket_all(cache, reasons)
+        assert not cache.db.in_transaction
+
+    with TemplateCache(path) as cache:
+        assert bucket_all(cache, reasons) == first
+        assert cache.misses == 0 and cache.hits > 0
+        assert not cache.db.in_transaction
+        # another process can write while this one is still open
+        other = sqlite3.connect(path, timeout=0)
+        other.execute("INSERT INTO counters (name, value) VALUES ('other', 1)")
+        other.commit()
+        other.close()
+        used = dict(cache.db.execute("SELECT normalized, last_used FROM reasons"))
+
+    db = sqlite3.connect(path)
+    for normalized, last_used in db.execute("SELECT normalized, last_used FROM reasons"):
+        assert last_used > used[normalized]
+    db.close()
+
+
+def test_memory_cache_entries_do_not_outlive_an_eviction(tmp_path, monkeypatch):
+    path = str(tmp_path / "templates.sqlite")
+    monkeypatch.setattr(hold_templates, "_memory_cache", LRUCache())
+
+    with TemplateCache(path, max_entries=1) as cache:
+        old = cache.add_template(13, "old reason")
+        cache.remember(13, "old reason", old)
+        cache.commit()
+    # another process adds a newer reason; closing it evicts the old one and its template
+    with TemplateCache(path, max_entries=1) as other:
+        new = other.add_template(13, "new reason")
+        other.remember(13, "new reason", new)
+
+    with TemplateCache(path, max_entries=1) as cache:
+        assert cache.lookup(13, "old reason") is None
+        assert cache.lookup(13, "new reason") == new
@@ -0,0 +1,42 @@
+import csv
+import numpy as np
+import histogram
+from jobcache import iter_column_chunks
+
+
+# writes a small cluster CSV whose chunks would each infer a different dtype on their own
+def write_csv(path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ClusterId", "ProcId", "Owner", "RemoteWallClockTime", "QDate", "CompletionDate", "Custom"])
+        for proc in range(9):
+            cluster = "123.0" if proc >= 6 else "123"          # the last chunk was dumped as floats
+            owner = "1000" if proc in (3, 4, 5) else "alice"   # the middle chunk looks numeric
+            custom = "" if proc == 4 else str(proc)            # the middle chunk has a missing value
+            writer.writerow([cluster, proc, owner, 60 * (proc + 1), 1700000000, 1700000000 + 600, custom])
+
+
+def test_chunks_keep_the_dtype_of_their_column(tmp_path):
+    path = str(tmp_path / "cluster_123_jobs.csv")
+    write_csv(path)
+    chunks = list(iter_column_chunks(path, ["ClusterId", "ProcId", "Owner", "Custom"], chunk_size=3))
+
+    assert [rows for _, rows in chunks] == [3, 3, 3]
+    for columns, _ in chunks:
+        assert columns["ClusterId"].dtype == np.int64
+        assert columns["ProcId"].dtype == np.int64
+        assert columns["Owner"].dtype.kind == "U"
+    assert chunks[1][0]["Owner"].tolist() == ["1000"] * 3
+    assert chunks[2][0]["ClusterId"].tolist() == [123] * 3
+    # a missing value can only be held as NaN
+    assert chunks[0][0]["Custom"].dtype == np.int64
+    assert np.isnan(chunks[1][0]["Custom"][1])
+
+
+def test_streaming_histogram_prints_integer_job_ids(tmp_path, capsys):
+    path = str(tmp_path / "cluster_123_jobs.csv")
+    write_csv(path)
+    histogram.histogram_streaming("123", path, percentiles=2, show_fast_jobs=True, chunk_size=3)
+    out = capsys.readouterr().out
+    ids = out.split("List of Job IDs with median runtime < 10 minutes:\n")[1].strip()
+    assert ids == ", ".join(f"123.{proc}" for proc in range(9))
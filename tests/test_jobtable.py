@@ -0,0 +1,48 @@
+import csv
+import numpy as np
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from jobcache import TextColumn
+from jobtable import load_table
+
+COLUMNS = ["ProcId", "Owner", "LastRemoteHost", "RemoteWallClockTime", "RequestMemory"]
+
+
+# a table's columns as plain lists, loaded in a worker process
+def load_in_worker(path):
+    table = load_table(path, COLUMNS)
+    return {name: table[name].tolist() for name in table}
+
+
+def test_columns_match_the_csv(fixture_csv):
+    table = load_table(fixture_csv, COLUMNS + ["NoSuchColumn"])
+    with open(fixture_csv, newline='', encoding='utf-8') as f:
+        jobs = list(csv.DictReader(f))
+
+    assert list(table) == COLUMNS and len(table) == table.rows == len(jobs)
+    assert table["ProcId"].tolist() == [int(job["ProcId"]) for job in jobs]
+    assert table["Owner"].tolist() == [job["Owner"] or None for job in jobs]
+    assert table.labels("Owner")[table.codes("Owner")].tolist() == table["Owner"].tolist()
+    assert table.get("NoSuchColumn") is None
+    with pytest.raises(TypeError):
+        table.codes("ProcId")
+
+    frame = table.to_frame(["Owner", "RemoteWallClockTime"])
+    assert frame["Owner"].dtype == "category"
+    assert frame["Owner"].astype(object).where(frame["Owner"].notna(), None).tolist() == table["Owner"].tolist()
+
+
+def test_columns_are_read_only_maps_of_the_cache(fixture_csv):
+    table = load_table(fixture_csv, COLUMNS)
+    for values in table.columns.values():
+        parts = [values.codes, values.offsets, values.blob] if isinstance(values, TextColumn) else [values]
+        for part in parts:
+            assert isinstance(part, np.memmap) and not part.flags.writeable
+    assert table.nbytes < 64 * table.rows
+
+
+def test_worker_processes_load_the_same_table(fixture_csv):
+    load_table(fixture_csv, COLUMNS)
+    expected = load_in_worker(fixture_csv)
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        assert list(pool.map(load_in_worker, [fixture_csv] * 4)) == [expected] * 4
@@ -0,0 +1,98 @@
+import io
+import os
+import sys
+import json
+import threading
+import subprocess
+import pytest
+import profiling
+from profiling import span
+
+
+# profiling state of a fresh run, restored afterwards (finish() at exit then does nothing)
+@pytest.fixture
+def state(monkeypatch):
+    state = {"enabled": False, "start": None, "spans": [], "stack": [], "trace": None, "cprofile": None}
+    monkeypatch.setattr(profiling, "_state", state)
+    return state
+
+
+@pytest.mark.parametrize("argv, options, rest", [
+    (["tool.py", "1"], {}, ["tool.py", "1"]),
+    (["tool.py", "--profile", "1"], {"--profile": True}, ["tool.py", "1"]),
+    (["tool.py", "1", "--profile-trace", "t.json"], {"--profile-trace": "t.json"}, ["tool.py", "1"]),
+    (["tool.py", "--profile-cprofile=p.out", "x"], {"--profile-cprofile": "p.out"}, ["tool.py", "x"]),
+    (["tool.py", "--profile-trace"], {"--profile-trace": True}, ["tool.py"]),
+])
+def test_split_flags(argv, options, rest):
+    assert profiling.split_flags(argv) == (options, rest)
+
+
+def test_spans_are_free_until_profiling_is_enabled(state):
+    argv = ["tool.py", "1"]
+    assert profiling.setup_from_argv(argv) is argv and argv == ["tool.py", "1"]
+    with span("load", rows=3) as s:
+        s.rows = 5
+    assert isinstance(s, profiling._NullSpan)
+    assert not profiling.enabled() and state["spans"] == []
+
+
+def test_spans_nest_and_add_up(state):
+    argv = ["tool.py", "--profile", "1"]
+    profiling.setup_from_argv(argv)
+    assert argv == ["tool.py", "1"] and profiling.enabled()
+
+    for rows in (10, 20):
+        with span("fetch"):
+            with span("parse") as s:
+                s.rows = rows
+    with span("render"):
+        thread = threading.Thread(target=lambda: span("worker").__enter__())
+        thread.start()
+        thread.join()
+
+    stages = profiling.summarize_spans(state["spans"])
+    assert list(stages) == [("fetch",), ("fetch", "parse"), ("render",)]
+    assert stages[("fetch",)]["calls"] == 2 and stages[("fetch",)]["rows"] is None
+    assert stages[("fetch", "parse")]["rows"] == 30
+    assert stages[("fetch",)]["seconds"] >= stages[("fetch", "parse")]["seconds"]
+
+    out = io.StringIO()
+    profiling.print_report(out)
+    lines = out.getvalue().splitlines()
+    assert [line.split()[0] for line in lines[3:6]] == ["fetch", "parse", "render"]
+    assert lines[4].startswith("  parse") and lines[4].split()[4] == "30"
+    assert lines[-1].startswith("total")
+
+
+def test_trace_holds_every_span(state, tmp_path):
+    profiling.enable()
+    with span("fetch", rows=4):
+        with span("parse"):
+            pass
+    path = tmp_path / "trace.json"
+    profiling.write_trace(str(path))
+
+    events = json.loads(path.read_text())["traceEvents"]
+    assert [(e["name"], e["cat"], e["args"]["rows"]) for e in events] == [
+        ("parse", "fetch", None), ("fetch", "tool", 4)]
+    assert all(e["ph"] == "X" and e["dur"] >= 0 for e in events)
+
+
+def test_profile_flags_of_a_tool(fixture_csv, tmp_path):
+    trace = tmp_path / "trace.json"
+    stats = tmp_path / "profile.out"
+    result = subprocess.run(
+        [sys.executable, os.path.join(os.path.dirname(profiling.__file__), "summarise.py"), "4421577",
+         "--profile", "--profile-trace", str(trace), f"--profile-cprofile={stats}"],
+        capture_output=True, text=True, cwd=tmp_path)
+
+    assert result.returncode == 0, result.stderr
+    assert "--profile" not in result.stdout and "Stage" not in result.stdout
+    stages = [line.split()[0] for line in result.stderr.splitlines() if line.startswith(("load", "render"))]
+    assert stages == ["load", "render"]
+    assert "top functions by cumulative time" in result.stderr
+    assert stats.stat().st_size > 0
+    events = json.loads(trace.read_text())["traceEvents"]
+    assert [e["name"] for e in events if e["cat"] == "tool"] == ["load", "render"]
+    assert {e["cat"] for e in events} >= {"tool", "load"}
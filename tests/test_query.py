@@ -0,0 +1,99 @@
+import os
+import csv
+import tempfile
+import pytest
+import query
+from utils import sample_csv_path
+from synthetic import FakeElasticsearch, FIXTURE
+
+
+# runs query.main in a temporary directory against a fake ES serving the fixture; returns the CSV rows
+def run_query(tmp_path, monkeypatch, argv, es=None):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(query, "connect_to_elasticsearch", lambda: es or FakeElasticsearch(FIXTURE))
+    query.main(argv)
+    csv_path, = (tmp_path / "cluster_data").glob("*.csv")
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        return next(reader), [row for row in reader if row]
+
+
+def test_sliced_dump_equals_single_scroll(tmp_path, monkeypatch):
+    (tmp_path / "single").mkdir()
+    (tmp_path / "sliced").mkdir()
+    single_header, single_rows = run_query(tmp_path / "single", monkeypatch, ["4421577"])
+    sliced_header, sliced_rows = run_query(tmp_path / "sliced", monkeypatch, ["4421577", "--slices", "4"])
+
+    assert len(single_rows) == 748
+    assert sliced_header == single_header
+    # the slices are written one after the other, so only the order of the rows differs
+    assert sorted(sliced_rows) == sorted(single_rows)
+
+
+def test_user_dump_only_has_the_jobs_of_the_user(tmp_path, monkeypatch):
+    header, rows = run_query(tmp_path, monkeypatch, ["4421577", "mad"])
+    assert [row[header.index("Owner")] for row in rows] == ["mad"]
+
+
+def test_budget_stops_at_max_results(tmp_path, monkeypatch):
+    monkeypatch.setattr(query, "MAX_RESULTS", 100)
+    _, rows = run_query(tmp_path, monkeypatch, ["4421577", "--slices", "4", "--page-size", "30"])
+    assert len(rows) == 100
+
+
+def test_fetch_to_spills_limit_is_shared_between_slices():
+    es = FakeElasticsearch(FIXTURE)
+    spills = [tempfile.TemporaryFile("w+") for _ in range(3)]
+    total, _ = query.fetch_to_spills(es, query.build_query(4421577), spills, page_size=25, limit=60)
+    written = 0
+    for spill in spills:
+        spill.seek(0)
+        written += sum(1 for _ in spill)
+        spill.close()
+    assert total == written == 60
+    assert es.scrolls == {}
+
+
+# fails every scroll after the first page
+class FailingElasticsearch(FakeElasticsearch):
+    def scroll(self, scroll_id, scroll=None):
+        raise ConnectionError("connection lost")
+
+
+@pytest.mark.parametrize("slices", [1, 4])
+def test_scrolls_are_cleared_on_error(slices):
+    es = FailingElasticsearch(FIXTURE)
+    spills = [tempfile.TemporaryFile("w+") for _ in range(slices)]
+    with pytest.raises(ConnectionError):
+        query.fetch_to_spills(es, query.build_query(4421577), spills, page_size=50)
+    for spill in spills:
+        spill.close()
+    assert es.next_id == slices
+    assert es.scrolls == {}
+
+
+def test_coerce_types_keeps_values_that_are_not_whole_numbers():
+    typed = query.coerce_types({"ProcId": "7", "JobStatus": 4.0, "RequestCpus": "1.7",
+                                "QDate": "inf", "RequestMemory": float("inf"), "Owner": "alice"})
+    assert typed == {"ProcId": 7, "JobStatus": 4, "RequestCpus": "1.7",
+                     "QDate": "inf", "RequestMemory": float("inf"), "Owner": "alice"}
+    assert isinstance(typed["JobStatus"], int)
+
+
+def test_incremental_without_a_dump_falls_back_to_a_full_dump(tmp_path, monkeypatch, capsys):
+    _, rows = run_query(tmp_path, monkeypatch, ["4421577", "--incremental"])
+    out = capsys.readouterr().out
+    assert "falling back to a full dump" in out
+    assert ">= None" not in out
+    assert len(rows) == 748
+
+
+def test_sample_is_written_where_the_reports_read_it(tmp_path, monkeypatch):
+    _, rows = run_query(tmp_path, monkeypatch, ["4421577", "--sample", "50"])
+    assert len(rows) == 50
+    assert os.path.exists(sample_csv_path("4421577", str(tmp_path / "cluster_data")))
+
+
+def test_sample_of_a_user_is_rejected(tmp_path, monkeypatch):
+    with pytest.raises(SystemExit):
+        run_query(tmp_path, monkeypatch, ["4421577", "jgasick", "--sample", "50"])
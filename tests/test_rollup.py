@@ -0,0 +1,92 @@
+import json
+import numpy as np
+import pytest
+import rollup
+from analytics import COLUMNS, SummarySketch, job_metrics
+from jobcache import iter_column_chunks
+from synthetic import write_cluster_csv
+
+SIZES = (3000, 4000, 5000)
+
+
+# data directory with three synthetic clusters of different sizes
+@pytest.fixture
+def data_dir(tmp_path):
+    cluster_ids = []
+    for seed, n in enumerate(SIZES):
+        cluster_id = write_cluster_csv(str(tmp_path / "tmp.csv"), n, seed=seed)
+        (tmp_path / "tmp.csv").rename(rollup.csv_path_for(cluster_id, str(tmp_path)))
+        cluster_ids.append(str(cluster_id))
+    return str(tmp_path), cluster_ids
+
+
+# exact per-job metrics of every job of the clusters, concatenated
+def exact_metrics(data_dir, cluster_ids):
+    parts = []
+    for cluster_id in cluster_ids:
+        for columns, rows in iter_column_chunks(rollup.csv_path_for(cluster_id, data_dir), COLUMNS, 10 ** 6):
+            parts.append(job_metrics(columns, rows))
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def test_rebuilt_sketches_match_the_saved_ones(data_dir):
+    path, cluster_ids = data_dir
+    cluster_id = cluster_ids[0]
+    first, _ = rollup.rollup([cluster_id], data_dir=path)
+    with open(rollup.summary_path_for(cluster_id, path), encoding="utf-8") as f:
+        saved = json.load(f)
+
+    # read back from the saved file, then rebuilt from the unchanged CSV
+    second, _ = rollup.rollup([cluster_id], data_dir=path)
+    rebuilt = rollup.build_group_sketches(rollup.csv_path_for(cluster_id, path))
+    rollup.save_group_sketches(cluster_id, rebuilt, saved["source"], path)
+    with open(rollup.summary_path_for(cluster_id, path), encoding="utf-8") as f:
+        assert json.load(f) == saved
+    third, _ = rollup.rollup([cluster_id], data_dir=path)
+
+    assert first.to_dict() == second.to_dict() == third.to_dict()
+
+
+def test_old_summary_files_are_rebuilt(data_dir):
+    path, cluster_ids = data_dir
+    cluster_id = cluster_ids[0]
+    rollup.rollup([cluster_id], data_dir=path)
+    summary_path = rollup.summary_path_for(cluster_id, path)
+    with open(summary_path, encoding="utf-8") as f:
+        data = json.load(f)
+    data["version"] = rollup.SUMMARY_VERSION - 1
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+    assert rollup.read_summary_file(cluster_id, path) is None
+    rollup.load_group_sketches(cluster_id, path)
+    assert rollup.read_summary_file(cluster_id, path)["version"] == rollup.SUMMARY_VERSION
+
+
+def test_merged_clusters_match_one_sketch_of_all_jobs(data_dir):
+    path, cluster_ids = data_dir
+    merged, used = rollup.rollup(cluster_ids, data_dir=path)
+    metrics = exact_metrics(path, cluster_ids)
+    single = SummarySketch()
+    single.update(metrics, sum(SIZES))
+
+    assert used == cluster_ids
+    assert merged.total_jobs == single.total_jobs == sum(SIZES)
+    assert merged.runtime.count == single.runtime.count
+    assert merged.runtime.mean == pytest.approx(single.runtime.mean)
+    assert merged.requests == single.requests
+
+    qs = np.linspace(0.05, 0.95, 19)
+    for name in SummarySketch.USAGE:
+        assert merged.stats[name].count == single.stats[name].count
+        assert merged.stats[name].mean == pytest.approx(single.stats[name].mean)
+        assert merged.stats[name].std() == pytest.approx(single.stats[name].std())
+    for name, sketch in merged.quantiles.items():
+        values = np.sort(metrics[name][~np.isnan(metrics[name])])
+        assert sketch.count == len(values)
+        assert sketch.min == values[0] and sketch.max == values[-1]
+        # rank error of a KLL sketch with k = 200 is about 1%; allow twice that
+        for estimate in (sketch.quantiles(qs), single.quantiles[name].quantiles(qs)):
+            low = np.searchsorted(values, estimate, side="left") / len(values)
+            high = np.searchsorted(values, estimate, side="right") / len(values)
+            assert np.all(low <= qs + 0.02) and np.all(high >= qs - 0.02), name
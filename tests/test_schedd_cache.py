@@ -0,0 +1,148 @@
+import sys
+import enum
+import types
+import pytest
+import schedd_cache
+from schedd_cache import QueryCache, CachedSchedd
+from synthetic import FakeAd
+
+
+# stands in for time.time() in schedd_cache
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+# a schedd whose ads can be changed between queries, counting the queries it answers
+class CountingSchedd:
+    def __init__(self, ads):
+        self.ads = ads
+        self.queries = 0
+
+    def query(self, constraint="true", projection=None, limit=-1):
+        self.queries += 1
+        return [FakeAd(ad) for ad in self.ads]
+
+    def history(self, constraint="true", projection=None, match=-1):
+        self.queries += 1
+        return []
+
+
+@pytest.fixture
+def classad(monkeypatch):
+    module = types.ModuleType("classad")
+    module.Value = enum.Enum("Value", "Error Undefined")
+    monkeypatch.setitem(sys.modules, "classad", module)
+    return module
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(schedd_cache, "time", types.SimpleNamespace(time=clock))
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    with QueryCache(str(tmp_path / "cache.sqlite")) as cache:
+        yield cache
+
+
+def test_undefined_values_are_kept(cache, classad):
+    ads = [{"ProcId": 0, "JobStatus": 5, "HoldReasonSubCode": classad.Value.Undefined,
+            "Requirements": classad.Value.Error, "Nested": object()}]
+    schedd = CachedSchedd(cache, CountingSchedd(ads))
+    projection = ["ProcId", "JobStatus", "HoldReasonSubCode", "Requirements", "Nested", "Missing"]
+
+    for _ in range(2):
+        [ad] = schedd.query("true", projection)
+        assert ad.eval("HoldReasonSubCode") is classad.Value.Undefined
+        assert ad.get("Requirements") is classad.Value.Error
+        assert ad.eval("JobStatus") == 5 and ad.get("ProcId") == 0
+        assert "HoldReasonSubCode" in ad and "Nested" not in ad and "Missing" not in ad
+        assert ad.get("Missing", "default") == "default"
+        with pytest.raises(KeyError):
+            ad.eval("Missing")
+    assert (cache.misses, cache.hits) == (1, 1)
+
+
+def test_results_expire_after_the_ttl(cache, clock):
+    source = CountingSchedd([{"ProcId": 0, "JobStatus": 1}])
+    schedd = CachedSchedd(cache, source, ttl=60)
+
+    assert schedd.query("true", ["JobStatus"])[0].eval("JobStatus") == 1
+    source.ads[0]["JobStatus"] = 2
+    clock.now += 60
+    assert schedd.query("true", ["JobStatus"])[0].eval("JobStatus") == 1
+    clock.now += 1
+    assert schedd.query("true", ["JobStatus"])[0].eval("JobStatus") == 2
+    assert source.queries == 2
+    assert (cache.hits, cache.stale_hits, cache.misses) == (1, 0, 2)
+
+
+def test_stale_results_are_served_while_they_are_refreshed(cache, clock):
+    source = CountingSchedd([{"ProcId": 0, "JobStatus": 1}])
+    schedd = CachedSchedd(cache, source, ttl=60, stale_while_revalidate=120)
+    other = CachedSchedd(cache, source, ttl=60, stale_while_revalidate=120)
+
+    schedd.query("true", ["JobStatus"])
+    source.ads[0]["JobStatus"] = 2
+    clock.now += 100
+    assert schedd.query("true", ["JobStatus"])[0].eval("JobStatus") == 1
+    schedd.wait()
+    assert source.queries == 2
+    assert schedd.query("true", ["JobStatus"])[0].eval("JobStatus") == 2
+
+    # only one refresh runs at a time for an entry
+    source.ads[0]["JobStatus"] = 3
+    clock.now += 100
+    key = schedd.key("query", "true", ["JobStatus"], -1)
+    assert cache.claim_refresh(key)
+    assert other.query("true", ["JobStatus"])[0].eval("JobStatus") == 2
+    assert other.refreshers == []
+
+    # past the stale window the schedd is queried again
+    clock.now += 200
+    assert schedd.query("true", ["JobStatus"])[0].eval("JobStatus") == 3
+    assert (cache.hits, cache.stale_hits, cache.misses) == (1, 2, 2)
+    assert source.queries == 3
+
+
+def test_least_recently_used_results_are_evicted(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    ads = [{"HoldReason": "x" * 100}]
+    size = len(schedd_cache.json.dumps(ads))
+    with QueryCache(path, max_bytes=3 * size) as cache:
+        for key in "abcd":
+            cache.put(key, ads)
+            clock.now += 1
+        cache.get("a")
+
+    with QueryCache(path, max_entries=2) as cache:
+        assert [key for key in "abcd" if cache.get(key) is not None] == ["a", "c", "d"]
+        assert cache.stats()["bytes"] == 3 * size
+        clock.now += 1
+        cache.get("d")
+        clock.now += 1
+        cache.get("a")
+
+    with QueryCache(path) as cache:
+        assert [key for key in "abcd" if cache.get(key) is not None] == ["a", "d"]
+
+
+def test_hit_and_miss_counts_are_kept_across_runs(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    source = CountingSchedd([{"ProcId": 0, "JobStatus": 1}])
+    for run in range(3):
+        with QueryCache(path) as cache:
+            schedd = CachedSchedd(cache, source)
+            schedd.query("true", ["JobStatus"])
+            schedd.history("true", ["JobStatus"])
+            stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 0)
+    assert (stats["total_hits"], stats["total_misses"], stats["total_stale_hits"]) == (4, 2, 0)
+    assert (stats["entries"], source.queries) == (2, 2)
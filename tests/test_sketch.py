@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+import analytics
+import histogram
+from sketch import KLLSketch, DEFAULT_K
+
+
+def test_sketch_is_exact_below_the_compaction_threshold():
+    values = np.random.default_rng(0).lognormal(5, 2, DEFAULT_K)
+    sketch = KLLSketch()
+    for chunk in np.array_split(values, 7):
+        sketch.update(chunk)
+    assert sketch.size() == DEFAULT_K
+    qs = np.linspace(0, 1, 41)
+    assert sketch.quantiles(qs).tolist() == np.quantile(values, qs, method="inverted_cdf").tolist()
+
+
+def test_same_values_give_the_same_sketch():
+    values = np.random.default_rng(1).lognormal(5, 2, 20000)
+    first, second = KLLSketch(), KLLSketch()
+    for sketch in (first, second):
+        for chunk in np.array_split(values, 13):
+            sketch.update(chunk)
+    assert first.to_dict() == second.to_dict()
+    assert KLLSketch.from_dict(first.to_dict()).to_dict() == first.to_dict()
+
+
+def test_streamed_reports_are_reproducible(synthetic_csv, monkeypatch, capsys):
+    monkeypatch.setattr(analytics, "cluster_csv_path", lambda cluster_id: synthetic_csv)
+    outputs = []
+    for _ in range(2):
+        analytics.summarize_streaming("synthetic", chunk_size=300)
+        histogram.histogram_streaming("synthetic", synthetic_csv, show_fast_jobs=True, chunk_size=300)
+        outputs.append(capsys.readouterr().out)
+    assert outputs[0] == outputs[1]
+    assert "Not enough data" not in outputs[0]
@@ -0,0 +1,118 @@
+import sys
+import subprocess
+import numpy as np
+import pytest
+import store
+from jobtable import load_table
+from store import JobStore, typed_value, where_clause, store_filters_from_argv, load_report_table
+
+COLUMNS = ["ProcId", "Owner", "LastRemoteHost", "RemoteWallClockTime", "CompletionDate", "RequestMemory"]
+
+
+# a job store holding the fixture cluster, used as the default store
+@pytest.fixture
+def job_store(fixture_csv, tmp_path, monkeypatch):
+    path = str(tmp_path / "store" / "jobs.sqlite")
+    monkeypatch.setattr(store, "DEFAULT_PATH", path)
+    with JobStore() as job_store:
+        job_store.ingest(store.read_csv_jobs(fixture_csv))
+    return path
+
+
+# the columns of a table as lists sorted by ProcId, NaN and missing text as None
+def sorted_columns(table):
+    order = np.argsort(table["ProcId"], kind="stable")
+    columns = {}
+    for name in table:
+        values = table[name][order].tolist()
+        columns[name] = [None if value is None or value != value else value for value in values]
+    return columns
+
+
+@pytest.mark.parametrize("convert, value, expected", [
+    (int, "42", 42), (int, "42.0", 42), (int, 7.0, 7), (int, "2.5", 2.5), (int, 0.25, 0.25),
+    (int, "", None), (int, None, None), (int, "abc", None), (int, "nan", None), (int, "inf", None),
+    (float, "1.5", 1.5), (float, "x", None), (str, 12, "12"),
+])
+def test_typed_value(convert, value, expected):
+    result = typed_value(convert, value)
+    assert result == expected and type(result) is type(expected)
+
+
+def test_where_clause():
+    assert where_clause() == ("", [])
+    clause, params = where_clause(cluster_ids=["1", 2], owner="alice", host="m1", since=10.0, until=20.0)
+    assert clause == (" WHERE ClusterId IN (?, ?) AND Owner = ? AND (LastRemoteHost = ? OR LastRemoteMachine = ?)"
+                      " AND CompletionDate >= ? AND CompletionDate < ?")
+    assert params == [1, 2, "alice", "m1", "m1", 10.0, 20.0]
+
+
+def test_store_filters_from_argv():
+    argv = ["analytics.py", "4421577", "--store", "--owner", "alice", "--host=m1", "--since", "100", "true"]
+    assert store_filters_from_argv(argv) == {"owner": "alice", "host": "m1", "since": 100.0}
+    assert argv == ["analytics.py", "4421577", "true"]
+
+    argv = ["analytics.py", "4421577"]
+    assert store_filters_from_argv(argv) is None and argv == ["analytics.py", "4421577"]
+
+
+def test_store_filters_need_store(capsys):
+    with pytest.raises(SystemExit) as e:
+        store_filters_from_argv(["analytics.py", "4421577", "--owner", "alice"])
+    assert e.value.code == 1
+    assert "--owner can only be used with --store" in capsys.readouterr().out
+
+
+def test_report_table_matches_the_filtered_csv(job_store, fixture_csv):
+    csv_table = load_table(fixture_csv, COLUMNS)
+    owners, counts = np.unique([o for o in csv_table["Owner"] if o is not None], return_counts=True)
+    owner = str(owners[counts.argmax()])
+    completion = csv_table["CompletionDate"].astype(np.float64)
+    since = float(np.nanmedian(completion))
+
+    argv = ["analytics.py", "4421577", "--store", "--owner", owner, "--since", str(since)]
+    filters = store_filters_from_argv(argv)
+    table = load_report_table(argv[1], COLUMNS, filters)
+
+    mask = np.array([o == owner for o in csv_table["Owner"]]) & (completion >= since)
+    assert 0 < table.rows == int(mask.sum()) < csv_table.rows
+    expected = sorted_columns(csv_table)
+    keep = [i for i, job in enumerate(np.argsort(csv_table["ProcId"], kind="stable")) if mask[job]]
+    assert sorted_columns(table) == {name: [values[i] for i in keep] for name, values in expected.items()}
+
+    assert load_report_table("all", COLUMNS, filters).rows == table.rows
+
+
+def test_report_table_of_all_jobs_matches_the_csv(job_store, fixture_csv):
+    table = load_report_table("4421577", COLUMNS, {})
+    assert sorted_columns(table) == sorted_columns(load_table(fixture_csv, COLUMNS))
+
+
+@pytest.mark.parametrize("cluster_id, filters", [("4421577", {"owner": "nobody"}), ("123", {})])
+def test_report_table_without_matching_jobs_exits(job_store, cluster_id, filters, capsys):
+    with pytest.raises(SystemExit) as e:
+        load_report_table(cluster_id, COLUMNS, filters)
+    assert e.value.code == 1
+    assert f"No jobs in the job store match ClusterId {cluster_id}" in capsys.readouterr().out
+
+
+def test_missing_store_exits(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(store, "DEFAULT_PATH", str(tmp_path / "missing.sqlite"))
+    with pytest.raises(SystemExit):
+        load_report_table("4421577", COLUMNS, {})
+    assert "No job store at" in capsys.readouterr().out
+
+
+def test_default_store_is_in_the_user_cache():
+    code = "import store; print(store.DEFAULT_PATH)"
+    env = {"HOME": "/home/someone", "PATH": "/usr/bin"}
+    result = subprocess.run([sys.executable, "-c", code], cwd=store.__file__.rsplit("/", 1)[0],
+                            env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "/home/someone/.cache/chtc-tools/jobs.sqlite"
+
+
+def test_query_imports_the_store_only_with_store():
+    code = "import sys, query; print(' '.join(m for m in ('store', 'sqlite3') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=store.__file__.rsplit("/", 1)[0],
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
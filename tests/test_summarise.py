@@ -0,0 +1,68 @@
+import csv
+import pytest
+from tabulate import tabulate
+import summarise
+from jobcache import read_meta
+from utils import safe_float
+
+
+# the original report: every row read into a dict, each selected value converted on its own
+def baseline_report(path, cluster_id, selected_params):
+    with open(path, newline='', encoding='utf-8') as f:
+        jobs = list(csv.DictReader(f))
+    data = []
+    for job in jobs:
+        row = {"ProcId": job.get("ProcId")}
+        for param in selected_params:
+            raw_val = job.get(param)
+            val = safe_float(raw_val)
+            if val is None:
+                val = raw_val
+            elif "RAW" in param:
+                val = val / 1024
+            row[param] = val
+        data.append(row)
+    return (f"\nSummary for ClusterId: {cluster_id}\nTotal Jobs: {len(data)}\n\n"
+            + tabulate(data, headers="keys", tablefmt="grid", floatfmt=".2f") + "\n")
+
+
+@pytest.mark.parametrize("csv_fixture, cluster_id", [("fixture_csv", "4421577"), ("synthetic_csv", "synthetic")])
+@pytest.mark.parametrize("params", [
+    summarise.DEFAULT_PARAMS,
+    ["Owner", "ResidentSetSize_RAW", "DiskUsage_RAW", "LastRemoteHost"],
+    ["RequestMemory", "ExitCode", "JobStatus"],
+])
+def test_report_matches_the_per_row_baseline(csv_fixture, cluster_id, params, request, capsys):
+    path = request.getfixturevalue(csv_fixture)
+    summarise.summarise(cluster_id, params)
+    assert capsys.readouterr().out == baseline_report(path, cluster_id, params)
+
+
+def test_only_the_selected_columns_are_parsed(fixture_csv, capsys):
+    summarise.summarise("4421577", ["RequestCpus", "ResidentSetSize_RAW"])
+    capsys.readouterr()
+    assert set(read_meta(fixture_csv)["columns"]) == {"ProcId", "RequestCpus", "ResidentSetSize_RAW"}
+
+    summarise.summarise("4421577", ["Owner"])
+    assert set(read_meta(fixture_csv)["columns"]) == {"ProcId", "RequestCpus", "ResidentSetSize_RAW", "Owner"}
+
+
+def test_convert_column_matches_convert_value(synthetic_csv):
+    names, table, rows = summarise.load_job_columns("synthetic", ["ResidentSetSize_RAW", "Owner", "RequestDisk"])
+    with open(synthetic_csv, newline='', encoding='utf-8') as f:
+        jobs = list(csv.DictReader(f))
+    assert rows == len(jobs)
+    for param in names[1:]:
+        expected = [summarise.convert_value(param, job[param]) if job[param] != "" else None for job in jobs]
+        assert summarise.convert_column(param, table.get(param), rows) == expected
+
+
+@pytest.mark.parametrize("cluster_id, params, message", [
+    ("4421577", ["NoSuchAttribute"], "were not found in the CSV data: NoSuchAttribute"),
+    ("123", summarise.DEFAULT_PARAMS, "File not found: cluster_data/cluster_123_jobs.csv"),
+])
+def test_bad_input_exits(fixture_csv, cluster_id, params, message, capsys):
+    with pytest.raises(SystemExit) as e:
+        summarise.summarise(cluster_id, params)
+    assert e.value.code == 1
+    assert message in capsys.readouterr().out
@@ -1,5 +1,56 @@
+import os
+
+
 def safe_float(val):
     try:
         return float(val)
     except (ValueError, TypeError):
         return None
+
+
+# path of the sample CSV of a cluster (written by query.py --sample, see sampling.py)
+def sample_csv_path(cluster_id, folder):
+    return os.path.join(folder, f"cluster_{cluster_id}_sample_jobs.csv")
+
+
+# columns of the cluster CSV read by each report
+REPORT_COLUMNS = {
+    "analytics": [
+        "RequestMemory", "ResidentSetSize_RAW", "RequestDisk", "DiskUsage_RAW",
+        "RequestCpus", "RequestGpus", "RemoteUserCpu", "RemoteSysCpu", "RemoteWallClockTime",
+    ],
+    "histogram": ["ClusterId", "ProcId", "RemoteWallClockTime", "QDate", "CompletionDate"],
+    "summarise": [
+        "ProcId", "RequestCpus", "CpusProvisioned", "RemoteSysCpu",
+        "RemoteUserCpu", "RemoteWallClockTime", "ResidentSetSize_RAW",
+    ],
+    "rollup": ["Owner", "AcctGroup", "AcctGroupUser"],
+}
+
+# union of the columns the reports need, in a stable order
+REPORT_FIELDS = sorted({name for columns in REPORT_COLUMNS.values() for name in columns})
+
+# type each known ClassAd attribute is written with
+FIELD_TYPES = {
+    "ClusterId": int,
+    "ProcId": int,
+    "JobStatus": int,
+    "QDate": int,
+    "CompletionDate": int,
+    "EnteredCurrentStatus": int,
+    "RequestCpus": int,
+    "RequestGpus": int,
+    "RequestMemory": int,
+    "RequestDisk": int,
+    "CpusProvisioned": int,
+    "ResidentSetSize_RAW": int,
+    "DiskUsage_RAW": int,
+    "RemoteWallClockTime": float,
+    "RemoteUserCpu": float,
+    "RemoteSysCpu": float,
+    "Owner": str,
+    "AcctGroup": str,
+    "AcctGroupUser": str,
+    "GlobalJobId": str,
+    "LastRemoteHost": str,
+}